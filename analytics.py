@@ -0,0 +1,356 @@
+"""
+analytics.py
+------------
+Volume integration of the recorded flow channels and reconciliation with the
+meter totaliser registers, on NumPy arrays.
+
+This module provides:
+- SeriesLoader: loads a recording (every segment, compressed or not) into
+  arrays: t (int64, wall clock epoch seconds as ts_to_epoch()) and values
+  (float64, rows x columns, NaN for empty cells). Closed segments are parsed
+  once and cached as "<segment>.npy" (one structured array, larger than a
+  compressed segment): the caches share a cache_bytes budget, the least
+  recently used ones are deleted beyond it, and retention deletes a cache
+  with its segment. The active file is parsed incrementally (only the rows
+  appended since the last load).
+- integrate(): gap-aware trapezoidal integration, optionally per bucket.
+- reconcile(): integrated volume vs totaliser increase over the same span.
+- summary(): the per channel figures of the analytics panel.
+
+Integration follows the rollups: an interval longer than max_gap seconds
+(acquisition stopped) is a gap and is not integrated, and an interval
+belongs to the bucket of its closing sample. Flows are per unit_seconds
+(3600 for m3/h), so volumes come out in the totaliser unit (m3).
+"""
+
+import glob
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import logging
+import numpy as np
+
+from recordings import (COMPRESSED_SUFFIXES, HEADER_PREFIX, Recording, RecordingStore,
+                        _open_compressed, epoch_to_ts, segment_base, ts_to_epoch)
+
+logger = logging.getLogger(__name__)
+
+_HEADER = HEADER_PREFIX.encode()
+
+
+# ──────────────────────────────────────────────────────────────
+# Parsing
+# ──────────────────────────────────────────────────────────────
+def _empty(ncols: int) -> Tuple[np.ndarray, np.ndarray]:
+    return np.empty(0, dtype=np.int64), np.empty((0, ncols), dtype=np.float64)
+
+
+def _to_float(cell: bytes) -> float:
+    try:
+        return float(cell)
+    except ValueError:
+        return float("nan")
+
+
+def _parse_slow(lines: List[bytes], ncols: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row by row parsing: skips malformed rows, pads/truncates the value cells."""
+    t, values = [], []
+    for line in lines:
+        ts, _, rest = line.partition(b",")
+        try:
+            epoch = ts_to_epoch(ts.decode("ascii"))
+        except (ValueError, UnicodeDecodeError):
+            continue
+        cells = [_to_float(c) for c in rest.split(b",")[:ncols]]
+        t.append(epoch)
+        values.append(cells + [float("nan")] * (ncols - len(cells)))
+    if not t:
+        return _empty(ncols)
+    return np.array(t, dtype=np.int64), np.array(values, dtype=np.float64)
+
+
+def parse_rows(data: bytes, ncols: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(t, values) of raw recording bytes; a trailing partial line is ignored."""
+    lines = data.split(b"\n")
+    lines.pop()  # empty after the last newline, or a partial line
+    if lines and lines[0].startswith(_HEADER):
+        del lines[0]
+    if not lines:
+        return _empty(ncols)
+    try:
+        # fixed width timestamps: one vectorised conversion
+        t = np.array(lines, dtype="S19").astype("datetime64[s]").astype(np.int64)
+        cells = b",".join([line[20:] for line in lines]).split(b",")
+        if len(cells) != len(lines) * ncols:
+            raise ValueError("irregular number of columns")
+    except ValueError:
+        return _parse_slow(lines, ncols)
+    raw = np.array(cells)
+    try:
+        values = raw.astype(np.float64)
+    except ValueError:  # empty cells (value not read) and the like
+        values = np.array([_to_float(c) for c in cells], dtype=np.float64)
+    return t, values.reshape(-1, ncols)
+
+
+# ──────────────────────────────────────────────────────────────
+# Loading
+# ──────────────────────────────────────────────────────────────
+class _ActiveCache:
+    """Rows of an active file parsed so far."""
+    def __init__(self, first_ts: Optional[str], ncols: int):
+        self.first_ts = first_ts
+        self.offset = 0
+        self.t, self.values = _empty(ncols)
+
+
+class SeriesLoader:
+    """Recordings of a RecordingStore as NumPy arrays.
+
+    cache_bytes bounds the .npy caches of the closed segments on disk
+    (0: no cache, every query parses the segments).
+    """
+    def __init__(self, recordings: RecordingStore, cache_bytes: int = 256_000_000):
+        self.recordings = recordings
+        self.cache_bytes = cache_bytes
+        self._active: Dict[str, _ActiveCache] = {}
+        # cache path -> size, least recently used first (scanned on first use)
+        self._caches: Optional["OrderedDict[str, int]"] = None
+        self._lock = threading.Lock()
+
+    def _known_caches(self) -> "OrderedDict[str, int]":
+        if self._caches is None:
+            found = []
+            for cache in glob.glob(os.path.join(glob.escape(self.recordings.data_path), "*.npy")):
+                try:
+                    st = os.stat(cache)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, cache, st.st_size))
+            self._caches = OrderedDict((cache, size) for _, cache, size in sorted(found))
+            self._trim()
+        return self._caches
+
+    def _trim(self, keep: Optional[str] = None) -> None:
+        """Delete the least recently used caches (except `keep`) beyond cache_bytes."""
+        caches = self._caches
+        # caches deleted with their segment (retention, delete) no longer count
+        for path in [path for path in caches if not os.path.exists(path)]:
+            del caches[path]
+        total = sum(caches.values())
+        while total > self.cache_bytes and caches and next(iter(caches)) != keep:
+            path, size = caches.popitem(last=False)
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _store_cache(self, cache: str, rows: np.ndarray) -> None:
+        """Write a segment cache, then delete the least recently used ones beyond cache_bytes."""
+        caches = self._known_caches()
+        if rows.nbytes > self.cache_bytes:
+            return
+        tmp = f"{cache}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.save(f, rows)
+            os.replace(tmp, cache)
+            caches[cache] = os.path.getsize(cache)
+            caches.move_to_end(cache)
+        except OSError as e:
+            logger.warning(f"Cannot cache {os.path.basename(cache)}: {e}")
+            return
+        self._trim(keep=cache)
+
+    def _closed(self, path: str, ncols: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Arrays of a closed segment, from its .npy cache (built on first use)."""
+        base = segment_base(path)
+        cache = f"{base}.npy"
+        caches = self._known_caches()
+        try:
+            rows = np.load(cache)
+            if rows.dtype.names == ("t", "values") and rows["values"].shape[1:] == (ncols,):
+                caches[cache] = caches.get(cache, rows.nbytes)
+                caches.move_to_end(cache)
+                return rows["t"], rows["values"]
+        except (FileNotFoundError, ValueError, OSError):
+            pass
+        # the segment may have been compressed since it was listed
+        for candidate in [path, base] + [base + suffix for suffix in COMPRESSED_SUFFIXES.values()]:
+            try:
+                f = _open_compressed(candidate) if candidate != base else open(candidate, "rb")
+                with f:
+                    data = f.read()
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            return _empty(ncols)
+        t, values = parse_rows(data, ncols)
+        rows = np.empty(len(t), dtype=[("t", np.int64), ("values", np.float64, (ncols,))])
+        rows["t"], rows["values"] = t, values
+        self._store_cache(cache, rows)
+        return t, values
+
+    def _active_arrays(self, rec: Recording, ncols: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Arrays of the active file; only the bytes appended since the last call are parsed."""
+        first_ts = rec.active.first_ts()
+        cached = self._active.get(rec.file)
+        try:
+            size = os.path.getsize(rec.path)
+        except FileNotFoundError:
+            size = 0
+        if (cached is None or cached.first_ts != first_ts or size < cached.offset
+                or cached.values.shape[1] != ncols):
+            cached = self._active[rec.file] = _ActiveCache(first_ts, ncols)
+        if size > cached.offset:
+            with open(rec.path, "rb") as f:
+                f.seek(cached.offset)
+                data = f.read(size - cached.offset)
+            complete = data.rfind(b"\n") + 1
+            t, values = parse_rows(data[:complete], ncols)
+            cached.offset += complete
+            if len(t):
+                cached.t = np.concatenate((cached.t, t))
+                cached.values = np.concatenate((cached.values, values))
+        return cached.t, cached.values
+
+    def load(self, file: str, start: Optional[str] = None, end: Optional[str] = None
+             ) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """(t, values, columns) of a recording for start <= timestamp < end."""
+        rec = self.recordings.get(file)
+        columns = rec.columns()
+        ncols = len(columns)
+        segments = rec.closed_segments()
+        active_first = rec.active.first_ts()
+        starts = [ts for ts, _ in segments[1:]] + [active_first]
+        parts = []
+        with self._lock:
+            for (seg_start, path), next_start in zip(segments, starts):
+                if end is not None and seg_start >= end:
+                    break
+                if start is not None and next_start is not None and next_start < start:
+                    continue  # segment entirely before the range
+                parts.append(self._closed(path, ncols))
+            if end is None or active_first is None or active_first < end:
+                parts.append(self._active_arrays(rec, ncols))
+        if not parts:
+            return (*_empty(ncols), columns)
+        t = np.concatenate([p[0] for p in parts])
+        values = np.concatenate([p[1] for p in parts])
+        lo = 0 if start is None else np.searchsorted(t, ts_to_epoch(start), side="left")
+        hi = len(t) if end is None else np.searchsorted(t, ts_to_epoch(end), side="left")
+        return t[lo:hi], values[lo:hi], columns
+
+    def column(self, file: str, column: str, start: Optional[str] = None,
+               end: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(t, x) of one column of a recording."""
+        t, values, columns = self.load(file, start, end)
+        if column not in columns:
+            raise ValueError(f"{file} has no column '{column}' (columns: {columns})")
+        return t, values[:, columns.index(column)]
+
+
+# ──────────────────────────────────────────────────────────────
+# Integration / reconciliation
+# ──────────────────────────────────────────────────────────────
+def integrate(t: np.ndarray, x: np.ndarray, max_gap: float = 300.0, unit_seconds: float = 3600.0,
+              bucket: Optional[int] = None) -> Dict:
+    """Gap-aware trapezoidal integral of a flow x(t) (per unit_seconds).
+
+    Intervals longer than max_gap, not increasing, or with a missing end
+    value are not integrated. With `bucket` (seconds), "buckets" lists the
+    volume of each bucket holding integrated intervals.
+    """
+    result = {"samples": int(len(t)), "volume": 0.0, "covered_seconds": 0.0,
+              "span_seconds": 0.0, "coverage": None, "gaps": 0, "gap_seconds": 0.0,
+              "mean_flow": None}
+    if bucket:
+        result["buckets"] = []
+    if len(t) < 2:
+        return result
+    dt = np.diff(t).astype(np.float64)
+    area = dt * (x[1:] + x[:-1]) * 0.5
+    ok = (dt > 0) & (dt <= max_gap) & np.isfinite(area)
+    gaps = dt > max_gap
+    covered = float(dt[ok].sum())
+    integral = float(area[ok].sum())
+    span = float(t[-1] - t[0])
+    result.update(volume=integral / unit_seconds, covered_seconds=covered, span_seconds=span,
+                  coverage=covered / span if span > 0 else None,
+                  gaps=int(gaps.sum()), gap_seconds=float(dt[gaps].sum()),
+                  mean_flow=integral / covered if covered > 0 else None)
+    if bucket and ok.any():
+        # t is sorted: each bucket is one run of keys
+        keys = t[1:][ok] // bucket
+        firsts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+        volumes = np.add.reduceat(area[ok], firsts) / unit_seconds
+        result["buckets"] = [{"bucket": epoch_to_ts(int(k) * bucket), "volume": float(v)}
+                             for k, v in zip(keys[firsts], volumes)]
+    return result
+
+
+def totaliser_increase(t: np.ndarray, total: np.ndarray) -> Dict:
+    """Increase of a totaliser series; decreases (resets, rollovers) are counted, not subtracted."""
+    keep = np.isfinite(total)
+    t, total = t[keep], total[keep]
+    if len(t) < 2:
+        return {"increase": None, "resets": 0, "start": None, "end": None}
+    d = np.diff(total)
+    resets = d < 0
+    return {"increase": float(d[~resets].sum()), "resets": int(resets.sum()),
+            "start": epoch_to_ts(int(t[0])), "end": epoch_to_ts(int(t[-1]))}
+
+
+def reconcile(t_flow: np.ndarray, flow: np.ndarray, t_total: np.ndarray, total: np.ndarray,
+              max_gap: float = 300.0, unit_seconds: float = 3600.0) -> Dict:
+    """Integrated flow vs totaliser increase over the span both series cover."""
+    if len(t_flow) < 2 or len(t_total) < 2:
+        return {"integrated": None, "totaliser": None, "difference": None, "relative": None}
+    lo, hi = max(t_flow[0], t_total[0]), min(t_flow[-1], t_total[-1])
+    f = (t_flow >= lo) & (t_flow <= hi)
+    k = (t_total >= lo) & (t_total <= hi)
+    integrated = integrate(t_flow[f], flow[f], max_gap, unit_seconds)
+    counted = totaliser_increase(t_total[k], total[k])
+    result = {"integrated": integrated["volume"], "totaliser": counted["increase"],
+              "resets": counted["resets"], "start": counted["start"], "end": counted["end"],
+              "coverage": integrated["coverage"], "difference": None, "relative": None}
+    if counted["increase"] is not None:
+        result["difference"] = integrated["volume"] - counted["increase"]
+        if counted["increase"]:
+            result["relative"] = result["difference"] / counted["increase"]
+    return result
+
+
+def _split_ref(ref: str, default_column: str) -> Tuple[str, str]:
+    """"file.csv:column" (or "file.csv") → (file, column)."""
+    file, _, column = ref.partition(":")
+    return file, column or default_column
+
+
+def summary(loader: SeriesLoader, channels: Sequence[Dict], start: Optional[str] = None,
+            end: Optional[str] = None, max_gap: float = 300.0, unit_seconds: float = 3600.0,
+            bucket: Optional[int] = None) -> List[Dict]:
+    """Volume (and reconciliation when a totaliser is given) of each channel.
+
+    channels: {"label", "file", "column" (default "value"), "totaliser": "file:column" (optional)}
+    """
+    rows = []
+    for channel in channels:
+        row = {"label": channel.get("label", channel["file"]), "file": channel["file"],
+               "column": channel.get("column", "value")}
+        try:
+            t, x = loader.column(channel["file"], row["column"], start, end)
+            row.update(integrate(t, x, max_gap, unit_seconds, bucket))
+            if channel.get("totaliser"):
+                file, column = _split_ref(channel["totaliser"], "net_total")
+                t_total, total = loader.column(file, column, start, end)
+                row["reconciliation"] = reconcile(t, x, t_total, total, max_gap, unit_seconds)
+        except Exception as e:
+            logger.error(f"Analytics of {channel['file']} failed: {e}")
+            row["error"] = str(e)
+        rows.append(row)
+    return rows
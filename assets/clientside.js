@@ -0,0 +1,34 @@
+// assets/clientside.js
+// Clientside callbacks (namespace "tuf"), registered with app.clientside_callback in tufGuiDash.py
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+  tuf: {
+    // record buttons: green when their task runs (state pushed over the socket)
+    buttonStyles: function (taskState, taskIds, styles) {
+      // window.tufTaskState may be ahead of the store if the socket was faster than the renderer
+      var state = window.tufTaskState || taskState || {};
+      return styles.map(function (style, i) {
+        var color = state[taskIds[i]] ? "lightgreen" : "lightgray";
+        return Object.assign({}, style, {backgroundColor: color});
+      });
+    },
+
+    // key, composite and record buttons: sent over the socket, no Dash request;
+    // the generation lets the server reject presses of a page older than a key reload
+    sendKey: function (keyClicks, compositeClicks, recClicks, generation) {
+      var triggered = window.dash_clientside.callback_context.triggered;
+      if (!triggered || !triggered.length || !triggered[0].value) {
+        return window.dash_clientside.no_update;
+      }
+      var propId = triggered[0].prop_id;
+      var id = JSON.parse(propId.slice(0, propId.lastIndexOf(".")));
+      if (id.type === "rec-btn") {
+        window.tufSend("action_key", {index: id.index, generation: generation});
+      } else if (id.type === "composite") {
+        window.tufSend("composite_key", {index: id.index, generation: generation});
+      } else {
+        window.tufSend("key_press", {group: id.group, index: id.index, generation: generation});
+      }
+      return window.dash_clientside.no_update;
+    }
+  }
+});
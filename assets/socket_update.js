@@ -1,10 +1,76 @@
 // assets/socket_update.js
+// Socket.IO link with the server:
+// - 'update_element' : text content of a status element
+// - 'task_state'     : {active: [task ids]} on connect, then {task_id, active} on each change;
+//                      kept in window.tufTaskState and copied to the "task-state" store
+//                      (record button colors are computed clientside)
+// - 'keypad_busy'    : {holder: socket id or null}; the keypad is busy when another page holds it
+// - tufSend()        : emits a key press (acknowledgement round-trip shown with ui: key_latency)
+window.tufTaskState = {};
+
+function pushTaskState() {
+  if (window.dash_clientside && window.dash_clientside.set_props) {
+    window.dash_clientside.set_props("task-state", {data: Object.assign({}, window.tufTaskState)});
+  }
+}
+
+var ackLatencies = [];
+window.tufSend = function (event, data) {
+  var socket = window.tufSocket;
+  if (!socket) {
+    return;
+  }
+  var t0 = performance.now();
+  socket.emit(event, data, function (ack) {
+    // readout only present with ui: key_latency: true in config.yaml
+    var latency = document.getElementById("socket-latency");
+    if (latency) {
+      var ms = performance.now() - t0;
+      ackLatencies.push(ms);
+      if (ackLatencies.length > 50) {
+        ackLatencies.shift();
+      }
+      var sorted = ackLatencies.slice().sort(function (a, b) { return a - b; });
+      var median = sorted[Math.floor(sorted.length / 2)];
+      latency.textContent = "key ack: " + ms.toFixed(1) + " ms (median " + median.toFixed(1) +
+                            " ms over " + ackLatencies.length + ")";
+    }
+    // a message, or an empty one clearing the target (e.g. a previous refusal)
+    if (ack && (ack.message || ack.target_id)) {
+      var element = document.getElementById(ack.target_id || "response");
+      if (element) {
+        element.textContent = ack.message || "";
+      }
+    }
+  });
+};
+
 document.addEventListener("DOMContentLoaded", function() {
   var socket = io.connect(location.protocol + '//' + document.domain + ':' + location.port);
+  window.tufSocket = socket;
   socket.on('update_element', function (data) {
     const element = document.getElementById(data.target_id);
     if (element) {
       element.textContent = data.content;
     }
   });
+  socket.on('keypad_busy', function (data) {
+    var busy = !!data.holder && data.holder !== socket.id;
+    document.body.classList.toggle("keypad-busy", busy);
+    var status = document.getElementById("keypad-status");
+    if (status) {
+      status.textContent = busy ? "Keypad in use by another operator" : "";
+    }
+  });
+  socket.on('task_state', function (data) {
+    if (data.active instanceof Array) {
+      window.tufTaskState = {};
+      data.active.forEach(function (id) { window.tufTaskState[id] = true; });
+    } else if (data.active) {
+      window.tufTaskState[data.task_id] = true;
+    } else {
+      delete window.tufTaskState[data.task_id];
+    }
+    pushTaskState();
+  });
 });
\ No newline at end of file
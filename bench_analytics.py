@@ -0,0 +1,82 @@
+# bench_analytics.py
+# Volume integration of one year of 10 s flow samples (3.15 M rows, daily
+# segments as written with rotate: daily): cold query (parse every segment,
+# build the .npy caches), warm query (caches on disk), query without caches
+# (cache_bytes: 0), and the original row by row float() + trapezoid loop for
+# comparison. A query is a load plus a gap-aware integration with daily buckets.
+#
+#   python bench_analytics.py [days]
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from analytics import SeriesLoader, integrate
+from recordings import RecordingStore, _ts_to_stamp
+
+
+def write_year(data_path, days):
+    """Daily segments of 10 s samples ending with the active file."""
+    t0 = np.datetime64("2025-01-01T00:00:00")
+    for day in range(days):
+        t = t0 + np.timedelta64(day, "D") + np.arange(0, 86400, 10).astype("timedelta64[s]")
+        epoch = t.astype(np.int64)
+        flow = 10 + 5 * np.sin(epoch / 3600.0)
+        stamps = np.char.replace(np.datetime_as_string(t, unit="s"), "T", " ")
+        name = "flow.csv" if day == days - 1 else f"flow.csv.{_ts_to_stamp(str(stamps[0]))}"
+        with open(os.path.join(data_path, name), "w") as f:
+            f.writelines(f"{s},{v:.4f}\n" for s, v in zip(stamps, flow))
+
+
+def legacy_integrate(path_list, max_gap=300.0):
+    """Row by row integration, as the offline scripts did."""
+    volume, prev = 0.0, None
+    for path in path_list:
+        with open(path) as f:
+            for line in f:
+                ts, _, value = line.rstrip("\n").partition(",")
+                t = time.mktime(time.strptime(ts, "%Y-%m-%d %H:%M:%S"))
+                x = float(value)
+                if prev is not None and 0 < t - prev[0] <= max_gap:
+                    volume += (t - prev[0]) * (x + prev[1]) / 2
+                prev = (t, x)
+    return volume / 3600
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+    with tempfile.TemporaryDirectory() as data_path:
+        t = time.perf_counter()
+        write_year(data_path, days)
+        print(f"generated {days} days of 10 s samples in {time.perf_counter() - t:.1f} s")
+
+        def query(loader):
+            t = time.perf_counter()
+            tt, x = loader.column("flow.csv", "value")
+            result = integrate(tt, x, bucket=86400)
+            return time.perf_counter() - t, tt, result
+
+        elapsed, tt, result = query(SeriesLoader(RecordingStore(data_path)))
+        print(f"cold query (parse, build .npy caches)   {elapsed:8.3f} s, {len(tt)} rows")
+        caches = [os.path.join(data_path, name) for name in os.listdir(data_path) if name.endswith(".npy")]
+        segments = [os.path.join(data_path, name) for name in os.listdir(data_path) if name.startswith("flow.csv.")
+                    and not name.endswith((".npy", ".idx"))]
+        print(f"  caches {sum(map(os.path.getsize, caches)) / 1e6:.1f} MB "
+              f"for {sum(map(os.path.getsize, segments)) / 1e6:.1f} MB of uncompressed segments")
+
+        # cold active file, warm segment caches
+        loader = SeriesLoader(RecordingStore(data_path))
+        elapsed = min(query(loader)[0] for _ in range(5))
+        print(f"warm query (caches on disk)             {elapsed:8.3f} s, volume {result['volume']:.3f} m3")
+
+        elapsed = query(SeriesLoader(RecordingStore(data_path), cache_bytes=0))[0]
+        print(f"query without caches (cache_bytes: 0)   {elapsed:8.3f} s")
+
+        rec = loader.recordings.get("flow.csv")
+        paths = [path for _, path in rec.closed_segments()][:30] + [rec.path]
+        t = time.perf_counter()
+        legacy_integrate(paths)
+        per_row = (time.perf_counter() - t) / (len(paths) * 8640)
+        print(f"legacy row by row loop, extrapolated {per_row * len(tt):8.3f} s")
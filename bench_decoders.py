@@ -0,0 +1,68 @@
+# bench_decoders.py
+# Microbenchmarks: historical decode_modbus_registers() vs the precompiled
+# decoders registry (single value and block decoding).
+#
+#   python bench_decoders.py [nb_values]
+import struct
+import sys
+import timeit
+import random
+
+from decoders import decode_registers, decode_block, np
+
+
+def legacy_decode(registers, fmt="REAL4"):
+    """Original implementation of modbus_worker.decode_modbus_registers."""
+    if not registers:
+        return None
+    raw = b"".join(r.to_bytes(2, "little") for r in registers)
+
+    if fmt == "REAL4":      # 32-bit float
+        return round(struct.unpack("<f", raw[:4])[0], 4)
+    elif fmt == "LONG":     # 32-bit signed int
+        return struct.unpack("<i", raw[:4])[0]
+    elif fmt == "INTEGER":  # single 16-bit int
+        return registers[0]
+    elif fmt == "REAL8":    # 64-bit float
+        return struct.unpack("<d", raw[:8])[0]
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+
+
+def make_block(nb_values):
+    raw = struct.pack(f"<{nb_values}f", *(random.uniform(0, 100) for _ in range(nb_values)))
+    return list(struct.unpack(f"<{2 * nb_values}H", raw))
+
+
+def bench(label, stmt, number):
+    best = min(timeit.repeat(stmt, number=number, repeat=5))
+    print(f"{label:<42} {best / number * 1e6:10.2f} µs/call")
+    return best / number
+
+
+if __name__ == "__main__":
+    nb_values = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    block = make_block(nb_values)
+    pair = block[:2]
+
+    # sanity check: both implementations agree
+    for i in range(nb_values):
+        assert legacy_decode(block[2 * i:2 * i + 2]) == decode_registers(block[2 * i:2 * i + 2])
+    assert decode_block(block, "REAL4") == [legacy_decode(block[2 * i:2 * i + 2]) for i in range(nb_values)]
+
+    print("single REAL4 value")
+    t_old = bench("  legacy decode_modbus_registers", lambda: legacy_decode(pair), 100000)
+    t_new = bench("  decoders.decode_registers", lambda: decode_registers(pair), 100000)
+    print(f"  speedup x{t_old / t_new:.2f}")
+
+    print(f"block of {nb_values} REAL4 values")
+    t_old = bench("  legacy, one call per value",
+                  lambda: [legacy_decode(block[i:i + 2]) for i in range(0, len(block), 2)], 2000)
+    t_new = bench("  decoders.decode_block", lambda: decode_block(block, "REAL4"), 2000)
+    print(f"  speedup x{t_old / t_new:.2f}")
+    if np is not None:
+        t_np = bench("  decoders.decode_block(numpy=True)",
+                     lambda: decode_block(block, "REAL4", numpy=True), 2000)
+        print(f"  speedup x{t_old / t_np:.2f}")
+    else:
+        print("  numpy not installed: vectorised path skipped")
@@ -0,0 +1,89 @@
+# bench_dispatch.py
+# Microbenchmarks of the per-sample dispatch overhead of ModbusWorker.execute_task:
+# callback name lookup (registry scan vs reverse index) and a full
+# read + decode + callback cycle against an in-memory client.
+#
+#   python bench_dispatch.py [nb_registered_callbacks]
+import sys
+import time
+import timeit
+import logging
+
+from callbacks import CALLBACK_REGISTRY, get_callback_name, register_callback
+from decoders import decode_registers
+from modbus_worker import Task, ModbusWorker
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+class _Response:
+    registers = [0, 16320]  # 1.5 as REAL4
+
+    def isError(self):
+        return False
+
+
+class MemoryClient:
+    """Client answering every read instantly."""
+    def read_holding_registers(self, address, count, device_id=1):
+        return _Response()
+
+
+def legacy_get_callback_name(func):
+    """Original linear scan of CALLBACK_REGISTRY."""
+    for name, registered_func in CALLBACK_REGISTRY.items():
+        if registered_func is func:
+            return name
+    return None
+
+
+def legacy_execute(client, task):
+    """Per-sample work of the original execute_task (lookups included)."""
+    mod = task.modbus_param
+    op = mod.get("op")
+    addr = int(mod.get("addr"))
+    nbreg = int(mod.get("nbreg", 1))
+    fmt = mod.get("format", "INTEGER")
+    if op == "read":
+        response = client.read_holding_registers(address=addr, count=nbreg, device_id=1)
+        value = decode_registers(response.registers, fmt)
+        logger.debug(f"modbus read holding register; addr= {addr}, count={nbreg},value:{value}")
+    ts = time.strftime("%Y-%m-%d %H:%M:%S")
+    if callable(task.callback):
+        logger.debug(f"[ execute_task] calling callback {legacy_get_callback_name(task.callback)}, task_id:{task.task_id},timestamp={ts},value:{value},parameters:{task.parameters}")
+        task.callback(task_id=task.task_id, value=value, timestamp=ts, **task.parameters)
+
+
+def bench(label, stmt, number):
+    best = min(timeit.repeat(stmt, number=number, repeat=5))
+    print(f"{label:<42} {best / number * 1e6:10.2f} µs/call")
+    return best / number
+
+
+if __name__ == "__main__":
+    nb = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+
+    # fill the registry like auto_register_callbacks(globals()) used to
+    for i in range(nb):
+        register_callback(f"func_{i}")(lambda **kw: None)
+
+    @register_callback("sink")
+    def sink(task_id, value, timestamp, **kwargs):
+        pass
+
+    print(f"callback name lookup, {len(CALLBACK_REGISTRY)} registered callbacks")
+    t_old = bench("  legacy registry scan", lambda: legacy_get_callback_name(sink), 200000)
+    t_new = bench("  reverse index", lambda: get_callback_name(sink), 200000)
+    print(f"  speedup x{t_old / t_new:.2f}")
+
+    client = MemoryClient()
+    worker = ModbusWorker(client)
+    task = Task(task_id="bench", callback=sink, parameters={"target_id": "status_0", "file": "x.csv"},
+                modbus_param={"op": "read", "addr": 1, "nbreg": 2, "format": "REAL4"})
+    task.resolve()
+
+    print("per-sample dispatch (read + decode + callback)")
+    t_old = bench("  legacy execute_task", lambda: legacy_execute(client, task), 50000)
+    t_new = bench("  execute_task, pre-resolved task", lambda: worker.execute_task(task), 50000)
+    print(f"  speedup x{t_old / t_new:.2f}")
@@ -0,0 +1,105 @@
+# bench_keypad.py
+# Keypad writes queued and their latency, with and without WriteAdmission, on a
+# real ModbusWorker whose client takes `frame` seconds per request (4 periodic
+# reads every 0.5 s keep the bus busy). Each operator types `keys` keys, one per
+# second, and double clicks each key (second click 100-400 ms later); operators
+# start 0.3 s apart. Every admitted click becomes an urgent write task, as in
+# tufGuiDash.on_base_or_function_key_press. Real time: about 2 x (keys + 2) s.
+#
+#   python bench_keypad.py [operators] [keys] [frame]
+import random
+import sys
+import threading
+import time
+
+from modbus_worker import ModbusWorker, Task
+from write_admission import WriteAdmission
+
+
+class SlowClient:
+    """Answers after `frame` seconds, like a device on the serial line."""
+    def __init__(self, frame):
+        self.frame = frame
+
+    class _Response:
+        registers = [0, 0]
+
+        def isError(self):
+            return False
+
+    def read_holding_registers(self, address, count=1, device_id=1):
+        time.sleep(self.frame)
+        return self._Response()
+
+    def write_register(self, address, value, device_id=1):
+        time.sleep(self.frame)
+        return self._Response()
+
+
+def clicks(operators, keys, seed=1):
+    """(time, session, key) of every click, sorted by time."""
+    rng = random.Random(seed)
+    events = []
+    for op in range(operators):
+        for k in range(keys):
+            t = op * 0.3 + k * 1.0
+            key = (59, rng.randrange(10))
+            events.append((t, f"op{op}", key))
+            events.append((t + rng.uniform(0.1, 0.4), f"op{op}", key))
+    return sorted(events)
+
+
+def run(events, frame, admission=None):
+    worker = ModbusWorker(SlowClient(frame))
+    latencies = []
+    lock = threading.Lock()
+
+    def reader(value, timestamp, **kwargs):
+        pass
+
+    def written(value, timestamp, clicked, **kwargs):
+        with lock:
+            latencies.append(time.monotonic() - clicked)
+
+    worker.start()
+    for i in range(4):
+        worker.create_task(Task(task_id=f"read_{i}", callback=reader, recurrence=0.5,
+                                modbus_param={"op": "read", "addr": 1 + 4 * i, "nbreg": 2, "format": "REAL4"}),
+                           save=False)
+    queued = refused = 0
+    started = time.monotonic()
+    for n, (t, session, (reg, val)) in enumerate(events):
+        delay = t - (time.monotonic() - started)
+        if delay > 0:
+            time.sleep(delay)
+        if admission is not None and not admission.admit(session, (reg, val)).admitted:
+            refused += 1
+            continue
+        queued += 1
+        worker.create_task(Task(task_id=f"write_{n}", callback=written, urgent=True,
+                                modbus_param={"op": "write", "addr": reg - 1, "value": val},
+                                parameters={"clicked": time.monotonic()}), save=False)
+    deadline = time.monotonic() + 30
+    while len(latencies) < queued and time.monotonic() < deadline:
+        time.sleep(0.05)
+    worker.stop()
+    return queued, refused, sorted(latencies)
+
+
+def report(label, queued, refused, latencies):
+    n = len(latencies)
+    print(f"{label:<22} {queued:4d} writes queued, {refused:3d} refused, latency "
+          f"p50 {latencies[n // 2] * 1000:6.1f} ms  p95 {latencies[min(n - 1, int(n * 0.95))] * 1000:6.1f} ms  "
+          f"max {latencies[-1] * 1000:6.1f} ms")
+
+
+if __name__ == "__main__":
+    operators = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    keys = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    frame = float(sys.argv[3]) if len(sys.argv) > 3 else 0.04
+    events = clicks(operators, keys)
+    print(f"{operators} operators x {keys} double clicked keys ({len(events)} clicks), "
+          f"{frame * 1000:.0f} ms per frame, 4 reads every 0.5 s")
+    report("no admission", *run(events, frame))
+    report("debounce 0.4 s + lease", *run(events, frame, WriteAdmission(debounce=0.4, lease=5.0)))
+    report("debounce 0.4 s only", *run(events, frame, WriteAdmission(debounce=0.4, lease=0)))
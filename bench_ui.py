@@ -0,0 +1,115 @@
+# bench_ui.py
+# Click latency of a record button against a running service, as the browser
+# sees it: request sent -> answer received.
+#   dash   : the legacy path, a Dash callback request carrying the n_clicks of
+#            every record button and answered with the style of every button
+#            (service built from the commit before the socket path:
+#            git worktree add ../tuf-legacy 6b90745^)
+#   socket : the current path, an acknowledged "action_key" Socket.IO event
+#            (pip install websocket-client for the browser's websocket transport,
+#            else long polling is used and reported)
+# Each click toggles the recording of the key, so an even number of clicks
+# leaves it as it was. Run both against the same device and config.yaml:
+#
+#   python bench_ui.py dash   http://host:8050 [--index 0] [-n 50]
+#   python bench_ui.py socket http://host:8050 [--index 0] [-n 50]
+import argparse
+import json
+import time
+import urllib.request
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.load(response)
+
+
+def components(node):
+    """Every component (type, props) of a /_dash-layout tree."""
+    if isinstance(node, list):
+        for child in node:
+            yield from components(child)
+    elif isinstance(node, dict) and "props" in node:
+        yield node
+        yield from components(node["props"].get("children"))
+
+
+def page_info(url):
+    """(number of record buttons, layout generation) of the served page."""
+    layout = get_json(url + "/_dash-layout")
+    nb_keys, generation = 0, None
+    for component in components(layout):
+        cid = component["props"].get("id")
+        if isinstance(cid, dict) and cid.get("type") == "rec-btn":
+            nb_keys += 1
+        elif cid == "layout-generation":
+            generation = component["props"].get("data")
+    return nb_keys, generation
+
+
+def dash_click(url, nb_keys, index, clicks):
+    """One legacy callback request, as the Dash renderer sends it."""
+    def btn(i):
+        return {"index": i, "type": "rec-btn"}
+    body = json.dumps({
+        "output": '{"index":["ALL"],"type":"rec-btn"}.style',
+        "outputs": [{"id": btn(i), "property": "style"} for i in range(nb_keys)],
+        "inputs": [{"id": "url", "property": "pathname", "value": "/"},
+                   [{"id": btn(i), "property": "n_clicks", "value": clicks[i]} for i in range(nb_keys)]],
+        "changedPropIds": [json.dumps(btn(index), separators=(",", ":")) + ".n_clicks"],
+        "state": [],
+    }).encode()
+    request = urllib.request.Request(url + "/_dash-update-component", data=body,
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"callback answered {response.status}")
+
+
+def report(label, latencies):
+    ordered = sorted(latencies)
+    n = len(ordered)
+    print(f"{label}: {n} clicks, p50 {ordered[n // 2] * 1000:.1f} ms, "
+          f"p95 {ordered[min(n - 1, int(n * 0.95))] * 1000:.1f} ms, max {ordered[-1] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="record button click latency of a running service")
+    parser.add_argument("path", choices=("dash", "socket"))
+    parser.add_argument("url", help="service URL, e.g. http://localhost:8050")
+    parser.add_argument("--index", type=int, default=0, help="record button clicked (a record key)")
+    parser.add_argument("-n", type=int, default=50, help="number of clicks (rounded up to even)")
+    args = parser.parse_args()
+    url = args.url.rstrip("/")
+    count = args.n + args.n % 2
+    nb_keys, generation = page_info(url)
+    if not 0 <= args.index < nb_keys:
+        raise SystemExit(f"--index must be below the {nb_keys} record buttons of the page")
+
+    latencies = []
+    if args.path == "dash":
+        clicks = [0] * nb_keys
+        for _ in range(count):
+            clicks[args.index] += 1
+            t0 = time.perf_counter()
+            dash_click(url, nb_keys, args.index, clicks)
+            latencies.append(time.perf_counter() - t0)
+            time.sleep(0.2)  # let the worker run the toggled task
+        label = f"dash callback ({nb_keys} record buttons)"
+    else:
+        import socketio
+        sio = socketio.Client()
+        sio.connect(url)
+        try:
+            for _ in range(count):
+                t0 = time.perf_counter()
+                ack = sio.call("action_key", {"index": args.index, "generation": generation}, timeout=10)
+                latencies.append(time.perf_counter() - t0)
+                if not ack or not ack.get("ok"):
+                    raise SystemExit(f"refused: {ack}")
+                time.sleep(0.2)
+            label = f"socket event over {sio.transport()} ({nb_keys} record buttons)"
+        finally:
+            sio.disconnect()
+    report(label, latencies)
@@ -0,0 +1,303 @@
+"""
+bus_planner.py
+--------------
+Bus occupancy model of the periodic tasks of config.yaml (Modbus RTU).
+
+Each frame costs its characters on the wire (start bit, data bits, parity
+bit, stop bits at the configured baud rate), the 3.5 character silence that
+delimits it, and the device turnaround between the request and the response:
+    read  n registers : request 8 bytes, response 5 + 2n bytes
+    write one register: request 8 bytes, response 8 bytes
+A task takes S seconds of bus per execution (one frame for a record key,
+one per register map block for a snapshot key) every `recurrence` seconds,
+so it occupies U = S / recurrence of the link. The timers of the worker
+push their task whether or not the previous one ran, so when the total U
+reaches 1 the queue grows without bound; below, the worst case wait is one
+execution of every other task (all the timers firing together).
+
+The turnaround is the only measured input: it defaults to bus_planner:
+turnaround in config.yaml and can be calibrated from a bus trace or from the
+per task timings of the running service (GET /stats/bus).
+
+Command line:
+    python bus_planner.py [-c config.yaml] [--turnaround 0.03] [--target 0.7]
+                          [--trace bus.trace] [--live http://host:8050] [--json]
+"""
+
+import argparse
+import json
+import statistics
+import urllib.request
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import yaml
+
+from modbus_worker import RegisterMap
+
+# frame sizes in bytes (address, function, ..., CRC)
+READ_REQUEST = 8
+WRITE_REQUEST = 8
+WRITE_RESPONSE = 8
+
+
+def read_response(count: int) -> int:
+    """Bytes of a read holding registers response of `count` registers."""
+    return 5 + 2 * count
+
+
+# ──────────────────────────────────────────────────────────────
+# Link timing
+# ──────────────────────────────────────────────────────────────
+class Link:
+    """Timing of a serial line configured like the `serial:` section."""
+    def __init__(self, baudrate: int = 9600, bytesize: int = 8, parity: str = "N",
+                 stopbits: float = 1, turnaround: float = 0.03):
+        self.baudrate = int(baudrate)
+        bits = 1 + int(bytesize) + (0 if str(parity).upper() == "N" else 1) + float(stopbits)
+        self.char_time = bits / self.baudrate
+        # fixed 1.75 ms above 19200 bauds (Modbus over serial line, 2.5.1.1)
+        self.silence = 3.5 * self.char_time if self.baudrate <= 19200 else 0.00175
+        self.turnaround = turnaround
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], turnaround: Optional[float] = None) -> "Link":
+        serial = config.get("serial", {})
+        if turnaround is None:
+            turnaround = float(config.get("bus_planner", {}).get("turnaround", 0.03))
+        return cls(baudrate=serial.get("baudrate", 9600), bytesize=serial.get("bytesize", 8),
+                   parity=serial.get("parity", "N"), stopbits=serial.get("stopbits", 1),
+                   turnaround=turnaround)
+
+    def wire(self, request: int, response: int) -> float:
+        """Seconds of one frame on the line, without the turnaround."""
+        return self.silence + (request + response) * self.char_time
+
+    def frame(self, request: int, response: int) -> float:
+        return self.wire(request, response) + self.turnaround
+
+
+# ──────────────────────────────────────────────────────────────
+# Task set
+# ──────────────────────────────────────────────────────────────
+def key_frames(key: Dict[str, Any], register_maps: Dict[str, Any]) -> Optional[List[Tuple[int, int]]]:
+    """(request, response) bytes of the frames of one execution of an action key;
+    None for keys without a periodic task (deleteFile, invalid keys)."""
+    action = key.get("action")
+    if action == "record" and key.get("nbReg") is not None:
+        return [(READ_REQUEST, read_response(int(key["nbReg"])))]
+    if action == "snapshot" and register_maps.get(key.get("map")):
+        kwargs = {"max_gap": int(key["max_gap"])} if key.get("max_gap") is not None else {}
+        blocks = RegisterMap(register_maps[key["map"]], **kwargs).blocks
+        return [(READ_REQUEST, read_response(count)) for _, count, _ in blocks]
+    return None
+
+
+def task_set(config: Dict[str, Any], task_ids: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """Periodic tasks of the action keys (only `task_ids` if given), with their frames."""
+    tasks = []
+    for key in config.get("action_keys") or []:
+        task_id = str(key.get("label", "")).replace(" ", "_")
+        if task_ids is not None and task_id not in task_ids:
+            continue
+        frames = key_frames(key, config.get("register_maps", {}))
+        if frames is None or key.get("recurrence") is None:
+            continue
+        tasks.append({"task_id": task_id, "action": key["action"],
+                      "recurrence": float(key["recurrence"]), "frames": frames})
+    return tasks
+
+
+# ──────────────────────────────────────────────────────────────
+# Model
+# ──────────────────────────────────────────────────────────────
+def plan(tasks: Sequence[Dict[str, Any]], link: Link, target: float = 0.7,
+         keypad_rate: float = 0.0) -> Dict[str, Any]:
+    """Per task and total utilisation of `tasks` on `link`.
+
+    target     : utilisation kept as a margin for retries and timeouts; the
+                 suggested recurrences fill the link up to it
+    keypad_rate: keypad writes per second reserved for the operators
+    """
+    rows = []
+    for task in tasks:
+        service = sum(link.frame(req, resp) for req, resp in task["frames"])
+        recurrence = task["recurrence"]
+        rows.append({"task_id": task["task_id"], "action": task["action"],
+                     "frames": len(task["frames"]),
+                     "registers": sum((resp - 5) // 2 for _, resp in task["frames"]),
+                     "recurrence": recurrence, "service": service,
+                     "utilisation": service / recurrence if recurrence > 0 else float("inf")})
+    write_time = link.frame(WRITE_REQUEST, WRITE_RESPONSE)
+    reserve = keypad_rate * write_time
+    total = sum(row["utilisation"] for row in rows) + reserve
+    for row in rows:
+        # fastest recurrence keeping the total at the target, the other tasks unchanged
+        room = target - (total - row["utilisation"])
+        row["min_recurrence"] = row["service"] / room if room > 0 else None
+
+    arrivals = sum(1 / row["recurrence"] for row in rows if row["recurrence"] > 0)
+    report = {
+        "link": {"baudrate": link.baudrate, "char_time": link.char_time,
+                 "silence": link.silence, "turnaround": link.turnaround,
+                 "write": write_time},
+        "tasks": rows,
+        "keypad_reserve": reserve,
+        "utilisation": total,
+        "target": target,
+        "saturated": total >= 1,
+        # worst case wait of a task: every other task and one key press ahead of it
+        "worst_wait": sum(row["service"] for row in rows) + (write_time if keypad_rate > 0 else 0.0),
+        # scaling all the recurrences by this factor brings the total to the target
+        "recurrence_scale": total / target if target > 0 else None,
+    }
+    if total >= 1:
+        # arrivals beyond the service rate accumulate in the queue
+        served = arrivals / total
+        report["queue_growth"] = arrivals - served
+        report["seconds_to_100_queued"] = 100 / (arrivals - served) if arrivals > served else None
+    else:
+        # mean queueing delay with deterministic service (M/D/1), a pessimistic
+        # figure for timers that mostly do not collide
+        mean_service = (total - reserve) / arrivals if arrivals else 0.0
+        report["mean_wait"] = total * mean_service / (2 * (1 - total))
+        if rows:
+            # how many more tasks like the mean one fit below the target
+            mean_u = sum(row["utilisation"] for row in rows) / len(rows)
+            report["headroom_tasks"] = max(int((target - total) / mean_u), 0) if mean_u > 0 else None
+    return report
+
+
+# ──────────────────────────────────────────────────────────────
+# Calibration against measured timings
+# ──────────────────────────────────────────────────────────────
+def turnaround_from_trace(records, link: Link) -> Optional[float]:
+    """Median of the recorded transaction durations minus their wire time."""
+    from bus_trace import OP_READ, STATUS_OK
+    samples = []
+    for rec in records:
+        if rec.status != STATUS_OK:
+            continue
+        if rec.op == OP_READ:
+            wire = link.wire(READ_REQUEST, read_response(rec.arg))
+        else:
+            wire = link.wire(WRITE_REQUEST, WRITE_RESPONSE)
+        samples.append(rec.duration - wire)
+    return max(statistics.median(samples), 0.0) if samples else None
+
+
+def turnaround_from_stats(per_task: Dict[str, Dict[str, Any]], tasks: Sequence[Dict[str, Any]],
+                          link: Link) -> Optional[float]:
+    """Median over the tasks of (mean measured bus time - wire time) per frame."""
+    samples = []
+    for task in tasks:
+        measured = per_task.get(task["task_id"])
+        if not measured or not measured["count"]:
+            continue
+        wire = sum(link.wire(req, resp) for req, resp in task["frames"])
+        samples.append((measured["bus_mean"] - wire) / len(task["frames"]))
+    return max(statistics.median(samples), 0.0) if samples else None
+
+
+def compare(report: Dict[str, Any], measured: Dict[str, Any]) -> Dict[str, Any]:
+    """Model next to the worker statistics (TransactionStats.snapshot())."""
+    per_task = measured.get("per_task", {})
+    elapsed = measured.get("elapsed") or 0.0
+    rows = {}
+    for row in report["tasks"]:
+        m = per_task.get(row["task_id"])
+        if not m:
+            continue
+        rows[row["task_id"]] = {"model_service": row["service"], "measured_service": m["bus_mean"],
+                                "measured_max": m["bus_max"],
+                                "model_utilisation": row["utilisation"],
+                                "measured_utilisation": m["count"] * m["bus_mean"] / elapsed if elapsed else None}
+    busy = sum(m["count"] * m["bus_mean"] for m in per_task.values())
+    return {"tasks": rows,
+            "model_utilisation": report["utilisation"],
+            "measured_utilisation": busy / elapsed if elapsed else None,
+            "measured_wait": measured.get("wait"), "max_queue": measured.get("max_queue"),
+            "errors": measured.get("errors")}
+
+
+# ──────────────────────────────────────────────────────────────
+# CLI
+# ──────────────────────────────────────────────────────────────
+def _ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.1f} ms"
+
+
+def _print_report(report: Dict[str, Any]):
+    link = report["link"]
+    print(f"link {link['baudrate']} bauds: char {_ms(link['char_time'])}, silence {_ms(link['silence'])}, "
+          f"turnaround {_ms(link['turnaround'])} ({link.get('turnaround_source', 'config')})")
+    print(f"{'task':<24}{'frames':>7}{'regs':>6}{'every':>9}{'bus':>11}{'util':>8}{'fastest':>11}")
+    for row in report["tasks"]:
+        fastest = "-" if row["min_recurrence"] is None else f"{row['min_recurrence']:.2f} s"
+        print(f"{row['task_id']:<24}{row['frames']:>7}{row['registers']:>6}{row['recurrence']:>7.1f} s"
+              f"{_ms(row['service']):>11}{row['utilisation']:>8.1%}{fastest:>11}")
+    print(f"total utilisation {report['utilisation']:.1%} (target {report['target']:.0%}, "
+          f"keypad reserve {report['keypad_reserve']:.1%})")
+    print(f"worst case wait {_ms(report['worst_wait'])}")
+    if report["saturated"]:
+        eta = report["seconds_to_100_queued"]
+        print(f"SATURATED: the queue grows by {report['queue_growth']:.2f} tasks/s"
+              + (f", 100 tasks queued after {eta:.0f} s" if eta else ""))
+    else:
+        print(f"mean queueing delay {_ms(report['mean_wait'])}, "
+              f"room for {report.get('headroom_tasks')} more tasks like the mean one")
+    if report["recurrence_scale"] and report["recurrence_scale"] > 1:
+        print(f"multiply every recurrence by {report['recurrence_scale']:.2f} to stay at the target")
+    live = report.get("live")
+    if live:
+        print(f"measured utilisation {live['measured_utilisation'] or 0:.1%} "
+              f"vs model {live['model_utilisation']:.1%}, max queue {live['max_queue']}")
+        for task_id, row in live["tasks"].items():
+            print(f"  {task_id:<22} bus {_ms(row['measured_service'])} (max {_ms(row['measured_max'])}) "
+                  f"vs model {_ms(row['model_service'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Modbus bus utilisation of the configured tasks")
+    parser.add_argument("-c", "--config", default="config.yaml")
+    parser.add_argument("--turnaround", type=float, help="device turnaround in seconds")
+    parser.add_argument("--target", type=float, help="utilisation to stay below (default bus_planner: target)")
+    parser.add_argument("--keypad-rate", type=float, help="keypad writes per second to reserve")
+    parser.add_argument("--trace", help="calibrate the turnaround on a recorded bus trace")
+    parser.add_argument("--live", metavar="URL",
+                        help="running service (e.g. http://localhost:8050): calibrate on its "
+                             "/stats/bus timings and plan its running tasks only")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    settings = config.get("bus_planner", {})
+    link = Link.from_config(config, args.turnaround)
+    target = args.target if args.target is not None else float(settings.get("target", 0.7))
+    keypad_rate = args.keypad_rate if args.keypad_rate is not None else float(settings.get("keypad_rate", 0.0))
+    source = "argument" if args.turnaround is not None else "config"
+
+    measured = None
+    if args.live:
+        with urllib.request.urlopen(args.live.rstrip("/") + "/stats/bus", timeout=10) as response:
+            measured = json.load(response)["measured"]
+    tasks = task_set(config, list(measured["per_task"]) if measured else None)
+
+    if args.turnaround is None and args.trace:
+        from bus_trace import read_trace
+        calibrated = turnaround_from_trace(read_trace(args.trace), link)
+        if calibrated is not None:
+            link.turnaround, source = calibrated, "trace"
+    elif args.turnaround is None and measured:
+        calibrated = turnaround_from_stats(measured["per_task"], tasks, link)
+        if calibrated is not None:
+            link.turnaround, source = calibrated, "live"
+
+    report = plan(tasks, link, target=target, keypad_rate=keypad_rate)
+    report["link"]["turnaround_source"] = source
+    if measured:
+        report["live"] = compare(report, measured)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
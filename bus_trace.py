@@ -0,0 +1,397 @@
+"""
+bus_trace.py
+------------
+Recording and replay of the Modbus traffic.
+
+This module provides:
+- TracingClient: wraps the pymodbus client; every request and its response
+  (or error) is appended to a compact binary trace with its timing.
+- ReplayClient: a client answering from a trace, with the recorded bus
+  latency (divided by the speed factor).
+- replay(): runs a ModbusWorker on a ReplayClient and returns its
+  transaction statistics next to the ones of the original trace, so
+  scheduler, coalescing and storage changes can be compared offline on
+  production traffic.
+
+Trace file (little endian): b"TUFTRACE" + u16 version, then one record per
+transaction:
+    f64 wall clock start, f32 duration (s), u8 op (1 read, 2 write; +0x80 for
+    the requests of urgent tasks, version 2 only), u8 status (0 ok, 1 error response, 2 exception), u8 device id,
+    u16 address, u16 count (read) or value (write), u16 n, n x u16 registers
+A 2 register read takes 25 bytes. When the file reaches max_bytes it is
+renamed "<file>.1" (one backup) and a new trace is started. Version 1
+traces (no urgent flag) are still read.
+
+The worker tells the client which task the next requests belong to with
+trace_task(task), when the client has that method.
+
+Command line:
+    python bus_trace.py info   bus.trace
+    python bus_trace.py replay bus.trace [--speed 10] [--mode trace|tasks]
+                               [--state TUFState] [--record DIR] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import struct
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TUFTRACE"
+VERSION = 2
+VERSIONS = (1, 2)  # readable
+_FILE_HEADER = struct.Struct("<8sH")
+_RECORD = struct.Struct("<dfBBBHHH")
+
+OP_READ, OP_WRITE = 1, 2
+OP_URGENT = 0x80
+STATUS_OK, STATUS_ERROR, STATUS_EXCEPTION = 0, 1, 2
+OP_NAMES = {OP_READ: "read", OP_WRITE: "write"}
+
+
+class TraceRecord(NamedTuple):
+    start: float        # wall clock (time.time()) of the request
+    duration: float     # seconds until the response (or the error)
+    op: int
+    status: int
+    device: int
+    address: int
+    arg: int            # register count (read) or written value (write)
+    registers: tuple
+    urgent: bool = False    # request of an urgent task (keypad write...)
+
+
+# ──────────────────────────────────────────────────────────────
+# Trace file
+# ──────────────────────────────────────────────────────────────
+def read_trace(path: str) -> Iterator[TraceRecord]:
+    """Records of a trace file, in order; a truncated last record is ignored."""
+    with open(path, "rb") as f:
+        header = f.read(_FILE_HEADER.size)
+        if len(header) < _FILE_HEADER.size:
+            return
+        magic, version = _FILE_HEADER.unpack(header)
+        if magic != MAGIC or version not in VERSIONS:
+            raise ValueError(f"{path} is not a bus trace (versions {VERSIONS})")
+        while True:
+            data = f.read(_RECORD.size)
+            if len(data) < _RECORD.size:
+                return
+            start, duration, op, status, device, address, arg, n = _RECORD.unpack(data)
+            raw = f.read(2 * n)
+            if len(raw) < 2 * n:
+                return
+            yield TraceRecord(start, duration, op & ~OP_URGENT, status, device, address, arg,
+                              struct.unpack(f"<{n}H", raw), bool(op & OP_URGENT))
+
+
+class TracingClient:
+    """Pass-through Modbus client recording every transaction to a trace file."""
+    def __init__(self, client, path: str, max_bytes: int = 50_000_000, flush_interval: float = 1.0):
+        self.client = client
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._last_flush = time.monotonic()
+        self._task = threading.local()  # urgent flag of the task being executed
+        self._open()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(_FILE_HEADER.pack(MAGIC, VERSION))
+        elif self._version() != VERSION:
+            # older trace: kept as the backup, the new records start a new file
+            self._file.close()
+            os.replace(self.path, f"{self.path}.1")
+            self._open()
+
+    def _version(self) -> Optional[int]:
+        with open(self.path, "rb") as f:
+            header = f.read(_FILE_HEADER.size)
+        if len(header) < _FILE_HEADER.size:
+            return None
+        return _FILE_HEADER.unpack(header)[1]
+
+    def __getattr__(self, name):
+        # connect(), close(), socket... of the wrapped client
+        return getattr(self.client, name)
+
+    def trace_task(self, task):
+        """Called by the worker before the requests of `task` (its urgent flag is recorded)."""
+        self._task.urgent = bool(getattr(task, "urgent", False))
+
+    def _record(self, start: float, duration: float, op: int, status: int, device: int,
+                address: int, arg: int, registers: Sequence[int] = ()):
+        regs = [r & 0xFFFF for r in registers]
+        if getattr(self._task, "urgent", False):
+            op |= OP_URGENT
+        data = (_RECORD.pack(start, duration, op, status, device & 0xFF, address & 0xFFFF,
+                             int(arg) & 0xFFFF, len(regs))
+                + struct.pack(f"<{len(regs)}H", *regs))
+        with self._lock:
+            try:
+                self._file.write(data)
+                now = time.monotonic()
+                if now - self._last_flush >= self.flush_interval:
+                    self._file.flush()
+                    self._last_flush = now
+                    if self._file.tell() >= self.max_bytes:
+                        self._file.close()
+                        os.replace(self.path, f"{self.path}.1")
+                        self._open()
+            except (OSError, ValueError) as e:
+                logger.error(f"Bus trace write failed: {e}")
+
+    def _call(self, op: int, device: int, address: int, arg: int, func, kwargs: Dict[str, Any]):
+        start = time.time()
+        t0 = time.perf_counter()
+        try:
+            response = func(**kwargs)
+        except Exception:
+            self._record(start, time.perf_counter() - t0, op, STATUS_EXCEPTION, device, address, arg)
+            raise
+        duration = time.perf_counter() - t0
+        if response.isError():
+            self._record(start, duration, op, STATUS_ERROR, device, address, arg)
+        else:
+            self._record(start, duration, op, STATUS_OK, device, address, arg,
+                         getattr(response, "registers", None) or ())
+        return response
+
+    def read_holding_registers(self, address, count=1, device_id=1, **kwargs):
+        return self._call(OP_READ, device_id, address, count, self.client.read_holding_registers,
+                          dict(kwargs, address=address, count=count, device_id=device_id))
+
+    def write_register(self, address, value, device_id=1, **kwargs):
+        return self._call(OP_WRITE, device_id, address, value, self.client.write_register,
+                          dict(kwargs, address=address, value=value, device_id=device_id))
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close_trace(self):
+        with self._lock:
+            self._file.close()
+
+
+# ──────────────────────────────────────────────────────────────
+# Replay
+# ──────────────────────────────────────────────────────────────
+class _Response:
+    def __init__(self, registers=(), error: bool = False):
+        self.registers = list(registers)
+        self._error = error
+
+    def isError(self):
+        return self._error
+
+
+class ReplayClient:
+    """Modbus client answering from recorded transactions.
+
+    Requests are matched on (op, address, count/value) in recorded order;
+    once the recorded answers of a request are used up, the last one is
+    repeated. Unmatched requests get zeros and are counted in `misses`.
+    Each answer takes the recorded duration / speed (latency=False: none).
+    """
+    def __init__(self, records: Sequence[TraceRecord], speed: float = 1.0, latency: bool = True):
+        self.speed = speed
+        self.latency = latency
+        self.answers: Dict[tuple, deque] = defaultdict(deque)
+        for rec in records:
+            self.answers[(rec.op, rec.address, rec.arg)].append(rec)
+        self.last: Dict[tuple, TraceRecord] = {}
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        return True
+
+    def close(self):
+        pass
+
+    def _answer(self, key) -> Optional[TraceRecord]:
+        with self.lock:
+            pending = self.answers.get(key)
+            if pending:
+                rec = self.last[key] = pending.popleft()
+            else:
+                rec = self.last.get(key)
+                if rec is None:
+                    self.misses += 1
+        if rec is not None and self.latency:
+            time.sleep(rec.duration / self.speed)
+        return rec
+
+    def _response(self, rec: Optional[TraceRecord], count: int):
+        if rec is None:
+            return _Response([0] * count)
+        if rec.status == STATUS_EXCEPTION:
+            raise ConnectionError(f"replayed exception ({OP_NAMES.get(rec.op)} at {rec.address})")
+        return _Response(rec.registers, error=rec.status == STATUS_ERROR)
+
+    def read_holding_registers(self, address, count=1, device_id=1, **kwargs):
+        return self._response(self._answer((OP_READ, address, count)), count)
+
+    def write_register(self, address, value, device_id=1, **kwargs):
+        return self._response(self._answer((OP_WRITE, address, value)), 0)
+
+
+def trace_stats(records: Sequence[TraceRecord]) -> Dict[str, Any]:
+    """Transaction statistics of a recorded trace (same keys as the replayed ones)."""
+    if not records:
+        return {"transactions": 0}
+    durations = sorted(rec.duration for rec in records)
+    n = len(durations)
+    elapsed = max(records[-1].start + records[-1].duration - records[0].start, 1e-9)
+    return {
+        "transactions": n,
+        "errors": sum(rec.status != STATUS_OK for rec in records),
+        "elapsed": elapsed,
+        "frames_per_s": n / elapsed,
+        "bus_busy": sum(durations) / elapsed,
+        "bus": {"p50": durations[n // 2], "p95": durations[min(n - 1, int(n * 0.95))],
+                "max": durations[-1]},
+    }
+
+
+def tasks_from_trace(records: Sequence[TraceRecord]) -> List[Dict[str, Any]]:
+    """Periodic read tasks inferred from a trace: one per (address, count), median interval."""
+    times = defaultdict(list)
+    for rec in records:
+        if rec.op == OP_READ:
+            times[(rec.address, rec.arg)].append(rec.start)
+    tasks = []
+    for (address, count), starts in sorted(times.items()):
+        if len(starts) < 2:
+            continue
+        recurrence = statistics.median(b - a for a, b in zip(starts, starts[1:]))
+        tasks.append({"task_id": f"read_{address}_{count}", "recurrence": recurrence,
+                      "modbus_param": {"op": "read", "addr": address, "nbreg": count, "format": "INTEGER"}})
+    return tasks
+
+
+def replay(records: Sequence[TraceRecord], speed: float = 1.0, mode: str = "trace",
+           state: Optional[Dict[str, Any]] = None, record_dir: Optional[str] = None,
+           duration: Optional[float] = None) -> Dict[str, Any]:
+    """Feed a trace through a ModbusWorker; return the replayed and recorded statistics.
+
+    mode "trace": every recorded transaction is re-issued at its recorded
+    time (scaled by 1/speed) as a one-shot task, urgent if it was recorded
+    so: the production arrival pattern, bursts included. mode "tasks": periodic tasks (from `state`, a
+    TUFState dict, or inferred from the trace) run with recurrences divided
+    by speed, for `duration` seconds (default: the trace length / speed).
+    record_dir: the values read are appended to recordings in this directory.
+    """
+    from modbus_worker import ModbusWorker, Task
+    from recordings import RecordingStore
+
+    client = ReplayClient(records, speed=speed)
+    worker = ModbusWorker(client)
+    store = RecordingStore(record_dir) if record_dir else None
+
+    def sink(task_id, value, timestamp, **kwargs):
+        if store is None:
+            return
+        if isinstance(value, dict):
+            store.append(f"{task_id}.csv", timestamp, list(value.values()), columns=list(value))
+        else:
+            store.append(f"{task_id}.csv", timestamp, [value])
+
+    span = (records[-1].start - records[0].start) if records else 0.0
+    worker.start()
+    started = time.monotonic()
+    if mode == "trace":
+        t0 = records[0].start if records else 0.0
+        for rec in records:
+            delay = (rec.start - t0) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+            op = "read" if rec.op == OP_READ else "write"
+            param = {"op": op, "addr": rec.address}
+            param.update({"nbreg": rec.arg, "format": "INTEGER"} if op == "read" else {"value": rec.arg})
+            worker.create_task(Task(task_id=f"replay_{op}_{rec.address}_{rec.arg}",
+                                    modbus_param=param, callback=sink, urgent=rec.urgent),
+                               save=False)
+        # let the queue drain
+        while worker.queue_size() and time.monotonic() - started < span / speed + 60:
+            time.sleep(0.05)
+    else:
+        definitions = list(state.values()) if state else tasks_from_trace(records)
+        for data in definitions:
+            worker.create_task(Task(task_id=data["task_id"], modbus_param=data["modbus_param"],
+                                    recurrence=float(data["recurrence"]) / speed, callback=sink),
+                               save=False)
+        time.sleep(duration if duration is not None else span / speed)
+    time.sleep(0.1)
+    worker.stop()
+    return {"speed": speed, "mode": mode, "replayed": worker.stats.snapshot(),
+            "recorded": trace_stats(records), "misses": client.misses}
+
+
+def _print_report(report: Dict[str, Any]):
+    def ms(x):
+        return "-" if x is None else f"{x * 1000:8.1f} ms"
+    rec, rep = report["recorded"], report["replayed"]
+    print(f"mode {report['mode']}, speed x{report['speed']}")
+    print(f"  recorded : {rec.get('transactions', 0)} frames in {rec.get('elapsed', 0):.1f} s, "
+          f"{rec.get('errors', 0)} errors, bus busy {rec.get('bus_busy', 0):.1%}")
+    if rec.get("transactions"):
+        print(f"             bus p50 {ms(rec['bus']['p50'])}  p95 {ms(rec['bus']['p95'])}  max {ms(rec['bus']['max'])}")
+    print(f"  replayed : {rep['tasks']} tasks / {rep['frames']} frames in {rep['elapsed']:.1f} s "
+          f"({rep['tasks_per_s']:.1f} tasks/s), {rep['errors']} errors, max queue {rep['max_queue']}, "
+          f"{report['misses']} unmatched requests")
+    print(f"             bus p50 {ms(rep['bus']['p50'])}  p95 {ms(rep['bus']['p95'])}  max {ms(rep['bus']['max'])}")
+    print(f"             wait p50 {ms(rep['wait']['p50'])}  p95 {ms(rep['wait']['p95'])}  max {ms(rep['wait']['max'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Modbus bus trace tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info", help="statistics of a recorded trace")
+    info.add_argument("trace")
+    rp = sub.add_parser("replay", help="replay a trace through a ModbusWorker")
+    rp.add_argument("trace")
+    rp.add_argument("--speed", type=float, default=1.0, help="time acceleration factor")
+    rp.add_argument("--mode", choices=("trace", "tasks"), default="trace")
+    rp.add_argument("--state", help="TUFState file giving the periodic tasks (mode tasks)")
+    rp.add_argument("--duration", type=float, help="replay length in seconds (mode tasks)")
+    rp.add_argument("--record", nargs="?", const="", default=None,
+                    help="append the values read to recordings (in DIR, default a temporary directory)")
+    rp.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    records = list(read_trace(args.trace))
+    if args.command == "info":
+        print(json.dumps(trace_stats(records), indent=2))
+    else:
+        state = None
+        if args.state:
+            with open(args.state) as f:
+                state = json.load(f)
+        record_dir = args.record
+        if record_dir == "":
+            record_dir = tempfile.mkdtemp(prefix="tuf_replay_")
+        report = replay(records, speed=args.speed, mode=args.mode, state=state,
+                        record_dir=record_dir, duration=args.duration)
+        if record_dir:
+            report["record_dir"] = record_dir
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            _print_report(report)
@@ -4,19 +4,23 @@ callbacks.py
 Central registry for Modbus task callbacks.
 
 This module provides:
-- A global CALLBACK_REGISTRY that maps string names → Python callables.
+- A global CALLBACK_REGISTRY that maps string names → Python callables,
+  with a reverse index (callable → name) for O(1) lookups.
 - A @register_callback("name") decorator to register callbacks easily.
-- Optional helper to auto-register all top-level functions.
+- Optional helper to register an explicit list of top-level functions.
 
 Import this module in the  main app or Modbus worker to access the registry.
 """
 
-from typing import Callable, Dict, Any
+from typing import Callable, Dict, Any, Iterable
 
 # ──────────────────────────────────────────────────────────────
 # Global registry: callback name → function reference
 # ──────────────────────────────────────────────────────────────
 CALLBACK_REGISTRY: Dict[str, Callable[..., Any]] = {}
+# Reverse index: function → callback name. Keyed by the function itself (not
+# its id(), which a new function may reuse once a replaced one is collected).
+_CALLBACK_NAMES: Dict[Callable[..., Any], str] = {}
 
 
 # ──────────────────────────────────────────────────────────────
@@ -32,24 +36,36 @@ def register_callback(name: str):
             ...
     """
     def decorator(func: Callable[..., Any]):
-        CALLBACK_REGISTRY[name] = func
+        _register(name, func)
         return func
     return decorator
 
 
+def _register(name: str, func: Callable[..., Any]):
+    """Add name ↔ func to the registry, keeping the reverse index in sync."""
+    previous = CALLBACK_REGISTRY.get(name)
+    if previous is not None and _CALLBACK_NAMES.get(previous) == name:
+        del _CALLBACK_NAMES[previous]
+    CALLBACK_REGISTRY[name] = func
+    _CALLBACK_NAMES[func] = name
+
+
 # ──────────────────────────────────────────────────────────────
-# Optional helper: auto-register all top-level functions
+# Optional helper: register an explicit list of top-level functions
 # ──────────────────────────────────────────────────────────────
-def auto_register_callbacks(module_globals: Dict[str, Any]):
+def auto_register_callbacks(module_globals: Dict[str, Any], names: Iterable[str]):
     """
-    Automatically register all top-level functions in the caller module.
+    Register the listed top-level functions of the caller module (opt-in:
+    functions not listed are never added to the registry).
     Example use at bottom of a file:
-        auto_register_callbacks(globals())
+        auto_register_callbacks(globals(), ["record_and_log", "log_to_browser"])
     """
     import inspect
-    for name, obj in module_globals.items():
-        if inspect.isfunction(obj):
-            CALLBACK_REGISTRY[name] = obj
+    for name in names:
+        obj = module_globals.get(name)
+        if not inspect.isfunction(obj):
+            raise ValueError(f"Cannot register callback '{name}': not a function")
+        _register(name, obj)
 
 
 # ──────────────────────────────────────────────────────────────
@@ -64,7 +80,10 @@ def get_callback_name(func) -> str | None:
     Given a function reference, return its registered callback name.
     Returns None if not found.
     """
-    for name, registered_func in CALLBACK_REGISTRY.items():
-        if registered_func is func:
-            return name
-    return None
\ No newline at end of file
+    try:
+        name = _CALLBACK_NAMES.get(func)
+    except TypeError:  # unhashable callable, never registered
+        return None
+    if name is not None and CALLBACK_REGISTRY.get(name) is func:
+        return name
+    return None
@@ -0,0 +1,189 @@
+"""
+config_reload.py
+----------------
+Hot reload of config.yaml.
+
+This module provides:
+- load_config(): parse and minimally validate a config file.
+- diff_keys(): compare two lists of keys (action keys...) by identity.
+- key_generation(): digest of the key lists, sent back by the pages with
+  every key event so that a page built before a reload is detected.
+- restart_needed(): the sections that only apply after a restart.
+- reload_tasks(): stops, restarts or reschedules the running tasks of the
+  action keys that a new configuration removed, renamed or changed.
+- ConfigWatcher: a thread polling the config file (mtime/size) and calling
+  a reload function when it changes; reload() can also be called directly
+  (e.g. from an HTTP endpoint).
+
+Applying a new configuration (layout, policies) is up to the application,
+with reload_tasks() for the running tasks: the watcher only detects, parses
+and hands over the new dict.
+An invalid file is logged and ignored, the running configuration stays.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import logging
+import yaml
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_KEYS = ("data_path", "serial", "base_keys", "function_keys", "action_keys")
+# sections only read at startup: a change is reported, applied at the next restart
+RESTART_KEYS = ("serial", "data_path", "state", "rollups", "log_file", "log_max_bytes",
+                "log_backup_count", "bus_trace", "reload")
+
+
+def load_config(path: str) -> Dict[str, Any]:
+    """Parse a config file; ValueError if it is not a mapping or misses a required key."""
+    with open(path, "r") as f:
+        config = yaml.safe_load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f"{path}: not a YAML mapping")
+    missing = [k for k in REQUIRED_KEYS if k not in config]
+    if missing:
+        raise ValueError(f"{path}: missing keys {missing}")
+    return config
+
+
+def diff_keys(old: Sequence[Dict], new: Sequence[Dict], ident: Callable[[Dict], str]
+              ) -> Tuple[List[str], List[str], List[str]]:
+    """(added, removed, changed) identities between two key lists.
+
+    A key is "changed" when its definition or its position (index used in
+    the component ids) differs.
+    """
+    old_keys = {ident(k): (i, k) for i, k in enumerate(old)}
+    new_keys = {ident(k): (i, k) for i, k in enumerate(new)}
+    added = [k for k in new_keys if k not in old_keys]
+    removed = [k for k in old_keys if k not in new_keys]
+    changed = [k for k in new_keys if k in old_keys and old_keys[k] != new_keys[k]]
+    return added, removed, changed
+
+
+def key_generation(*key_lists: Sequence[Dict]) -> str:
+    """Short digest of the key lists (definitions and order).
+
+    Key events carry an index into these lists: a page whose generation
+    differs from the server's was built before a reload that may have
+    reordered them, and its events must be rejected.
+    """
+    data = json.dumps(key_lists, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()[:12]
+
+
+def restart_needed(old: Dict[str, Any], new: Dict[str, Any],
+                   keys: Sequence[str] = RESTART_KEYS) -> List[str]:
+    """Sections of `keys` whose value differs between two configurations."""
+    return [k for k in keys if new.get(k) != old.get(k)]
+
+
+def _same_channel(old: Dict, new: Dict) -> bool:
+    """True when `new` is `old` under another label: same action and file, or
+    the same definition apart from the label."""
+    if old.get("action") != new.get("action"):
+        return False
+    if old.get("file") is not None:
+        return old.get("file") == new.get("file")
+    def strip(key):
+        return {k: v for k, v in key.items() if k != "label"}
+    return strip(old) == strip(new)
+
+
+def reload_tasks(worker, old_keys: Sequence[Dict], new_keys: Sequence[Dict],
+                 old_maps: Dict[str, Any], new_maps: Dict[str, Any],
+                 ident: Callable[[Dict], str], build_task: Callable[[int, Dict], Any]
+                 ) -> Dict[str, Any]:
+    """Bring the running tasks of the action keys in line with `new_keys`.
+
+    worker: a ModbusWorker (tasks, create_task, replace_task, delete_task);
+    ident(key) is the task id of a key, build_task(index, key) its task
+    (None for an invalid key). Only running tasks are touched:
+    - a removed key's task is stopped;
+    - a renamed key's task (same action and file under a new label, see
+      _same_channel) is restarted under its new id;
+    - a key whose definition, position or register map changed is
+      rescheduled, or stopped when it no longer builds a task.
+    """
+    added, removed, changed = diff_keys(old_keys, new_keys, ident)
+    maps_changed = {name for name in set(old_maps) | set(new_maps)
+                    if old_maps.get(name) != new_maps.get(name)}
+    old_by_id = {ident(k): k for k in old_keys}
+    candidates = {ident(k): (i, k) for i, k in enumerate(new_keys) if ident(k) in added}
+    stopped, rescheduled, renamed = [], [], {}
+    for task_id in removed:
+        if task_id not in worker.tasks:
+            continue
+        worker.delete_task(worker.tasks[task_id])
+        new_id = next((new_id for new_id, (_, key) in candidates.items()
+                       if new_id not in worker.tasks and _same_channel(old_by_id[task_id], key)), None)
+        task = build_task(*candidates[new_id]) if new_id is not None else None
+        if task is None:
+            stopped.append(task_id)
+        else:
+            worker.create_task(task)
+            renamed[task_id] = new_id
+    for index, key in enumerate(new_keys):
+        task_id = ident(key)
+        if task_id not in worker.tasks or task_id in renamed.values():
+            continue
+        if task_id not in changed and key.get("map") not in maps_changed:
+            continue
+        task = build_task(index, key)
+        if task is None:
+            worker.delete_task(worker.tasks[task_id])
+            stopped.append(task_id)
+        else:
+            worker.replace_task(task)
+            rescheduled.append(task_id)
+    return {"added": added, "removed": removed, "changed": changed,
+            "stopped": stopped, "rescheduled": rescheduled, "renamed": renamed}
+
+
+class ConfigWatcher(threading.Thread):
+    """Polls `path` every `interval` seconds and calls on_change(new_config) when it changes."""
+    def __init__(self, path: str, on_change: Callable[[Dict[str, Any]], Any], interval: float = 2.0):
+        super().__init__(daemon=True, name="ConfigWatcher")
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._stamp = self._file_stamp()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def reload(self) -> Any:
+        """Parse the file and apply it now; return what on_change returns (raises on invalid file)."""
+        with self._lock:
+            self._stamp = self._file_stamp()
+            config = load_config(self.path)
+            return self.on_change(config)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            stamp = self._file_stamp()
+            if stamp is None or stamp == self._stamp:
+                continue
+            # let an editor finish writing before parsing
+            time.sleep(0.2)
+            if self._file_stamp() != stamp:
+                continue
+            logger.info(f"Config file {self.path} changed, reloading")
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Config reload failed, keeping the running configuration: {e}")
+
+    def stop(self):
+        self._stop_event.set()
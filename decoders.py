@@ -0,0 +1,206 @@
+"""
+decoders.py
+-----------
+Registry of TUF-2000 register decoders.
+
+This module provides:
+- A global DECODER_REGISTRY that maps format names → Decoder objects.
+- Precompiled struct.Struct objects for every format (no per-sample format parsing).
+- decode_registers(): decode one value, same contract as the historical
+  modbus_worker.decode_modbus_registers().
+- decode_block(): decode a whole register block into many values in one pass,
+  optionally through NumPy (frombuffer + view dtype) when it is installed.
+
+Register convention (TUF-2000 default): every 16-bit register is laid out
+little-endian and multi-register values are stored low word first.
+"""
+
+import struct
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+try:  # optional dependency, only used by decode_block(..., numpy=True)
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the deployment
+    np = None
+
+
+# ──────────────────────────────────────────────────────────────
+# Precompiled packers
+# ──────────────────────────────────────────────────────────────
+@lru_cache(maxsize=64)
+def _register_packer(count: int) -> struct.Struct:
+    """Struct packing `count` 16-bit registers, each little-endian."""
+    return struct.Struct(f"<{count}H")
+
+
+@lru_cache(maxsize=256)
+def _block_struct(code: str, count: int) -> struct.Struct:
+    """Struct unpacking `count` repetitions of `code` in one call."""
+    return struct.Struct(f"<{code * count}")
+
+
+def registers_to_bytes(registers: Sequence[int]) -> bytes:
+    """Pack a list of 16-bit registers into raw bytes (little-endian registers)."""
+    return _register_packer(len(registers)).pack(*registers)
+
+
+def _swap_words(registers: Sequence[int]) -> List[int]:
+    """Swap each pair of registers (high word first → low word first)."""
+    swapped = list(registers)
+    swapped[0::2] = registers[1::2]
+    swapped[1::2] = registers[0::2]
+    return swapped
+
+
+# BCD byte → value (0..99), None for bytes holding a non decimal nibble
+_BCD_BYTE = [
+    (b >> 4) * 10 + (b & 0x0F) if (b >> 4) < 10 and (b & 0x0F) < 10 else None
+    for b in range(256)
+]
+
+
+# ──────────────────────────────────────────────────────────────
+# Decoder definition and registry
+# ──────────────────────────────────────────────────────────────
+@dataclass(frozen=True)
+class Decoder:
+    """
+    How to turn `nbreg` registers into one value.
+
+    code    : struct code unpacking one value ('' for custom decoders)
+    ndigits : rounding applied to the decoded value (None = no rounding)
+    swap    : registers are stored high word first and must be swapped
+    dtype   : NumPy dtype used by the vectorised path (None = not supported)
+    convert : custom decoder taking the register list of one value
+    """
+    name: str
+    nbreg: int
+    code: str = ""
+    ndigits: Optional[int] = None
+    swap: bool = False
+    dtype: Optional[str] = None
+    convert: Optional[Callable[[Sequence[int]], Any]] = None
+
+    def __post_init__(self):
+        # precompile the single value packer/unpacker once
+        single = struct.Struct("<" + self.code) if self.code else None
+        object.__setattr__(self, "_single", single)
+        object.__setattr__(self, "_packer", _register_packer(self.nbreg))
+
+    def decode(self, registers: Sequence[int]) -> Any:
+        """Decode the first value found in `registers`."""
+        regs = registers[:self.nbreg]
+        if self.convert is not None:
+            return self.convert(regs)
+        if self.swap:
+            regs = _swap_words(regs)
+        value = self._single.unpack(self._packer.pack(*regs))
+        value = value[0] if len(value) == 1 else sum(value)
+        return round(value, self.ndigits) if self.ndigits is not None else value
+
+    def decode_many(self, registers: Sequence[int], count: int) -> List[Any]:
+        """Decode `count` consecutive values from `registers`."""
+        regs = registers[:count * self.nbreg]
+        if self.convert is not None:
+            n = self.nbreg
+            return [self.convert(regs[i:i + n]) for i in range(0, len(regs), n)]
+        if self.swap:
+            regs = _swap_words(regs)
+        values = _block_struct(self.code, count).unpack(registers_to_bytes(regs))
+        width = len(self.code)
+        if width > 1:  # composite values (LONG + REAL) are summed per record
+            values = [sum(values[i:i + width]) for i in range(0, len(values), width)]
+        if self.ndigits is not None:
+            nd = self.ndigits
+            return [round(v, nd) for v in values]
+        return list(values)
+
+
+DECODER_REGISTRY: Dict[str, Decoder] = {}
+
+
+def register_decoder(decoder: Decoder) -> Decoder:
+    """Register (or replace) a decoder under its name."""
+    DECODER_REGISTRY[decoder.name] = decoder
+    return decoder
+
+
+def get_decoder(fmt: str) -> Decoder:
+    """Return the decoder registered for `fmt` or raise ValueError."""
+    try:
+        return DECODER_REGISTRY[fmt]
+    except KeyError:
+        raise ValueError(f"Unknown format: {fmt}") from None
+
+
+def _decode_bcd(registers: Sequence[int]) -> Optional[int]:
+    """Decode BCD registers (most significant register first) into an int."""
+    value = 0
+    for reg in registers:
+        hi = _BCD_BYTE[(reg >> 8) & 0xFF]
+        lo = _BCD_BYTE[reg & 0xFF]
+        if hi is None or lo is None:
+            raise ValueError(f"Invalid BCD register value: {reg:#06x}")
+        value = value * 10000 + hi * 100 + lo
+    return value
+
+
+# ──────────────────────────────────────────────────────────────
+# TUF-2000 data types
+# ──────────────────────────────────────────────────────────────
+register_decoder(Decoder("INTEGER", 1, code="H", dtype="<u2"))
+register_decoder(Decoder("LONG", 2, code="i", dtype="<i4"))
+register_decoder(Decoder("REAL4", 2, code="f", ndigits=4, dtype="<f4"))
+register_decoder(Decoder("REAL4_WS", 2, code="f", ndigits=4, swap=True, dtype="<f4"))
+register_decoder(Decoder("REAL8", 4, code="d", dtype="<f8"))
+# totaliser: integer part (LONG) followed by its fractional part (REAL4)
+register_decoder(Decoder("LONG_REAL", 4, code="if", ndigits=4))
+register_decoder(Decoder("BCD", 1, convert=_decode_bcd))
+
+
+# ──────────────────────────────────────────────────────────────
+# Public decoding helpers
+# ──────────────────────────────────────────────────────────────
+def decode_registers(registers: Sequence[int], fmt: str = "REAL4") -> Any:
+    """Decode list of 16-bit registers into a Python value (None if empty)."""
+    if not registers:
+        return None
+    return get_decoder(fmt).decode(registers)
+
+
+def decode_block(registers: Sequence[int], fmt: str = "REAL4",
+                 count: Optional[int] = None, numpy: bool = False):
+    """
+    Decode a register block holding `count` consecutive values of `fmt`.
+
+    `count` defaults to as many whole values as the block holds.
+    With numpy=True the block is decoded with np.frombuffer + a view dtype
+    and an ndarray is returned; otherwise a list is returned.
+    """
+    decoder = get_decoder(fmt)
+    if count is None:
+        count = len(registers) // decoder.nbreg
+    if count <= 0:
+        return np.empty(0) if (numpy and np is not None) else []
+    if len(registers) < count * decoder.nbreg:
+        raise ValueError(
+            f"Block of {len(registers)} registers too short for {count} x {fmt}")
+
+    if not numpy:
+        return decoder.decode_many(registers, count)
+
+    if np is None:
+        raise RuntimeError("decode_block(numpy=True) requires numpy to be installed")
+    if decoder.dtype is None:
+        # no flat dtype for this format: decode in Python, return an array
+        return np.asarray(decoder.decode_many(registers, count))
+
+    regs = np.frombuffer(registers_to_bytes(registers[:count * decoder.nbreg]), dtype="<u2")
+    if decoder.swap:
+        regs = np.ascontiguousarray(regs.reshape(-1, 2)[:, ::-1]).reshape(-1)
+    values = regs.view(decoder.dtype)
+    if decoder.ndigits is not None:
+        values = np.round(values.astype(np.float64), decoder.ndigits)
+    return values
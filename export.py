@@ -0,0 +1,252 @@
+"""
+export.py
+---------
+Streaming export of recorded channels over HTTP.
+
+GET /export?channel=<file>[&channel=<file>...]&start=<ts>&end=<ts>&format=csv|ndjson&gzip=1
+           [&resolution=<seconds>]
+
+- Everything is generated chunk by chunk: memory stays flat whatever the
+  export size, and reads go through the recordings index/mmap (no lock is
+  held while streaming, acquisition keeps appending).
+- Several channels are merged into one time-aligned export. Without
+  `resolution`, rows are joined on their exact timestamp: channels recorded
+  by different tasks rarely share one, so expect one row per sample with
+  the other channels empty. With `resolution=N` the timestamps are aligned
+  on N second buckets: one row per bucket, each channel holding its last
+  sample of the bucket (empty if it has none).
+- Only the channels of the configured recording keys can be exported (the
+  state file, logs, traces and rollup files of data_path cannot).
+- A single channel exported as plain CSV is the header line followed by
+  the raw bytes of the range, taken from its closed (rotated, possibly
+  compressed) segments and its active file: the length is known upfront
+  and HTTP Range requests (resume) are supported. Give an explicit `end` to
+  resume an export of a channel that is still recording.
+"""
+
+import heapq
+import json
+import os
+import re
+import zlib
+from typing import Collection, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from flask import Response, jsonify
+
+from recordings import RawPiece, Recording, RecordingStore, epoch_to_ts, ts_to_epoch
+
+CHUNK_SIZE = 64 * 1024
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+# ──────────────────────────────────────────────────────────────
+# Row sources
+# ──────────────────────────────────────────────────────────────
+def _channel_label(rec: Recording) -> str:
+    return os.path.splitext(rec.file)[0]
+
+
+def export_columns(recs: Sequence[Recording]) -> List[str]:
+    """Output value columns; channel prefixed when several channels are merged."""
+    if len(recs) == 1:
+        return recs[0].columns()
+    columns = []
+    for rec in recs:
+        label = _channel_label(rec)
+        cols = rec.columns()
+        columns.extend([label] if cols == ["value"] else [f"{label}.{c}" for c in cols])
+    return columns
+
+
+def _tagged_rows(rec: Recording, i: int, start: Optional[str], end: Optional[str]):
+    for ts, values in rec.iter_rows(start, end):
+        yield ts, i, values
+
+
+def merged_rows(recs: Sequence[Recording], start: Optional[str], end: Optional[str],
+                resolution: int = 0) -> Iterator[Tuple[str, List[str]]]:
+    """Rows of several recordings merged on their timestamps, or on the start of
+    their `resolution` second bucket (last sample of each channel in the bucket)."""
+    if len(recs) == 1 and not resolution:
+        yield from recs[0].iter_rows(start, end)
+        return
+    widths = [len(rec.columns()) for rec in recs]
+    offsets = [sum(widths[:i]) for i in range(len(recs))]
+    total = sum(widths)
+    streams = [_tagged_rows(rec, i, start, end) for i, rec in enumerate(recs)]
+    current_ts, row = None, None
+    for ts, i, values in heapq.merge(*streams, key=lambda r: (r[0], r[1])):
+        if resolution:
+            t = ts_to_epoch(ts)
+            ts = epoch_to_ts(t - t % resolution)
+        if ts != current_ts:
+            if row is not None:
+                yield current_ts, row
+            current_ts, row = ts, [""] * total
+        row[offsets[i]:offsets[i] + widths[i]] = values[:widths[i]]
+    if row is not None:
+        yield current_ts, row
+
+
+# ──────────────────────────────────────────────────────────────
+# Encoders (generators of bytes chunks)
+# ──────────────────────────────────────────────────────────────
+def _batched(lines: Iterable[str]) -> Iterator[bytes]:
+    buf, size = [], 0
+    for line in lines:
+        buf.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(buf).encode("utf-8")
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+
+def csv_chunks(columns: Sequence[str], rows: Iterable[Tuple[str, List[str]]]) -> Iterator[bytes]:
+    header = "timestamp," + ",".join(columns) + "\n"
+    return _batched(
+        line for part in ([header], (ts + "," + ",".join(values) + "\n" for ts, values in rows))
+        for line in part)
+
+
+def _json_value(value: str):
+    if value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def ndjson_chunks(columns: Sequence[str], rows: Iterable[Tuple[str, List[str]]]) -> Iterator[bytes]:
+    def lines():
+        for ts, values in rows:
+            record = {"timestamp": ts}
+            record.update(zip(columns, map(_json_value, values)))
+            yield json.dumps(record, separators=(",", ":")) + "\n"
+    return _batched(lines())
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def pieces_range_chunks(pieces: Sequence[RawPiece], first: int, stop: int) -> Iterator[bytes]:
+    """Bytes [first, stop) of the concatenation of raw pieces."""
+    offset = 0
+    for piece in pieces:
+        size = len(piece)
+        if offset + size > first and offset < stop:
+            yield from piece.chunks(max(first - offset, 0), min(stop - offset, size), CHUNK_SIZE)
+        offset += size
+        if offset >= stop:
+            break
+
+
+# ──────────────────────────────────────────────────────────────
+# HTTP
+# ──────────────────────────────────────────────────────────────
+def _parse_range(header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+    """(first, last) byte of a single "bytes=" range; None when absent; ValueError if unsatisfiable."""
+    if not header:
+        return None
+    m = _RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        raise ValueError(header)
+    if not m.group(1):  # suffix range: last N bytes
+        first, last = max(0, length - int(m.group(2))), length - 1
+    else:
+        first = int(m.group(1))
+        last = min(int(m.group(2)), length - 1) if m.group(2) else length - 1
+    if first > last or first >= length:
+        raise ValueError(header)
+    return first, last
+
+
+def _raw_csv_response(rec: Recording, start: Optional[str], end: Optional[str],
+                      filename: str, range_header: Optional[str]) -> Response:
+    """Single channel plain CSV: header + raw segment bytes, with Range support."""
+    header = ("timestamp," + ",".join(rec.columns()) + "\n").encode("utf-8")
+    # the active file is streamed from the file object the offsets were computed on
+    pieces = rec.raw_pieces(start, end)
+    length = len(header) + sum(len(piece) for piece in pieces)
+
+    def close():
+        for piece in pieces:
+            piece.close()
+
+    try:
+        byte_range = _parse_range(range_header, length)
+    except ValueError:
+        close()
+        return Response(status=416, headers={"Content-Range": f"bytes */{length}"})
+    first, last = byte_range if byte_range else (0, length - 1)
+
+    def body():
+        if first < len(header):
+            yield header[first:last + 1]
+        data_first = max(first - len(header), 0)
+        data_stop = last + 1 - len(header)
+        if data_stop > data_first:
+            yield from pieces_range_chunks(pieces, data_first, data_stop)
+
+    headers = {"Accept-Ranges": "bytes",
+               "Content-Length": str(last - first + 1),
+               "Content-Disposition": f'attachment; filename="{filename}"'}
+    status = 200
+    if byte_range:
+        status = 206
+        headers["Content-Range"] = f"bytes {first}-{last}/{length}"
+    response = Response(body(), status=status, mimetype="text/csv", headers=headers)
+    response.call_on_close(close)
+    return response
+
+
+def export_response(recordings: RecordingStore, args, headers,
+                    channels: Optional[Collection[str]] = None) -> Response:
+    """Build the streaming response of an /export request (args: request.args);
+    `channels`: the exportable file names (None: any recording of data_path)."""
+    files = args.getlist("channel")
+    fmt = args.get("format", "csv")
+    gzip = args.get("gzip", "0").lower() in ("1", "true", "yes")
+    start, end = args.get("start"), args.get("end")
+    if not files:
+        return jsonify(error="missing 'channel' parameter"), 400
+    if fmt not in ("csv", "ndjson"):
+        return jsonify(error=f"unknown format '{fmt}'"), 400
+    try:
+        resolution = int(args.get("resolution") or 0)
+        if resolution < 0:
+            raise ValueError
+    except ValueError:
+        return jsonify(error="'resolution' must be a number of seconds"), 400
+    if channels is not None:
+        unknown = [f for f in files if f not in channels]
+        if unknown:
+            return jsonify(error=f"unknown channel(s): {', '.join(unknown)}"), 404
+    try:
+        recs = [recordings.get(f) for f in files]
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    missing = [rec.file for rec in recs if not os.path.exists(rec.path) and not rec.closed_segments()]
+    if missing:
+        return jsonify(error=f"unknown channel(s): {', '.join(missing)}"), 404
+
+    filename = "_".join(_channel_label(rec) for rec in recs) + "." + fmt
+    if fmt == "csv" and not gzip and len(recs) == 1 and not resolution:
+        return _raw_csv_response(recs[0], start, end, filename, headers.get("Range"))
+
+    columns = export_columns(recs)
+    rows = merged_rows(recs, start, end, resolution)
+    chunks = csv_chunks(columns, rows) if fmt == "csv" else ndjson_chunks(columns, rows)
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if gzip:
+        chunks, mimetype, filename = gzip_chunks(chunks), "application/gzip", filename + ".gz"
+    return Response(chunks, mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
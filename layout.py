@@ -1,7 +1,13 @@
 from dash import dcc, html
 
-def build_layout(baseKeys, functionKeys, composite_keys, register_keys):
-    """Builds and returns the full Dash layout."""
+def build_layout(baseKeys, functionKeys, composite_keys, register_keys, generation=None,
+                 show_latency=False):
+    """Builds and returns the full Dash layout.
+
+    `generation` identifies the key lists the page is built from; it is sent
+    back with every key event (see stale_page() in tufGuiDash.py).
+    `show_latency` adds the key acknowledgement round-trip readout (diagnostics).
+    """
 
     # ── Generate composite button rows ──────────────────────────────
     composite_button_rows = []
@@ -34,8 +40,17 @@ def build_layout(baseKeys, functionKeys, composite_keys, register_keys):
     return html.Div([
     # This invisible component triggers callbacks on page load/reload
     dcc.Location(id="url", refresh=False),
+    # task state pushed over the socket ({task_id: true}) and the task id of
+    # each record button: button colors are computed in the browser
+    dcc.Store(id="task-state", data={}),
+    dcc.Store(id="action-task-ids", data=[k["label"].replace(" ", "_") for k in register_keys]),
+    # dummy output of the clientside callbacks sending key presses over the socket
+    dcc.Store(id="key-sent"),
+    dcc.Store(id="layout-generation", data=generation),
 
     html.H2("Modbus Virtual Keyboard"),
+    # set by the 'keypad_busy' socket message while another operator holds the keypad
+    html.Div(id="keypad-status", style={"color": "darkorange", "minHeight": "1.2em"}),
 
     # Base buttons
     html.Div([
@@ -68,6 +83,9 @@ def build_layout(baseKeys, functionKeys, composite_keys, register_keys):
         *composite_button_rows,
         html.Hr(),
         html.Div(id="response", style={"marginTop": "10px", "color": "blue"}),
+        # round-trip time of the key presses (socket acknowledgement), ui: key_latency
+        *([html.Div(id="socket-latency", style={"marginTop": "4px", "color": "gray", "fontSize": "0.8em"})]
+          if show_latency else []),
     ]),
 
     html.Hr(),
@@ -120,4 +138,20 @@ def build_layout(baseKeys, functionKeys, composite_keys, register_keys):
         "alignItems": "center",                  # center on desktop
         "padding": "0 10px",
     }),
-],style={'padding': '20px'})
+
+    html.Hr(),
+    # Volumes integrated from the recorded flows (filled by the analytics callback)
+    html.H3("volumes"),
+    html.Div([
+        dcc.RadioItems(
+            id="analytics-period",
+            options=[{"label": "24 h", "value": 1}, {"label": "7 days", "value": 7},
+                     {"label": "30 days", "value": 30}, {"label": "1 year", "value": 365}],
+            value=1,
+            inline=True,
+            style={"marginRight": "10px"},
+        ),
+        html.Button("refresh", id="analytics-refresh", n_clicks=0),
+    ], style={"display": "flex", "alignItems": "center", "marginBottom": "10px"}),
+    html.Div(id="analytics-summary", style={"overflowX": "auto"}),
+],style={'padding': '20px'})
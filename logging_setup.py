@@ -0,0 +1,71 @@
+"""
+logging_setup.py
+----------------
+Non-blocking logging configuration for the TUF2000 service.
+
+Every logger writes to a QueueHandler; a QueueListener thread does the
+actual I/O, so a slow SD card never stalls the Modbus worker thread.
+
+config.yaml keys (all optional):
+    log_level        : root level name (default "INFO")
+    log_file         : rotating log file; stdout when empty
+    log_max_bytes    : size that triggers a rotation (default 5 MB)
+    log_backup_count : number of rotated files kept (default 5)
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from typing import Any, Dict
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+
+def setup_logging(config: Dict[str, Any]) -> logging.handlers.QueueListener:
+    """Configure the root logger from config; return the started QueueListener."""
+    level_name = str(config.get("log_level", "INFO")).upper()
+    level = logging.getLevelName(level_name)
+    if not isinstance(level, int):
+        level = logging.INFO
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handler = None
+    log_file = config.get("log_file")
+    if log_file:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=int(config.get("log_max_bytes", 5 * 1024 * 1024)),
+                backupCount=int(config.get("log_backup_count", 5)),
+                encoding="utf-8",
+            )
+        except OSError as e:
+            print(f"Cannot open log file {log_file} ({e}); logging to stdout", file=sys.stderr)
+    if handler is None:
+        handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(formatter)
+
+    # producers only enqueue; the listener thread formats and writes
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener: logging.handlers.QueueListener):
+    """Flush pending records at exit (no-op if the listener was already stopped)."""
+    try:
+        listener.stop()
+    except AttributeError:
+        pass
@@ -3,11 +3,11 @@ import threading
 import json
 import os
 import time
-import struct
 from collections import deque
 from dataclasses import dataclass, field
-from typing import Any, Dict, Callable,Optional
+from typing import Any, Dict, Callable,Optional, Tuple
 from callbacks import  get_callback_name,CALLBACK_REGISTRY   
+from decoders import Decoder, decode_registers, get_decoder
 import random
 import logging
 
@@ -29,10 +29,32 @@ class Task:
     parameters: Dict[str, Any] = field(default_factory=dict)
     recurrence: float = 0.0
     urgent: bool = False
+    # compiled read plan of "snapshot" tasks (rebuilt from modbus_param, never saved)
+    register_map: Optional["RegisterMap"] = field(default=None, repr=False, compare=False)
+    # pre-resolved dispatch data, filled once by resolve() (never saved)
+    decoder: Optional[Decoder] = field(default=None, repr=False, compare=False)
+    resolved_io: Optional[Tuple[str, int, int, Any]] = field(default=None, repr=False, compare=False)
+    # time.monotonic() of the last push into the queue (queue wait statistics)
+    queued_at: float = field(default=0.0, repr=False, compare=False)
 
     def is_periodic(self) -> bool:
         return self.recurrence > 0
 
+    def resolve(self):
+        """Resolve once what execute_task needs on every sample:
+        callback name, (op, addr, nbreg, value), decoder and snapshot read plan."""
+        if self.callback and not self.callback_name:
+            self.callback_name = get_callback_name(self.callback)
+        mod = self.modbus_param
+        op = mod.get("op")
+        value = mod.get("value")
+        self.resolved_io = (op, int(mod.get("addr", 0)), int(mod.get("nbreg", 1)),
+                            int(value) if value is not None else None)
+        if op == "read":
+            self.decoder = get_decoder(mod.get("format", "INTEGER"))
+        elif op == "snapshot" and self.register_map is None:
+            self.register_map = RegisterMap(mod["fields"], max_gap=int(mod.get("max_gap", 24)))
+
     def __repr__(self):
         return f"<Task id={self.task_id}, op={self.modbus_param.get('op')}, rec={self.recurrence}s>"
 # ----------------------------------------------------------------------
@@ -40,9 +62,14 @@ class Task:
 # ----------------------------------------------------------------------
 
 class TaskQueue:
-    """Thread-safe deque-based task queue with top/bottom insert."""
+    """Thread-safe deque-based task queue with top/bottom insert.
+
+    Items pushed on top (urgent) run before the others, in the order they
+    were pushed: a sequence of keypad writes keeps its order.
+    """
     def __init__(self):
         self.q = deque()
+        self.urgent = deque()
         self.lock = threading.Lock()
 
     def push_bottom(self, item):
@@ -51,15 +78,17 @@ class TaskQueue:
 
     def push_top(self, item):
         with self.lock:
-            self.q.appendleft(item)
+            self.urgent.append(item)
 
     def pop_bottom(self):
         with self.lock:
+            if self.urgent:
+                return self.urgent.popleft()
             return self.q.popleft() if self.q else None
     def size(self):
         """Return the number of items currently in the queue."""
         with self.lock:
-            return len(self.q)
+            return len(self.q) + len(self.urgent)
 
 
 # ----------------------------------------------------------------------
@@ -67,29 +96,154 @@ class TaskQueue:
 # ----------------------------------------------------------------------
 
 def decode_modbus_registers(registers, fmt="REAL4"):
-    """Decode list of 16-bit registers into a Python value (little-endian)."""
-    if not registers:
-        return None
-    raw = b"".join(r.to_bytes(2, "little") for r in registers)
-
-    if fmt == "REAL4":      # 32-bit float
-        return round(struct.unpack("<f", raw[:4])[0], 4)
-    elif fmt == "LONG":     # 32-bit signed int
-        return struct.unpack("<i", raw[:4])[0]
-    elif fmt == "INTEGER":  # single 16-bit int
-        return registers[0]
-    elif fmt == "REAL8":    # 64-bit float
-        return struct.unpack("<d", raw[:8])[0]
-    else:
-        raise ValueError(f"Unknown format: {fmt}")
+    """Decode list of 16-bit registers into a Python value (little-endian).
+
+    Kept for compatibility; decoding is done by the precompiled decoders
+    registered in decoders.DECODER_REGISTRY.
+    """
+    return decode_registers(registers, fmt)
+
+
+# ----------------------------------------------------------------------
+# Register map used by "snapshot" tasks
+# ----------------------------------------------------------------------
+
+# Modbus limit for one read holding registers request
+MAX_READ_COUNT = 125
+
+
+class RegisterMap:
+    """Named register fields read together in as few block reads as possible.
+
+    fields: list of {"name": ..., "addr": ..., "format": ...}; addresses follow
+    the same convention as the "addr" of record action keys.
+    Fields closer than `max_gap` unused registers are merged into the same
+    read, as long as a block stays within MAX_READ_COUNT registers: at 9600
+    bauds an extra register costs ~2 ms while an extra frame costs a full
+    request/turnaround/response cycle.
+    """
+    def __init__(self, fields, max_gap: int = 24, max_count: int = MAX_READ_COUNT):
+        self.fields = []
+        for f in fields:
+            decoder = get_decoder(f.get("format", "REAL4"))
+            self.fields.append((f["name"], int(f["addr"]), decoder))
+        self.fields.sort(key=lambda f: f[1])
+
+        # blocks: [start, count, [(name, offset, decoder), ...]]
+        self.blocks = []
+        for name, addr, decoder in self.fields:
+            end = addr + decoder.nbreg
+            if self.blocks:
+                block = self.blocks[-1]
+                start, count = block[0], block[1]
+                if addr - (start + count) <= max_gap and max(end - start, count) <= max_count:
+                    block[1] = max(count, end - start)
+                    block[2].append((name, addr - start, decoder))
+                    continue
+            self.blocks.append([addr, decoder.nbreg, [(name, 0, decoder)]])
+
+    def names(self):
+        """Field names, in address order."""
+        return [name for name, _, _ in self.fields]
+
+    def decode(self, block_registers):
+        """Decode the registers of every block (same order as self.blocks) into a record."""
+        record = {}
+        for (_, _, members), registers in zip(self.blocks, block_registers):
+            for name, offset, decoder in members:
+                record[name] = decoder.decode(registers[offset:offset + decoder.nbreg])
+        return record
+
+
+# ----------------------------------------------------------------------
+# Transaction statistics
+# ----------------------------------------------------------------------
+class TransactionStats:
+    """Counters and recent timings of the executed tasks.
+
+    bus  : seconds spent on the Modbus operation of a task (all its frames, decoding)
+    wait : seconds between the push into the queue and the execution
+    The last `window` tasks are kept for the percentiles; per task id, the
+    count, frames, mean and max bus time are kept since the last reset.
+    """
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.since = time.time()
+            self.tasks = 0
+            self.frames = 0
+            self.errors = 0
+            self.max_queue = 0
+            self.bus = deque(maxlen=self.window)
+            self.wait = deque(maxlen=self.window)
+            self.per_task = {}  # task_id → [count, frames, total bus, max bus]
+
+    def record(self, wait: float, bus: float, frames: int, queue_size: int, error: bool = False,
+               task_id: Optional[str] = None):
+        with self.lock:
+            self.tasks += 1
+            self.frames += frames
+            self.errors += error
+            if queue_size > self.max_queue:
+                self.max_queue = queue_size
+            self.bus.append(bus)
+            self.wait.append(wait)
+            if task_id is not None:
+                entry = self.per_task.get(task_id)
+                if entry is None:
+                    entry = self.per_task[task_id] = [0, 0, 0.0, 0.0]
+                entry[0] += 1
+                entry[1] += frames
+                entry[2] += bus
+                if bus > entry[3]:
+                    entry[3] = bus
+
+    @staticmethod
+    def _percentiles(values) -> Dict[str, Optional[float]]:
+        if not values:
+            return {"p50": None, "p95": None, "max": None}
+        ordered = sorted(values)
+        n = len(ordered)
+        return {"p50": ordered[n // 2], "p95": ordered[min(n - 1, int(n * 0.95))], "max": ordered[-1]}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters since the last reset and percentiles (seconds) of the recent tasks."""
+        with self.lock:
+            elapsed = max(time.time() - self.since, 1e-9)
+            bus, wait = list(self.bus), list(self.wait)
+            return {
+                "elapsed": elapsed,
+                "tasks": self.tasks,
+                "frames": self.frames,
+                "errors": self.errors,
+                "tasks_per_s": self.tasks / elapsed,
+                "bus_busy": sum(bus) / elapsed if self.tasks <= self.window else None,
+                "max_queue": self.max_queue,
+                "bus": self._percentiles(bus),
+                "wait": self._percentiles(wait),
+                "per_task": {tid: {"count": n, "frames": frames, "bus_mean": total / n, "bus_max": peak}
+                             for tid, (n, frames, total, peak) in self.per_task.items()},
+            }
 
 
 # ----------------------------------------------------------------------
 # Modbus Worker
 # ----------------------------------------------------------------------
+def check_response(response, op: str, addr: int):
+    """Raise on a Modbus error response (exception code from the device):
+    the task fails, its callback is not called and it counts in the errors."""
+    if response.isError():
+        raise IOError(f"{op} at {addr}: error response {response}")
+
 
 class ModbusWorker(threading.Thread):
-    def __init__(self, client,state_file: str = ""):
+    def __init__(self, client,state_file: str = "", save_delay: float = 1.0,
+                 journal: bool = False, journal_limit: int = 200,
+                 on_task_change: Optional[Callable[[str, "Task"], None]] = None):
         super().__init__(daemon=True)
         self.client = client
         self.queue = TaskQueue()
@@ -97,6 +251,20 @@ class ModbusWorker(threading.Thread):
         self.timers = {}  # task_id → threading.Timer
         self.running = True
         self.state_file = state_file
+        # state persistence: saves of a burst of changes are coalesced into one
+        # write after save_delay seconds; with journal=True every change is
+        # appended to <state_file>.journal and the snapshot is only rewritten
+        # once the journal holds journal_limit entries
+        self.save_delay = save_delay
+        self.journal = journal
+        self.journal_limit = journal_limit
+        self.journal_file = f"{state_file}.journal" if state_file else ""
+        self._journal_entries = 0
+        self._save_timer = None
+        self._state_lock = threading.RLock()
+        # called with ("create"|"delete", task) when a periodic task starts or stops
+        self.on_task_change = on_task_change
+        self.stats = TransactionStats()
 
     # ---------------- main worker loop ----------------
     def run(self):
@@ -116,48 +284,71 @@ class ModbusWorker(threading.Thread):
     # ---------------- execute modbus operation ----------------
     def execute_task(self, task: Task):
         """Perform the Modbus operation for a given task and invoke callback."""
-        mod = task.modbus_param
-        op = mod.get("op")
-        addr = int(mod.get("addr"))
-        nbreg = int(mod.get("nbreg", 1))
-        fmt = mod.get("format", "INTEGER")
-
         value = None
+        started = time.monotonic()
+        wait = started - task.queued_at if task.queued_at else 0.0
+        frames = 0
 
         try:
+            if task.resolved_io is None:
+                task.resolve()
+            op, addr, nbreg, value = task.resolved_io
+            trace_task = getattr(self.client, "trace_task", None)
+            if trace_task is not None:
+                trace_task(task)
             if op == "read":
+                frames = 1
                 response = self.client.read_holding_registers(address=addr, count=nbreg, device_id=1)
-                value = decode_modbus_registers(response.registers, fmt)
-                logger.debug(f"modbus read holding register; addr= {addr}, count={nbreg},value:{value}")
+                check_response(response, op, addr)
+                value = task.decoder.decode(response.registers) if response.registers else None
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("modbus read holding register; addr=%s count=%s value=%s", addr, nbreg, value)
+            elif op == "snapshot":
+                # one record for the whole register map, one frame per block
+                blocks = []
+                for start, count, _ in task.register_map.blocks:
+                    frames += 1
+                    response = self.client.read_holding_registers(address=start, count=count, device_id=1)
+                    check_response(response, op, start)
+                    blocks.append(response.registers)
+                value = task.register_map.decode(blocks)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("modbus snapshot; blocks=%s record=%s", len(blocks), value)
             elif op == "write":
-                value= int(mod.get("value"))
-                logger.debug(f"modbus write register; addr= {addr}, value={value}")
-                self.client.write_register(address=addr, value=value, device_id=1)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("modbus write register; addr=%s value=%s", addr, value)
+                frames = 1
+                response = self.client.write_register(address=addr, value=value, device_id=1)
+                check_response(response, op, addr)
             else:
                 logger.error(f"[ModbusWorker] Unknown Modbus operation: {op}")
                 return
         except Exception as e:
             logger.error(f"[ModbusWorker] Error executing task {task.task_id}: {e}")
+            self.stats.record(wait, time.monotonic() - started, frames, self.queue.size(), error=True,
+                              task_id=task.task_id)
             return
+        self.stats.record(wait, time.monotonic() - started, frames, self.queue.size(),
+                          task_id=task.task_id)
 
         ts = time.strftime("%Y-%m-%d %H:%M:%S")
         if callable(task.callback):
             try:
-                logger.debug(f"[ execute_task] calling callback {get_callback_name(task.callback)}, task_id:{task.task_id},timestamp={ts},value:{value},parameters:{task.parameters}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("[execute_task] calling callback=%s task_id=%s timestamp=%s value=%s",
+                                 task.callback_name, task.task_id, ts, value)
                 task.callback(task_id=task.task_id,value=value, timestamp=ts, **task.parameters)
             except Exception as cb_err:
                 logger.error(f"[ModbusWorker] Callback error for {task.task_id}: {cb_err}")
-                task_cb=get_callback_name(task.callback)
-                logger.error(f"[ModbusWorker] task calback:{task_cb}; parameters for {task.task_id}:{task.parameters}")
+                logger.error(f"[ModbusWorker] task calback:{task.callback_name}; parameters for {task.task_id}:{task.parameters}")
 
     # ---------------- schedule periodic tasks ----------------
     def create_task(self, task: Task,save: bool = True):
         """Register and start a task (one-shot or periodic)."""
         tid = task.task_id
         
-        # Infer callback name automatically if missing
-        if task.callback and not getattr(task, "callback_name", None):
-            task.callback_name = get_callback_name(task.callback)
+        # Resolve callback name, decoder and read plan once, not on every sample
+        task.resolve()
 
         # Check for duplicates; 
         # only periodic tasks are inserted in the task list 
@@ -173,19 +364,20 @@ class ModbusWorker(threading.Thread):
             if not self.running:
                 return
                 
-            # If task has been deleted, stop
-            if tid not in self.tasks:
+            # If task has been deleted (or replaced by a new definition), stop
+            if self.tasks.get(tid) is not task:
                 logger.debug(f"[ModbusWorker] Timer for deleted task '{tid}' exiting.")
                 return
                 
             # Push task into queue (urgent vs normal)
+            task.queued_at = time.monotonic()
             if task.urgent:
                 self.queue.push_top(task)
             else:
                 self.queue.push_bottom(task)
 
             # Reschedule if periodic
-            if task.is_periodic() and self.running and tid in self.tasks:
+            if task.is_periodic() and self.running and self.tasks.get(tid) is task:
                 t = threading.Timer(task.recurrence, timer_callback)
                 t.daemon = True
                 t.start()
@@ -193,19 +385,44 @@ class ModbusWorker(threading.Thread):
 
         # Start initial call immediately
         timer_callback()
+        if task.is_periodic():
+            self._notify("create", task)
         #save state if not already restoring worker state
-        if save:
+        #one-shot tasks are never part of the saved state
+        if save and task.is_periodic():
             logger.info(f"[ModbusWorker] Task '{tid}' created; saving state.")
-            self.save_state()
+            self.state_changed("create", task)
 
     def delete_task(self, task: Task):
         tid = task.task_id  # ✅ extract ID from Task
         timer = self.timers.pop(tid, None)
+        if timer:
+            timer.cancel()
+        removed = self.tasks.pop(tid, None)
+        if removed is not None and removed.is_periodic():
+            logger.info(f"[ModbusWorker] Task '{tid}' stopped; savings state")
+            self.state_changed("delete", removed)
+            self._notify("delete", removed)
+
+    def _notify(self, op: str, task: Task):
+        if self.on_task_change is not None:
+            try:
+                self.on_task_change(op, task)
+            except Exception as e:
+                logger.error(f"[ModbusWorker] Task change listener error for {task.task_id}: {e}")
+
+    def replace_task(self, task: Task):
+        """Swap a running periodic task for a new definition with the same id.
+
+        The old timer is cancelled and the new task starts immediately; the
+        saved state gets one "create" entry (no intermediate delete).
+        """
+        tid = task.task_id
+        timer = self.timers.pop(tid, None)
         if timer:
             timer.cancel()
         self.tasks.pop(tid, None)
-        logger.info(f"[ModbusWorker] Task '{tid}' stopped; savings state")
-        self.save_state()
+        self.create_task(task)
 
     def stop(self):
         """Stop worker and all timers."""
@@ -213,6 +430,7 @@ class ModbusWorker(threading.Thread):
         for t in self.timers.values():
             t.cancel()
         self.timers.clear()
+        self.flush_state()
         print("[Worker] Stopped.")
         
     def get_active_task_ids(self):
@@ -223,39 +441,146 @@ class ModbusWorker(threading.Thread):
     def queue_size(self):
         """Return the number of pending tasks in the queue."""
         return self.queue.size()
+    @staticmethod
+    def _task_state(task: Task) -> Dict[str, Any]:
+        """Serializable description of a periodic task."""
+        return {
+            "task_id": task.task_id,
+            "modbus_param": task.modbus_param,
+            "parameters": task.parameters,
+            "recurrence": task.recurrence,
+            "urgent": task.urgent,
+            "callback_name": task.callback_name,
+        }
+
+    @staticmethod
+    def _write_atomic(path: str, data: str):
+        """Write a file through temp file + fsync + rename: readers see the old or the new content."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        # make the rename itself durable
+        try:
+            dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+
+    def state_changed(self, op: str, task: Task):
+        """Persist a task creation/deletion: journal append or coalesced snapshot."""
+        if not self.state_file:
+            return
+        if self.journal:
+            entry = {"op": op, "task_id": task.task_id}
+            if op == "create":
+                entry["task"] = self._task_state(task)
+            try:
+                with self._state_lock:
+                    with open(self.journal_file, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self._journal_entries += 1
+                if self._journal_entries < self.journal_limit:
+                    return
+            except Exception as e:
+                logger.error(f"Error appending to worker state journal: {e}")
+        self.schedule_save()
+
+    def schedule_save(self):
+        """Save the state after save_delay seconds; changes made meanwhile share the same write."""
+        with self._state_lock:
+            if self._save_timer is not None:
+                return
+            if self.save_delay <= 0:
+                self.save_state()
+                return
+            self._save_timer = threading.Timer(self.save_delay, self.flush_state)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush_state(self):
+        """Write a pending coalesced save now."""
+        with self._state_lock:
+            timer, self._save_timer = self._save_timer, None
+            if timer is None:
+                return
+            timer.cancel()
+            self.save_state()
+
     def save_state(self):
+        """Atomically write the snapshot of periodic tasks and reset the journal."""
+        if not self.state_file:
+            return
         try:
-            state = {}
-            for task_id, task in self.tasks.items():
-                if getattr(task, "recurrence", 0) > 0:
-                    state[task_id] = {
-                        "task_id": task.task_id,
-                        "modbus_param": task.modbus_param,
-                        "parameters": task.parameters,
-                        "recurrence": task.recurrence,
-                        "urgent": task.urgent,
-                        "callback_name": task.callback_name,
-                    }
-            with open(self.state_file, "w") as f:
-                json.dump(state, f, indent=2)
+            with self._state_lock:
+                state = {task.task_id: self._task_state(task)
+                         for task in list(self.tasks.values()) if task.is_periodic()}
+                self._write_atomic(self.state_file, json.dumps(state, indent=2))
+                # the snapshot now holds every journaled change
+                if self.journal_file and os.path.exists(self.journal_file):
+                    os.remove(self.journal_file)
+                self._journal_entries = 0
             logger.info(f"Saved {len(state)} tasks to {self.state_file}")
         except Exception as e:
             logger.error(f"Error saving worker state: {e}")
-        
-        
+
+    def _replay_journal(self, state: Dict[str, Any]) -> Tuple[int, int]:
+        """Apply the journal entries on top of the snapshot state; return the numbers
+        of entries applied and of invalid lines."""
+        if not self.journal_file or not os.path.exists(self.journal_file):
+            return 0, 0
+        applied = invalid = 0
+        with open(self.journal_file, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    if entry["op"] == "create":
+                        state[entry["task_id"]] = entry["task"]
+                    elif entry["op"] == "delete":
+                        state.pop(entry["task_id"], None)
+                    applied += 1
+                except Exception as e:
+                    # a crash while appending leaves at most one partial last line
+                    logger.warning(f"Ignoring invalid journal entry at line {line_no}: {e}")
+                    invalid += 1
+        return applied, invalid
+
     #load the state of the  worker from a file
     def load_state(self):
-        if not os.path.exists(self.state_file):
+        state = {}
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, "r") as f:
+                    state = json.load(f)
+            except Exception as e:
+                # keep the unreadable file aside instead of overwriting it on next save
+                logger.error(f"Error loading worker state file: {e}; moved to {self.state_file}.corrupt")
+                try:
+                    os.replace(self.state_file, f"{self.state_file}.corrupt")
+                except OSError:
+                    pass
+        else:
             logger.info(f"No saved state file found at {self.state_file}")
-            return
 
         try:
-            with open(self.state_file, "r") as f:
-                state = json.load(f)
+            replayed, invalid = self._replay_journal(state)
         except Exception as e:
-            logger.error(f"Error loading worker state file: {e}")
-            return
-        
+            logger.error(f"Error replaying worker state journal: {e}")
+            replayed, invalid = 0, 0
+        if replayed:
+            logger.info(f"Replayed {replayed} journal entries from {self.journal_file}")
+
         #recreate the tasks
         logger.info(f"Restoring  state file from  {self.state_file}")
         for task_id, data in state.items():
@@ -278,4 +603,9 @@ class ModbusWorker(threading.Thread):
                 self.create_task(task,save = False)
                 logger.info(f"Restored task: {task_id} (callback={cb_name})")
             except Exception as e:
-                logger.error(f"Error restoring task {task_id}: {e}")
\ No newline at end of file
+                logger.error(f"Error restoring task {task_id}: {e}")
+
+        # fold the replayed journal into a fresh snapshot; a journal with a torn
+        # line is folded too, else the next append would be glued onto that line
+        if replayed or invalid:
+            self.save_state()
@@ -0,0 +1,866 @@
+"""
+recordings.py
+-------------
+Storage of the recorded channels (one CSV file per channel in data_path).
+
+This module provides:
+- Segment: one uncompressed data file and its sparse time index.
+- Recording: one channel, i.e. its active segment plus its closed (rotated,
+  possibly compressed) segments, read back as one continuous series.
+- RecordingStore: the Recording objects of data_path, the hooks run on every
+  appended row (rollup tiers) and the background segment maintenance
+  (compression, retention).
+
+Range reads use a sparse sidecar index "<file>.idx" ("timestamp,byte offset"
+every index_every rows, extended as rows are appended): the reader bisects it
+to a start offset and streams only the requested range from a memory-mapped
+view of the file.
+
+Rotation (RecordingPolicy, per channel): the active file "<file>" is renamed
+"<file>.<YYYYmmddTHHMMSS>" (timestamp of its first row) every day or once it
+reaches max_bytes; closed segments are then compressed (.gz / .zst) off the
+worker thread and deleted once older than retention_days or beyond
+retention_bytes. The byte budget counts everything the channel keeps on
+disk: segments with their index and analytics caches, the active file and
+the rollup tiers (which expire by their own retention, see rollups.py).
+
+File format: one "timestamp,value[,value...]" row per sample, timestamps in
+TS_FORMAT (local time, lexicographic order = chronological order).
+The index bisection, the range reads, the rollups and the analytics rely on
+timestamps that never go back: the local time zone must have a fixed UTC
+offset (run the service with TZ=UTC). In a zone with daylight saving time the
+fall-back hour repeats timestamps; wall_clock_problem() detects such a zone
+and the service refuses to start in it.
+Multi-field recordings (snapshot tasks) start with a "timestamp,<field>,..."
+header line; single value recordings have no header and one "value" column.
+"""
+
+import bisect
+import calendar
+import gzip
+import io
+import mmap
+import os
+import queue
+import re
+import shutil
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import logging
+
+try:  # optional dependency, only needed for compress: "zstd"
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the deployment
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+HEADER_PREFIX = "timestamp,"
+SEGMENT_STAMP = "%Y%m%dT%H%M%S"
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+# ──────────────────────────────────────────────────────────────
+# Timestamp helpers
+# ──────────────────────────────────────────────────────────────
+_DAY_CACHE: Dict[str, int] = {}
+
+
+def ts_to_epoch(ts: str) -> int:
+    """Seconds since 1970-01-01 of a TS_FORMAT wall clock timestamp (no timezone applied)."""
+    day = ts[:10]
+    base = _DAY_CACHE.get(day)
+    if base is None:
+        base = calendar.timegm((int(ts[0:4]), int(ts[5:7]), int(ts[8:10]), 0, 0, 0, 0, 0, 0))
+        if len(_DAY_CACHE) > 4096:
+            _DAY_CACHE.clear()
+        _DAY_CACHE[day] = base
+    return base + int(ts[11:13]) * 3600 + int(ts[14:16]) * 60 + int(ts[17:19])
+
+
+def epoch_to_ts(seconds: float) -> str:
+    """Inverse of ts_to_epoch()."""
+    return time.strftime(TS_FORMAT, time.gmtime(seconds))
+
+
+def wall_clock_problem(now: Optional[float] = None) -> Optional[str]:
+    """Why local TS_FORMAT timestamps may go back in this time zone (UTC offset
+    changing over the year around `now`); None when the offset is fixed."""
+    now = time.time() if now is None else now
+    offsets = {time.localtime(now + day * 86400).tm_gmtoff for day in range(-366, 367, 7)}
+    if len(offsets) > 1:
+        hours = sorted(offset / 3600 for offset in offsets)
+        return (f"local time zone {'/'.join(time.tzname)} changes its UTC offset "
+                f"({', '.join(f'{h:+g} h' for h in hours)}): timestamps repeat when clocks go back")
+    return None
+
+
+def _ts_to_stamp(ts: str) -> str:
+    return ts[0:4] + ts[5:7] + ts[8:10] + "T" + ts[11:13] + ts[14:16] + ts[17:19]
+
+
+def _stamp_to_ts(stamp: str) -> str:
+    return f"{stamp[0:4]}-{stamp[4:6]}-{stamp[6:8]} {stamp[9:11]}:{stamp[11:13]}:{stamp[13:15]}"
+
+
+def segment_base(path: str) -> str:
+    """Path of a closed segment without its compression suffix (base of its cache files)."""
+    for suffix in COMPRESSED_SUFFIXES.values():
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def segment_sidecars(path: str) -> List[str]:
+    """Files derived from a closed segment: time index and analytics array cache."""
+    base = segment_base(path)
+    return [f"{base}.idx", f"{base}.npy"]
+
+
+def _iter_lines(lines, start: Optional[str], end: Optional[str]):
+    """Filter data lines (bytes) on start <= timestamp < end, yield (ts, [values])."""
+    header = HEADER_PREFIX.encode()
+    start_b = start.encode() if start is not None else None
+    end_b = end.encode() if end is not None else None
+    for line in lines:
+        if not line or line.startswith(header):
+            continue
+        ts = line[:19]
+        if start_b is not None and ts < start_b:
+            continue
+        if end_b is not None and ts >= end_b:
+            break
+        ts, _, rest = line.rstrip(b"\r\n").decode("utf-8").partition(",")
+        yield ts, rest.split(",")
+
+
+# ──────────────────────────────────────────────────────────────
+# Rotation / retention policy
+# ──────────────────────────────────────────────────────────────
+@dataclass
+class RecordingPolicy:
+    """
+    rotate          : "daily", "size" or "none"
+    max_bytes       : size of the active file triggering a "size" rotation
+    compress        : compression of closed segments, "gzip", "zstd" or "none"
+    retention_days  : closed segments ending before now - retention_days are deleted (0 = keep)
+    retention_bytes : oldest closed segments (and their caches) are deleted while the
+                      channel uses more than this on disk in total (0 = unlimited)
+    """
+    rotate: str = "none"
+    max_bytes: int = 50_000_000
+    compress: str = "gzip"
+    retention_days: float = 0
+    retention_bytes: int = 0
+
+    @classmethod
+    def from_config(cls, *configs: Dict) -> "RecordingPolicy":
+        """Policy from config dicts, later ones overriding earlier ones (unknown keys ignored)."""
+        values = {}
+        for conf in configs:
+            values.update({k: v for k, v in (conf or {}).items() if k in cls.__dataclass_fields__})
+        policy = cls(**values)
+        policy.max_bytes = int(policy.max_bytes)
+        policy.retention_days = float(policy.retention_days or 0)
+        policy.retention_bytes = int(policy.retention_bytes or 0)
+        if policy.compress == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed; closed segments will be compressed with gzip")
+            policy.compress = "gzip"
+        return policy
+
+
+# ──────────────────────────────────────────────────────────────
+# One uncompressed data file and its index
+# ──────────────────────────────────────────────────────────────
+class Segment:
+    """An uncompressed data file with its sparse time index.
+
+    Appending never scans the file: when the index of a non empty file is
+    missing (legacy file, crash), rows are appended unindexed until
+    build_index() runs (maintenance thread, or the first range read).
+    """
+    def __init__(self, path: str, index_every: int = 1000):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.index_every = index_every
+        self.lock = threading.Lock()
+        # sparse index, loaded on first use
+        self._idx_ts: Optional[List[str]] = None
+        self._idx_off: List[int] = []
+        self._rows_since_index = 0
+        self._indexed = False
+
+    def reset(self):
+        """Forget the cached index (the file was renamed or removed)."""
+        with self.lock:
+            self._idx_ts = None
+
+    def _load_index(self):
+        """Load the sidecar index, without building a missing one. Call with self.lock held."""
+        if self._idx_ts is not None:
+            return
+        self._idx_ts, self._idx_off, self._rows_since_index = [], [], 0
+        self._indexed = True
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if size == 0:
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            return
+        try:
+            with open(self.index_path, "r", encoding="ascii") as f:
+                for line in f:
+                    ts, _, off = line.rstrip("\r\n").partition(",")
+                    if off and int(off) < size:
+                        self._idx_ts.append(ts)
+                        self._idx_off.append(int(off))
+        except (FileNotFoundError, ValueError):
+            self._idx_ts, self._idx_off = [], []
+        if not self._idx_ts:
+            self._indexed = False
+            return
+        # rows appended after the last index entry (at most index_every rows)
+        with open(self.path, "rb") as f:
+            f.seek(self._idx_off[-1])
+            self._rows_since_index = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 16), b""))
+
+    @staticmethod
+    def _scan(f, offset: int, entries: List[Tuple[str, int]], rows_since: int, every: int):
+        """Index the complete lines of `f` from `offset`; return (end offset, rows since last entry)."""
+        header = HEADER_PREFIX.encode()
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # partial last line
+            if not line.startswith(header):
+                if rows_since % every == 0:
+                    entries.append((line[:19].decode("ascii"), offset))
+                    rows_since = 0
+                rows_since += 1
+            offset += len(line)
+        return offset, rows_since
+
+    def build_index(self):
+        """Build a missing index; the file is scanned without holding self.lock
+        (appends go on), only the rows appended meanwhile are read under it."""
+        with self.lock:
+            self._load_index()
+            if self._indexed:
+                return
+        logger.info(f"Building time index of {self.path}")
+        entries: List[Tuple[str, int]] = []
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            offset, rows_since = self._scan(f, 0, entries, 0, self.index_every)
+            with self.lock:
+                try:
+                    if os.stat(self.path).st_ino != inode:
+                        return  # rotated meanwhile, the new file is indexed as it grows
+                except FileNotFoundError:
+                    return
+                if self._idx_ts is None or self._indexed:
+                    return  # reset or built meanwhile
+                _, rows_since = self._scan(f, offset, entries, rows_since, self.index_every)
+                tmp_path = f"{self.index_path}.tmp"
+                with open(tmp_path, "w", encoding="ascii") as out:
+                    out.writelines(f"{ts},{off}\n" for ts, off in entries)
+                os.replace(tmp_path, self.index_path)
+                self._idx_ts = [ts for ts, _ in entries]
+                self._idx_off = [off for _, off in entries]
+                self._rows_since_index = rows_since
+                self._indexed = True
+
+    def first_ts(self) -> Optional[str]:
+        """Timestamp of the first row, None for an empty file (reads the first lines only)."""
+        with self.lock:
+            if self._idx_ts:
+                return self._idx_ts[0]
+            try:
+                f = open(self.path, "rb")
+            except FileNotFoundError:
+                return None
+            with f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        return None
+                    if not line.startswith(HEADER_PREFIX.encode()):
+                        return line[:19].decode("ascii")
+            return None
+
+    def start_offset(self, start: Optional[str]) -> int:
+        """Byte offset from which reading finds every row with timestamp >= start."""
+        self.build_index()
+        with self.lock:
+            self._load_index()
+            if start is None or not self._idx_ts:
+                return 0
+            # last index entry strictly before start (rows sharing its timestamp may precede it)
+            i = bisect.bisect_left(self._idx_ts, start) - 1
+            return self._idx_off[i] if i >= 0 else 0
+
+    def offset_of(self, ts: Optional[str]) -> int:
+        """Exact byte offset of the first row with timestamp >= ts.
+
+        Rows after the last complete line are never included: for ts=None, or
+        when no row matches, this is the end of the last complete line.
+        """
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return 0
+        with f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                return 0
+            with mm:
+                size = mm.rfind(b"\n") + 1
+                if ts is None:
+                    return size
+                pos = self.start_offset(ts)
+                header = HEADER_PREFIX.encode()
+                ts_b = ts.encode()
+                while pos < size:
+                    nl = mm.find(b"\n", pos)
+                    if mm[pos:pos + len(header)] != header and mm[pos:pos + 19] >= ts_b:
+                        return pos
+                    pos = nl + 1
+                return size
+
+    def append_row(self, timestamp: str, row: bytes, header: Optional[bytes] = None):
+        """Append an encoded row (header first if the file is empty) and extend the index."""
+        with self.lock:
+            self._load_index()
+            with open(self.path, "ab") as f:
+                if header and f.tell() == 0:
+                    f.write(header)
+                offset = f.tell()
+                f.write(row)
+            if not self._indexed:
+                return  # left to build_index()
+            if not self._idx_ts or self._rows_since_index >= self.index_every:
+                with open(self.index_path, "a", encoding="ascii") as f:
+                    f.write(f"{timestamp},{offset}\n")
+                self._idx_ts.append(timestamp)
+                self._idx_off.append(offset)
+                self._rows_since_index = 0
+            self._rows_since_index += 1
+
+    def iter_rows(self, start: Optional[str] = None, end: Optional[str] = None
+                  ) -> Iterator[Tuple[str, List[str]]]:
+        """Yield (timestamp, [value strings]) for start <= timestamp < end.
+
+        Seeks with the sparse index then streams from a memory-mapped view:
+        only the pages of the requested range are read.
+        """
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            yield from self.iter_file_rows(f, start, end)
+
+    def iter_file_rows(self, f: BinaryIO, start: Optional[str] = None, end: Optional[str] = None
+                       ) -> Iterator[Tuple[str, List[str]]]:
+        """iter_rows() on `f`, the segment file opened by the caller (it stays
+        readable if the segment is compressed or renamed meanwhile)."""
+        offset = self.start_offset(start)
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return
+        with mm:
+            yield from _iter_lines(self._mapped_lines(mm, offset), start, end)
+
+    @staticmethod
+    def _mapped_lines(mm, pos: int):
+        size = len(mm)
+        while pos < size:
+            nl = mm.find(b"\n", pos)
+            if nl < 0:
+                break  # partial last line, still being written
+            yield mm[pos:nl]
+            pos = nl + 1
+
+
+def _open_compressed(path: str):
+    """Binary line iterator over a compressed segment."""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        raw = open(path, "rb")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True))
+    return gzip.open(path, "rb")
+
+
+def _open_segment(path: str) -> BinaryIO:
+    """Binary reader of the data of a closed segment, given its uncompressed path:
+    the file itself or its compressed version (it may be compressed meanwhile)."""
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        for suffix in COMPRESSED_SUFFIXES.values():
+            if os.path.exists(path + suffix):
+                return _open_compressed(path + suffix)
+        raise
+
+
+def uncompressed_size(path: str) -> int:
+    """Size of the data of a closed segment (uncompressed path, see _open_segment):
+    file size, gzip trailer (size modulo 4 GiB, segments stay far below) or zstd
+    frame header; counted by decompressing when the frame does not record it."""
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        pass
+    if os.path.exists(path + ".gz"):
+        with open(path + ".gz", "rb") as f:
+            f.seek(-4, os.SEEK_END)
+            return struct.unpack("<I", f.read(4))[0]
+    if os.path.exists(path + ".zst") and zstandard is not None:
+        with open(path + ".zst", "rb") as f:
+            size = zstandard.frame_content_size(f.read(18))
+        if size >= 0:
+            return size
+    with _open_segment(path) as f:
+        return sum(len(chunk) for chunk in iter(lambda: f.read(1 << 20), b""))
+
+
+class RawPiece:
+    """Bytes [begin, stop) of the uncompressed data of one segment.
+
+    `f` is the open active file (see Recording.raw_pieces); closed segments
+    are opened when read, compressed or not.
+    """
+    def __init__(self, path: str, begin: int, stop: int, f: Optional[BinaryIO] = None):
+        self.path = path
+        self.begin = begin
+        self.stop = max(begin, stop)
+        self.f = f
+
+    def __len__(self) -> int:
+        return self.stop - self.begin
+
+    def chunks(self, first: int, last: int, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+        """Bytes [first, last) of the piece."""
+        f = self.f if self.f is not None else _open_segment(self.path)
+        try:
+            if f.seekable():
+                f.seek(self.begin + first)
+            else:  # compressed: decompress and skip
+                skip = self.begin + first
+                while skip > 0:
+                    data = f.read(min(skip, 1 << 20))
+                    if not data:
+                        return
+                    skip -= len(data)
+            remaining = last - first
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        finally:
+            if f is not self.f:
+                f.close()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+
+def _data_range(f: BinaryIO, start: str, end: Optional[str], offset: int = 0) -> Tuple[int, Optional[int]]:
+    """(begin, stop) offsets of the rows start <= timestamp < end, reading the lines
+    of `f` from `offset` (start "" = first row). Without end, the scan stops at
+    begin and stop is None. Missing rows give the end of the complete lines."""
+    header = HEADER_PREFIX.encode()
+    start_b = start.encode()
+    end_b = end.encode() if end is not None else None
+    begin = None
+    for line in f:
+        if not line.endswith(b"\n"):
+            break
+        if not line.startswith(header):
+            ts = line[:19]
+            if begin is None and ts >= start_b:
+                begin = offset
+                if end_b is None:
+                    return begin, None
+            if end_b is not None and ts >= end_b:
+                return (offset if begin is None else begin), offset
+        offset += len(line)
+    return (offset if begin is None else begin), (offset if end_b is not None else None)
+
+
+def compress_file(path: str, method: str) -> str:
+    """Compress `path` next to itself (temp file + rename), remove the original; return the new path."""
+    target = path + COMPRESSED_SUFFIXES[method]
+    tmp = target + ".tmp"
+    with open(path, "rb") as src:
+        if method == "zstd":
+            with open(tmp, "wb") as raw:
+                # the frame records the original size (uncompressed_size())
+                with zstandard.ZstdCompressor(level=10).stream_writer(raw, size=os.path.getsize(path)) as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+        else:
+            with gzip.open(tmp, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(tmp, target)
+    os.remove(path)
+    return target
+
+
+# ──────────────────────────────────────────────────────────────
+# One recorded channel
+# ──────────────────────────────────────────────────────────────
+class Recording:
+    """A channel of data_path: active file + closed segments, seen as one series."""
+    def __init__(self, data_path: str, file: str, index_every: int = 1000,
+                 policy: Optional[RecordingPolicy] = None,
+                 on_rotate: Optional[Callable[["Recording", str], None]] = None):
+        self.data_path = data_path
+        self.file = file
+        self.path = os.path.join(data_path, file)
+        self.index_path = f"{self.path}.idx"
+        self.policy = policy or RecordingPolicy()
+        self.on_rotate = on_rotate
+        self.lock = threading.Lock()
+        self.active = Segment(self.path, index_every)
+        self._columns: Optional[List[str]] = None
+        self._segment_re = re.compile(rf"^{re.escape(file)}\.(\d{{8}}T\d{{6}})(\.gz|\.zst)?$")
+
+    # ---------------- segments ----------------
+    def closed_segments(self) -> List[Tuple[str, str]]:
+        """(first timestamp, path) of the closed segments, oldest first."""
+        found: Dict[str, str] = {}
+        try:
+            names = os.listdir(self.data_path)
+        except FileNotFoundError:
+            return []
+        for name in names:
+            m = self._segment_re.match(name)
+            if m:
+                # during compression both files exist: prefer the original
+                stamp = m.group(1)
+                if stamp not in found or not m.group(2):
+                    found[stamp] = os.path.join(self.data_path, name)
+        return [(_stamp_to_ts(stamp), found[stamp]) for stamp in sorted(found)]
+
+    def _rotate(self, first_ts: str):
+        """Close the active file. Call with self.lock held."""
+        segment = f"{self.path}.{_ts_to_stamp(first_ts)}"
+        with self.active.lock:
+            os.replace(self.path, segment)
+            if os.path.exists(self.active.index_path):
+                os.replace(self.active.index_path, f"{segment}.idx")
+        self.active.reset()
+        logger.info(f"Rotated {self.file} to {os.path.basename(segment)}")
+        if self.on_rotate is not None:
+            self.on_rotate(self, segment)
+
+    def _needs_rotation(self, timestamp: str) -> Optional[str]:
+        """First timestamp of the active file if it must be closed before writing `timestamp`."""
+        rotate = self.policy.rotate
+        if rotate == "none":
+            return None
+        first_ts = self.active.first_ts()
+        if first_ts is None:
+            return None
+        if rotate == "daily" and first_ts[:10] != timestamp[:10]:
+            return first_ts
+        if rotate == "size" and os.path.getsize(self.path) >= self.policy.max_bytes:
+            return first_ts
+        return None
+
+    @staticmethod
+    def _size(*paths: str) -> int:
+        total = 0
+        for path in paths:
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return total
+
+    def apply_retention(self, now: Optional[str] = None, extra_bytes: int = 0) -> List[str]:
+        """Delete the closed segments beyond the retention limits; return the removed paths.
+
+        extra_bytes: disk use of the channel kept elsewhere (rollup tiers),
+        counted against retention_bytes with the segments, their sidecars
+        and the active file.
+        """
+        policy = self.policy
+        if not policy.retention_days and not policy.retention_bytes:
+            return []
+        now = now or time.strftime(TS_FORMAT)
+        removed = []
+        with self.lock:
+            segments = self.closed_segments()
+            # a closed segment ends where the next one (or the active file) starts
+            ends = [ts for ts, _ in segments[1:]] + [self.active.first_ts() or now]
+            sizes = [self._size(path, *segment_sidecars(path)) for _, path in segments]
+            total = sum(sizes) + self._size(self.path, self.index_path) + extra_bytes
+            limit = epoch_to_ts(ts_to_epoch(now) - policy.retention_days * 86400) if policy.retention_days else None
+            for (_, path), end, size in zip(segments, ends, sizes):
+                too_old = limit is not None and end <= limit
+                too_big = policy.retention_bytes and total > policy.retention_bytes
+                if not (too_old or too_big):
+                    break
+                for p in [path] + segment_sidecars(path):
+                    if os.path.exists(p):
+                        os.remove(p)
+                total -= size
+                removed.append(path)
+        for path in removed:
+            logger.info(f"Retention: deleted {os.path.basename(path)}")
+        return removed
+
+    # ---------------- write / read ----------------
+    def columns(self) -> List[str]:
+        """Value column names: the header fields, or ["value"] for headerless files."""
+        if self._columns is None:
+            paths = [self.path] + [path for _, path in reversed(self.closed_segments())]
+            for path in paths:
+                try:
+                    if path.endswith((".gz", ".zst")):
+                        f = _open_compressed(path)
+                    else:
+                        f = open(path, "rb")
+                    with f:
+                        first = f.readline().decode("utf-8")
+                except FileNotFoundError:
+                    continue
+                if not first:
+                    continue
+                self._columns = (first.rstrip("\r\n").split(",")[1:]
+                                 if first.startswith(HEADER_PREFIX) else ["value"])
+                break
+            else:
+                return ["value"]
+        return self._columns
+
+    def append(self, timestamp: str, values: Sequence, columns: Optional[Sequence[str]] = None):
+        """Append one row (rotating first if needed); `columns` is written as header of a new file."""
+        row = timestamp + "," + ",".join("" if v is None else str(v) for v in values) + "\n"
+        header = (HEADER_PREFIX + ",".join(columns) + "\n").encode("utf-8") if columns else None
+        with self.lock:
+            os.makedirs(self.data_path, exist_ok=True)
+            first_ts = self._needs_rotation(timestamp)
+            if first_ts is not None:
+                self._rotate(first_ts)
+            self.active.append_row(timestamp, row.encode("utf-8"), header)
+            if columns:
+                self._columns = list(columns)
+
+    def iter_rows(self, start: Optional[str] = None, end: Optional[str] = None
+                  ) -> Iterator[Tuple[str, List[str]]]:
+        """Yield (timestamp, [value strings]) for start <= timestamp < end, across all segments."""
+        with self.lock:
+            segments = self.closed_segments()
+            active_first = self.active.first_ts()
+        starts = [ts for ts, _ in segments[1:]] + [active_first]
+        for (seg_start, path), next_start in zip(segments, starts):
+            if end is not None and seg_start >= end:
+                return
+            if start is not None and next_start is not None and next_start < start:
+                continue  # segment entirely before the range
+            # the segment may have been compressed since it was listed: the
+            # plain file (index and mmap), else its compressed version
+            base = segment_base(path)
+            try:
+                f = open(base, "rb")
+            except FileNotFoundError:
+                try:
+                    f = _open_segment(base)
+                except FileNotFoundError:
+                    continue  # deleted meanwhile (retention)
+                with f:
+                    yield from _iter_lines(f, start, end)
+                continue
+            with f:
+                yield from Segment(base).iter_file_rows(f, start, end)
+        yield from self.active.iter_rows(start, end)
+
+    def raw_pieces(self, start: Optional[str], end: Optional[str]) -> List[RawPiece]:
+        """The raw bytes of the rows start <= timestamp < end, as one piece per segment
+        (header lines excluded), oldest first; close() the last one when done.
+
+        The active file is opened and its offsets computed under the recording
+        lock: a later rotation renames it, the bytes read from the open file
+        stay those of the offsets. Offsets inside a compressed segment are
+        found by decompressing it up to the range limits; segments entirely
+        inside the range only have their size read.
+        """
+        self.active.build_index()
+        with self.lock:
+            segments = self.closed_segments()
+            active_first = self.active.first_ts()
+            try:
+                f = open(self.path, "rb")
+            except FileNotFoundError:
+                f = None
+            if f is not None:
+                active = RawPiece(self.path, self.active.offset_of(start or ""),
+                                  self.active.offset_of(end) if end else self.active.offset_of(None), f)
+        pieces = []
+        starts = [ts for ts, _ in segments[1:]] + [active_first]
+        for (seg_start, path), next_start in zip(segments, starts):
+            if end is not None and seg_start >= end:
+                break
+            if start is not None and next_start is not None and next_start < start:
+                continue  # segment entirely before the range
+            path = segment_base(path)
+            plain = os.path.exists(path)
+            # every row up to the segment end: its size, no need to scan to the end
+            whole_tail = end is None or (next_start is not None and next_start <= end)
+            with _open_segment(path) as seg:
+                hint = 0
+                if plain and start:
+                    hint = Segment(path).start_offset(start)
+                    seg.seek(hint)
+                begin, stop = _data_range(seg, start or "", None if whole_tail else end, hint)
+            if stop is None:
+                stop = uncompressed_size(path)
+            pieces.append(RawPiece(path, begin, stop))
+        if f is not None:
+            if end is None or active_first is None or active_first < end:
+                pieces.append(active)
+            else:
+                f.close()
+        return pieces
+
+    def delete(self):
+        """Remove the channel: active file, closed segments and indexes."""
+        with self.lock:
+            paths = [self.path, self.index_path]
+            for _, path in self.closed_segments():
+                paths += [path] + segment_sidecars(path)
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            self.active.reset()
+            self._columns = None
+
+
+# ──────────────────────────────────────────────────────────────
+# Background compression / retention of closed segments
+# ──────────────────────────────────────────────────────────────
+class SegmentMaintainer(threading.Thread):
+    """Compresses closed segments, builds missing indexes and applies retention
+    (segments and rollup tiers), off the worker thread.
+
+    Besides the jobs submitted on rotation, retention of every channel of
+    `recordings` is applied each `interval` seconds.
+    """
+    def __init__(self, recordings: Optional["RecordingStore"] = None, interval: float = 3600.0):
+        super().__init__(daemon=True, name="SegmentMaintainer")
+        self.jobs = queue.Queue()
+        self.recordings = recordings
+        self.interval = interval
+
+    def submit(self, rec: Recording, segment: Optional[str] = None):
+        self.jobs.put((rec, segment))
+
+    def run(self):
+        while True:
+            try:
+                rec, segment = self.jobs.get(timeout=self.interval)
+            except queue.Empty:
+                if self.recordings is not None:
+                    for file in list(self.recordings.policies):
+                        self.submit(self.recordings.get(file))
+                continue
+            rollups = self.recordings.rollups if self.recordings is not None else None
+            try:
+                method = rec.policy.compress
+                if segment and method in COMPRESSED_SUFFIXES and os.path.exists(segment):
+                    target = compress_file(segment, method)
+                    if os.path.exists(f"{segment}.idx"):
+                        os.remove(f"{segment}.idx")
+                    logger.info(f"Compressed {os.path.basename(segment)} to {os.path.basename(target)}")
+                # index of a legacy active file (never built by append)
+                rec.active.build_index()
+                if rollups is not None:
+                    rollups.apply_retention(rec)
+                rec.apply_retention(extra_bytes=rollups.disk_usage(rec) if rollups is not None else 0)
+            except Exception as e:
+                logger.error(f"Maintenance of {rec.file} failed: {e}")
+            finally:
+                self.jobs.task_done()
+
+
+# ──────────────────────────────────────────────────────────────
+# All the recordings of data_path
+# ──────────────────────────────────────────────────────────────
+class RecordingStore:
+    """Recording objects of data_path, the per-row hooks (rollups) and segment maintenance."""
+    def __init__(self, data_path: str, rollups=None, index_every: int = 1000,
+                 policy: Optional[RecordingPolicy] = None, maintenance_interval: float = 3600.0):
+        self.data_path = data_path
+        self.rollups = rollups
+        self.index_every = index_every
+        self.policy = policy or RecordingPolicy()
+        self.policies: Dict[str, RecordingPolicy] = {}
+        self.maintainer = SegmentMaintainer(self, maintenance_interval)
+        self._recordings: Dict[str, Recording] = {}
+        self._lock = threading.Lock()
+
+    def get(self, file: str) -> Recording:
+        """Recording of `file` (a plain file name inside data_path)."""
+        if os.path.basename(file) != file or file in ("", ".", ".."):
+            raise ValueError(f"Invalid recording name: {file!r}")
+        with self._lock:
+            rec = self._recordings.get(file)
+            if rec is None:
+                rec = self._recordings[file] = Recording(
+                    self.data_path, file, self.index_every,
+                    policy=self.policies.get(file, self.policy),
+                    on_rotate=self.maintainer.submit)
+            return rec
+
+    def set_policy(self, file: str, policy: RecordingPolicy):
+        """Rotation/compression/retention policy of one channel."""
+        self.policies[file] = policy
+        self.get(file).policy = policy
+
+    def start_maintenance(self):
+        """Start the maintenance thread; queue leftovers (uncompressed closed segments,
+        missing indexes) and retention."""
+        if not self.maintainer.is_alive():
+            self.maintainer.start()
+        for file in list(self.policies):
+            rec = self.get(file)
+            pending = [path for _, path in rec.closed_segments() if not path.endswith((".gz", ".zst"))]
+            for path in pending:
+                self.maintainer.submit(rec, path)
+            self.maintainer.submit(rec)
+
+    def append(self, file: str, timestamp: str, values: Sequence,
+               columns: Optional[Sequence[str]] = None):
+        """Append a row to `file` and update its rollups."""
+        rec = self.get(file)
+        rec.append(timestamp, values, columns)
+        if self.rollups is not None:
+            try:
+                self.rollups.add(rec, timestamp, columns or rec.columns(), values)
+            except Exception as e:
+                logger.error(f"Failed to update rollups of {file}: {e}")
+
+    def delete(self, file: str):
+        """Remove a recording and everything derived from it."""
+        rec = self.get(file)
+        rec.delete()
+        if self.rollups is not None:
+            self.rollups.delete(rec)
@@ -0,0 +1,382 @@
+"""
+rollups.py
+----------
+Minute / hour / day aggregates of the recorded channels, maintained
+incrementally as samples are appended.
+
+For every recording and value column, each tier keeps per bucket:
+count, min, max, mean and integral (trapezoidal, in value x seconds; a flow
+in m3/h integrates to m3 once divided by 3600). A trapezoid segment belongs
+to the bucket of its closing sample; segments longer than max_gap seconds
+(acquisition stopped) are not integrated.
+
+Closed buckets are appended to "<file>.rollup_<tier>" next to the raw file,
+the open bucket of each tier lives in memory. After a restart the open buckets
+are rebuilt from the raw rows recorded since the last closed bucket; a full
+rebuild from the raw data is available on demand with rebuild(). A rebuild
+scans the raw data without holding the lock taken by add() (acquisition goes
+on, the old tiers keep being served) into "<file>.rollup_<tier>.rebuild"
+files, then swaps them in and replays the rows appended meanwhile.
+
+The tier files are append-only; apply_retention() (run by the segment
+maintenance thread) drops the closed buckets older than the retention of
+their tier (retention_days, e.g. {"1m": 30}: one minute buckets are kept 30
+days, the other tiers forever).
+"""
+
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import logging
+
+from recordings import TS_FORMAT, Recording, ts_to_epoch, epoch_to_ts
+
+logger = logging.getLogger(__name__)
+
+# tier name → bucket width in seconds
+TIERS = (("1m", 60), ("1h", 3600), ("1d", 86400))
+ROLLUP_HEADER = "bucket,column,count,min,max,mean,integral"
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _fmt(x: float) -> str:
+    return repr(round(x, 6))
+
+
+class _Bucket:
+    __slots__ = ("count", "min", "max", "sum", "integral")
+
+    def __init__(self):
+        self.count = 0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.sum = 0.0
+        self.integral = 0.0
+
+    def add(self, x: float, area: float):
+        self.count += 1
+        self.sum += x
+        self.integral += area
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    def as_dict(self, bucket: str, column: str) -> Dict:
+        return {"bucket": bucket, "column": column, "count": self.count,
+                "min": self.min, "max": self.max, "mean": self.sum / self.count,
+                "integral": self.integral}
+
+
+class _ChannelState:
+    """Rollup state of one recording."""
+    def __init__(self, tiers):
+        self.last: Dict[str, tuple] = {}                          # column → (epoch, value)
+        self.open_start: Dict[str, Optional[int]] = {name: None for name, _ in tiers}
+        self.open: Dict[str, Dict[str, _Bucket]] = {name: {} for name, _ in tiers}
+        self.next_start: Dict[str, int] = {name: 0 for name, _ in tiers}  # first unsaved bucket
+        self.suffix = ""  # ".rebuild" while a rebuild writes the closed buckets aside
+
+
+class RollupManager:
+    """Incremental rollup tiers of every recording of a RecordingStore."""
+    def __init__(self, max_gap: float = 300.0, tiers=TIERS,
+                 retention_days: Optional[Dict[str, float]] = None):
+        self.max_gap = max_gap
+        self.tiers = tuple(tiers)
+        # tier name → days of closed buckets kept (missing or 0 = keep everything)
+        self.retention_days = dict(retention_days or {})
+        self._states: Dict[str, _ChannelState] = {}
+        # file → rows added while its rebuild scans the raw data
+        self._pending: Dict[str, List[tuple]] = {}
+        self._lock = threading.RLock()
+
+    # ---------------- files ----------------
+    @staticmethod
+    def rollup_path(rec: Recording, tier: str) -> str:
+        return f"{rec.path}.rollup_{tier}"
+
+    @staticmethod
+    def _last_line(path: str) -> Optional[str]:
+        """Last non empty line of a small text file, None if missing/empty."""
+        try:
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - 4096))
+                lines = f.read().decode("utf-8").strip().splitlines()
+        except FileNotFoundError:
+            return None
+        return lines[-1] if lines else None
+
+    def _write_closed(self, rec: Recording, state: _ChannelState, tier: str, start: int,
+                      buckets: Dict[str, _Bucket]):
+        path = self.rollup_path(rec, tier) + state.suffix
+        bucket = epoch_to_ts(start)
+        with open(path, "a", encoding="utf-8") as f:
+            if f.tell() == 0:
+                f.write(ROLLUP_HEADER + "\n")
+            for column, b in buckets.items():
+                f.write(f"{bucket},{column},{b.count},{_fmt(b.min)},{_fmt(b.max)},"
+                        f"{_fmt(b.sum / b.count)},{_fmt(b.integral)}\n")
+
+    # ---------------- incremental update ----------------
+    def _state(self, rec: Recording, until: str) -> _ChannelState:
+        """State of a recording; on first use resume after the last persisted buckets."""
+        state = self._states.get(rec.file)
+        if state is not None:
+            return state
+        state = _ChannelState(self.tiers)
+        resume = []
+        for name, width in self.tiers:
+            line = self._last_line(self.rollup_path(rec, name))
+            if line and not line.startswith("bucket,"):
+                state.next_start[name] = ts_to_epoch(line.split(",", 1)[0]) + width
+                resume.append(state.next_start[name])
+            else:
+                # no history for this tier: start with the current bucket
+                # (use rebuild() to backfill from the raw data)
+                t = ts_to_epoch(until)
+                state.next_start[name] = t - t % width
+        self._states[rec.file] = state
+        if resume:
+            # rebuild the open buckets from the rows recorded since the last closed one
+            # (starting max_gap earlier so that the first trapezoid is complete)
+            columns = rec.columns()
+            since = epoch_to_ts(min(resume) - self.max_gap)
+            for ts, values in rec.iter_rows(start=since, end=until):
+                self._add(rec, state, ts_to_epoch(ts), columns, values)
+        return state
+
+    def _add(self, rec: Recording, state: _ChannelState, t: int,
+             columns: Sequence[str], values: Sequence):
+        samples = []
+        for column, value in zip(columns, values):
+            x = _to_float(value)
+            if x is None:
+                continue
+            prev = state.last.get(column)
+            area = 0.0
+            if prev is not None and 0 < t - prev[0] <= self.max_gap:
+                area = (t - prev[0]) * (x + prev[1]) / 2
+            state.last[column] = (t, x)
+            samples.append((column, x, area))
+        if not samples:
+            return
+
+        for name, width in self.tiers:
+            start = t - t % width
+            if start < state.next_start[name]:
+                continue  # bucket already persisted
+            open_start = state.open_start[name]
+            if open_start is not None and open_start != start:
+                if start < open_start:
+                    continue  # out of order sample
+                self._write_closed(rec, state, name, open_start, state.open[name])
+                state.next_start[name] = open_start + width
+                state.open[name] = {}
+            state.open_start[name] = start
+            buckets = state.open[name]
+            for column, x, area in samples:
+                b = buckets.get(column)
+                if b is None:
+                    b = buckets[column] = _Bucket()
+                b.add(x, area)
+
+    def add(self, rec: Recording, timestamp: str, columns: Sequence[str], values: Sequence):
+        """Account for one row just appended to `rec`."""
+        with self._lock:
+            state = self._state(rec, timestamp)
+            self._add(rec, state, ts_to_epoch(timestamp), columns, values)
+            pending = self._pending.get(rec.file)
+            if pending is not None:
+                pending.append((timestamp, columns, values))
+
+    # ---------------- queries / maintenance ----------------
+    def query(self, rec: Recording, tier: str = "1h", start: Optional[str] = None,
+              end: Optional[str] = None, column: Optional[str] = None,
+              include_open: bool = True) -> List[Dict]:
+        """Buckets of `tier` with start <= bucket < end, oldest first."""
+        if tier not in dict(self.tiers):
+            raise ValueError(f"Unknown rollup tier: {tier}")
+        rows = []
+        try:
+            with open(self.rollup_path(rec, tier), "r", encoding="utf-8") as f:
+                for line in f:
+                    bucket, col, count, mn, mx, mean, integral = line.rstrip("\r\n").split(",")
+                    if bucket == "bucket":
+                        continue
+                    if (start is not None and bucket < start) or (column is not None and col != column):
+                        continue
+                    if end is not None and bucket >= end:
+                        break
+                    rows.append({"bucket": bucket, "column": col, "count": int(count),
+                                 "min": float(mn), "max": float(mx), "mean": float(mean),
+                                 "integral": float(integral)})
+        except FileNotFoundError:
+            pass
+        if include_open:
+            with self._lock:
+                state = self._states.get(rec.file)
+                if state is not None and state.open_start[tier] is not None:
+                    bucket = epoch_to_ts(state.open_start[tier])
+                    if (start is None or bucket >= start) and (end is None or bucket < end):
+                        rows.extend(b.as_dict(bucket, col) for col, b in state.open[tier].items()
+                                    if column is None or col == column)
+        return rows
+
+    def delete(self, rec: Recording):
+        """Forget and remove the rollups of a recording (a running rebuild is discarded)."""
+        with self._lock:
+            self._states.pop(rec.file, None)
+            self._pending.pop(rec.file, None)
+            for name, _ in self.tiers:
+                self._remove(self.rollup_path(rec, name))
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def disk_usage(self, rec: Recording) -> int:
+        """Bytes of the tier files of a recording."""
+        total = 0
+        for name, _ in self.tiers:
+            try:
+                total += os.path.getsize(self.rollup_path(rec, name))
+            except FileNotFoundError:
+                pass
+        return total
+
+    def apply_retention(self, rec: Recording, now: Optional[str] = None) -> int:
+        """Drop the closed buckets older than the retention of their tier; return the rows dropped."""
+        now_t = ts_to_epoch(now or time.strftime(TS_FORMAT))
+        dropped = 0
+        for name, _ in self.tiers:
+            days = float(self.retention_days.get(name) or 0)
+            if days > 0:
+                limit = epoch_to_ts(now_t - days * 86400)
+                dropped += self._drop_before(self.rollup_path(rec, name), limit)
+        if dropped:
+            logger.info(f"Retention: dropped {dropped} rollup rows of {rec.file}")
+        return dropped
+
+    def _drop_before(self, path: str, limit: str) -> int:
+        """Rewrite a tier file without its buckets < limit. The kept rows are copied
+        without the lock; only the rows appended meanwhile are copied under it."""
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return 0
+        tmp_path = f"{path}.tmp"
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            header = f.readline()
+            cut, dropped = f.tell(), 0
+            limit_b = limit.encode()
+            for line in f:
+                if line[:len(limit_b)] >= limit_b:
+                    break
+                cut += len(line)
+                dropped += 1
+            if not dropped:
+                return 0
+            with open(tmp_path, "wb") as out:
+                out.write(header)
+                f.seek(cut)
+                shutil.copyfileobj(f, out, 1 << 20)
+                with self._lock:
+                    try:
+                        replaced = os.stat(path).st_ino != inode
+                    except FileNotFoundError:
+                        replaced = True
+                    if not replaced:
+                        shutil.copyfileobj(f, out, 1 << 20)
+                        out.close()
+                        os.replace(tmp_path, path)
+        if replaced:
+            # rebuilt or deleted meanwhile: the new file is left alone
+            self._remove(tmp_path)
+            return 0
+        return dropped
+
+    def rebuilding(self, rec: Recording) -> bool:
+        with self._lock:
+            return rec.file in self._pending
+
+    def rebuild(self, rec: Recording) -> int:
+        """Recompute every tier of a recording from its raw rows; return the number of rows read.
+
+        The scan runs without the lock (add() only queues its rows meanwhile)
+        and assumes the timestamps of a channel never decrease: rows added
+        during the scan and newer than its last row are replayed at the swap.
+        """
+        with self._lock:
+            if rec.file in self._pending:
+                raise RuntimeError(f"Rollups of {rec.file} are already being rebuilt")
+            pending = self._pending[rec.file] = []
+        try:
+            while True:
+                segments = rec.closed_segments()
+                state = _ChannelState(self.tiers)
+                state.suffix = ".rebuild"
+                for name, _ in self.tiers:
+                    self._remove(self.rollup_path(rec, name) + state.suffix)
+                columns = rec.columns()
+                rows, last = 0, None
+                for ts, values in rec.iter_rows():
+                    self._add(rec, state, ts_to_epoch(ts), columns, values)
+                    rows += 1
+                    last = ts
+                if rec.closed_segments() == segments:
+                    break
+                # rotated (or compressed) during the scan: rows may have been skipped
+                logger.info(f"Segments of {rec.file} changed during the rollup rebuild; rescanning")
+
+            with self._lock:
+                if self._pending.get(rec.file) is not pending:
+                    logger.info(f"Rollup rebuild of {rec.file} discarded (recording deleted)")
+                    return rows
+                for ts, row_columns, values in pending:
+                    if last is None or ts > last:
+                        self._add(rec, state, ts_to_epoch(ts), row_columns, values)
+                for name, _ in self.tiers:
+                    path = self.rollup_path(rec, name)
+                    if os.path.exists(path + state.suffix):
+                        os.replace(path + state.suffix, path)
+                    else:
+                        self._remove(path)
+                state.suffix = ""
+                self._states[rec.file] = state
+        finally:
+            with self._lock:
+                if self._pending.get(rec.file) is pending:
+                    del self._pending[rec.file]
+                for name, _ in self.tiers:
+                    self._remove(self.rollup_path(rec, name) + ".rebuild")
+        logger.info(f"Rebuilt rollups of {rec.file} from {rows} rows (+{len(pending)} appended meanwhile)")
+        return rows
+
+    def rebuild_async(self, rec: Recording) -> bool:
+        """Run rebuild() on a background thread; False if one is already running for `rec`."""
+        if self.rebuilding(rec):
+            return False
+
+        def run():
+            try:
+                self.rebuild(rec)
+            except Exception as e:
+                logger.error(f"Rollup rebuild of {rec.file} failed: {e}")
+        threading.Thread(target=run, daemon=True, name=f"rebuild-{rec.file}").start()
+        return True
@@ -0,0 +1,132 @@
+# test_analytics.py
+# Unit tests of the volume integration, the reconciliation with a totaliser and
+# the segment array caches:
+#   python -m pytest -q test_analytics.py
+import os
+
+import numpy as np
+import pytest
+
+from analytics import SeriesLoader, integrate, parse_rows, reconcile
+from recordings import RecordingPolicy, RecordingStore, compress_file, epoch_to_ts, ts_to_epoch
+
+T0 = ts_to_epoch("2025-03-01 00:00:00")
+
+
+def test_constant_flow_volume():
+    t = np.arange(0, 3601, 10) + T0
+    result = integrate(t, np.full(len(t), 36.0))  # 36 m3/h during one hour
+    assert result["volume"] == pytest.approx(36.0)
+    assert result["coverage"] == 1.0
+    assert result["gaps"] == 0
+    assert result["mean_flow"] == pytest.approx(36.0)
+
+
+def test_trapezoid_of_a_ramp():
+    t = np.array([0, 1800, 3600]) + T0
+    assert integrate(t, np.array([0.0, 10.0, 20.0]), max_gap=3600)["volume"] == pytest.approx(10.0)
+
+
+def test_gaps_and_missing_values_are_not_integrated():
+    t = np.array([0, 10, 20, 1020, 1030, 1040]) + T0
+    x = np.array([3600.0, 3600.0, 3600.0, 3600.0, np.nan, 3600.0])
+    result = integrate(t, x, max_gap=300)
+    # 0-10, 10-20 integrated; 20-1020 is a gap; both intervals around NaN are dropped
+    assert result["volume"] == pytest.approx(20.0)
+    assert result["gaps"] == 1
+    assert result["gap_seconds"] == 1000.0
+    assert result["covered_seconds"] == 20.0
+    assert result["span_seconds"] == 1040.0
+
+
+def test_short_series():
+    assert integrate(np.array([T0]), np.array([1.0]))["volume"] == 0.0
+    assert integrate(np.array([], dtype=np.int64), np.array([]), bucket=3600)["buckets"] == []
+
+
+def test_buckets_follow_the_closing_sample():
+    t = np.arange(0, 7201, 600) + T0
+    result = integrate(t, np.full(len(t), 6.0), max_gap=600, bucket=3600)
+    assert [b["bucket"] for b in result["buckets"]] == [epoch_to_ts(T0), epoch_to_ts(T0 + 3600),
+                                                         epoch_to_ts(T0 + 7200)]
+    # the interval ending at 3600 belongs to the second hour
+    assert [round(b["volume"], 6) for b in result["buckets"]] == [5.0, 6.0, 1.0]
+    assert sum(b["volume"] for b in result["buckets"]) == pytest.approx(result["volume"])
+
+
+def test_reconcile_counts_resets():
+    t = np.arange(0, 3601, 60) + T0
+    total = 100.0 + np.arange(len(t)) * 0.1
+    total[30:] -= 50.0  # totaliser reset half way
+    result = reconcile(t, np.full(len(t), 6.0), t, total)
+    assert result["integrated"] == pytest.approx(6.0)
+    assert result["totaliser"] == pytest.approx(5.9)
+    assert result["resets"] == 1
+    assert result["difference"] == pytest.approx(0.1)
+
+
+def test_parse_rows_handles_headers_and_empty_cells():
+    data = (b"timestamp,flow,velocity\n"
+            b"2025-03-01 00:00:00,1.5,2\n"
+            b"2025-03-01 00:00:10,,3\n"
+            b"2025-03-01 00:00:2")
+    t, values = parse_rows(data, 2)
+    assert list(t) == [T0, T0 + 10]
+    assert values[0].tolist() == [1.5, 2.0]
+    assert np.isnan(values[1, 0]) and values[1, 1] == 3.0
+
+
+def daily_store(path, days, compress="none"):
+    store = RecordingStore(str(path))
+    store.set_policy("flow.csv", RecordingPolicy(rotate="daily", compress=compress))
+    for day in range(days):
+        for i in range(0, 86400, 600):
+            store.append("flow.csv", epoch_to_ts(T0 + day * 86400 + i), [6.0])
+    rec = store.get("flow.csv")
+    if compress != "none":
+        for _, segment in rec.closed_segments():
+            compress_file(segment, compress)
+    return store
+
+
+def test_loader_reads_compressed_segments(tmp_path):
+    loader = SeriesLoader(daily_store(tmp_path, 3, compress="gzip"))
+    t, x = loader.column("flow.csv", "value")
+    assert len(t) == 3 * 144
+    assert integrate(t, x, max_gap=600)["volume"] == pytest.approx(6.0 * (3 * 24 - 1 / 6))
+    t, _ = loader.column("flow.csv", "value", start=epoch_to_ts(T0 + 86400), end=epoch_to_ts(T0 + 90000))
+    assert list(t) == list(range(T0 + 86400, T0 + 90000, 600))
+
+
+def test_caches_stay_within_budget(tmp_path):
+    store = daily_store(tmp_path, 5)
+    loader = SeriesLoader(store)
+    loader.column("flow.csv", "value")
+    caches = sorted(tmp_path.glob("*.npy"))
+    assert len(caches) == 4
+    size = os.path.getsize(caches[0])
+
+    loader = SeriesLoader(store, cache_bytes=2 * size)
+    # existing caches beyond the budget are deleted, least recently written first
+    t, _ = loader.column("flow.csv", "value", start=epoch_to_ts(T0 + 3 * 86400))
+    assert len(t) == 2 * 144
+    assert sorted(tmp_path.glob("*.npy")) == caches[2:]
+    # a cache built later evicts the least recently used one
+    loader.column("flow.csv", "value", end=epoch_to_ts(T0 + 3600))
+    assert sorted(tmp_path.glob("*.npy")) == [caches[0], caches[3]]
+
+    SeriesLoader(store, cache_bytes=0).column("flow.csv", "value")
+    assert list(tmp_path.glob("*.npy")) == []
+
+
+def test_expired_segment_takes_its_cache(tmp_path):
+    store = daily_store(tmp_path, 3)
+    loader = SeriesLoader(store)
+    loader.column("flow.csv", "value")
+    rec = store.get("flow.csv")
+    oldest = rec.closed_segments()[0][1]
+    assert os.path.exists(f"{oldest}.npy")
+    rec.policy.retention_days = 2
+    assert rec.apply_retention(now=epoch_to_ts(T0 + 3 * 86400)) == [oldest]
+    assert not os.path.exists(f"{oldest}.npy")
+    assert len(loader.column("flow.csv", "value")[0]) == 2 * 144
@@ -0,0 +1,113 @@
+# test_bus_planner.py
+# Unit tests of the bus occupancy model and its calibration:
+#   python -m pytest -q test_bus_planner.py
+import pytest
+
+from bus_planner import (READ_REQUEST, WRITE_REQUEST, WRITE_RESPONSE, Link, key_frames, plan,
+                         read_response, task_set, turnaround_from_stats, turnaround_from_trace)
+from bus_trace import OP_READ, OP_WRITE, STATUS_ERROR, STATUS_OK, TraceRecord
+
+MAPS = {"tuf2000": [{"name": "flow", "addr": 1, "format": "REAL4"},
+                    {"name": "net_total", "addr": 25, "format": "LONG_REAL"},
+                    {"name": "signal_quality", "addr": 92, "format": "INTEGER"}]}
+
+
+def record_task(task_id, recurrence, nb_reg=2):
+    return {"task_id": task_id, "action": "record", "recurrence": recurrence,
+            "frames": [(READ_REQUEST, read_response(nb_reg))]}
+
+
+@pytest.mark.parametrize("baudrate, char_time, silence", [
+    (9600, 10 / 9600, 3.5 * 10 / 9600),
+    (19200, 10 / 19200, 3.5 * 10 / 19200),
+    (38400, 10 / 38400, 0.00175),  # fixed silence above 19200 bauds
+])
+def test_link_timing(baudrate, char_time, silence):
+    link = Link(baudrate=baudrate)
+    assert link.char_time == pytest.approx(char_time)
+    assert link.silence == pytest.approx(silence)
+
+
+def test_parity_and_stop_bits():
+    assert Link(9600, parity="E").char_time == pytest.approx(11 / 9600)
+    assert Link(19200, parity="N", stopbits=2).char_time == pytest.approx(11 / 19200)
+
+
+def test_frame_sizes():
+    assert read_response(2) == 9
+    assert key_frames({"action": "record", "nbReg": 2}, {}) == [(8, 9)]
+    assert key_frames({"action": "snapshot", "map": "tuf2000"}, MAPS) == [(8, 5 + 2 * 28), (8, 7)]
+    assert key_frames({"action": "snapshot", "map": "tuf2000", "max_gap": 0}, MAPS) == [
+        (8, 9), (8, 13), (8, 7)]
+    assert key_frames({"action": "deleteFile", "file": "flow.csv"}, MAPS) is None
+    # a write request and its echo
+    assert (WRITE_REQUEST, WRITE_RESPONSE) == (8, 8)
+    link = Link(9600, turnaround=0.03)
+    assert link.frame(WRITE_REQUEST, WRITE_RESPONSE) == pytest.approx(3.5 / 960 + 16 / 960 + 0.03)
+
+
+def test_task_set_of_config():
+    config = {"register_maps": MAPS, "action_keys": [
+        {"label": "Flow rate", "action": "record", "nbReg": 2, "recurrence": 1},
+        {"label": "Meter", "action": "snapshot", "map": "tuf2000", "recurrence": 10},
+        {"label": "Delete", "action": "deleteFile", "file": "flow.csv"},
+    ]}
+    assert [(t["task_id"], len(t["frames"])) for t in task_set(config)] == [("Flow_rate", 1), ("Meter", 2)]
+    assert [t["task_id"] for t in task_set(config, ["Meter"])] == ["Meter"]
+
+
+def test_plan_utilisation_and_min_recurrence():
+    link = Link(9600, turnaround=0.03)
+    service = 3.5 / 960 + 17 / 960 + 0.03  # read of 2 registers
+    report = plan([record_task("a", 1.0), record_task("b", 0.5)], link, target=0.7)
+    a, b = report["tasks"]
+    assert a["service"] == pytest.approx(service)
+    assert a["utilisation"] == pytest.approx(service)
+    assert b["utilisation"] == pytest.approx(2 * service)
+    assert report["utilisation"] == pytest.approx(3 * service)
+    assert not report["saturated"]
+    # a alone may run until the total reaches the target
+    assert a["min_recurrence"] == pytest.approx(service / (0.7 - 2 * service))
+    assert report["worst_wait"] == pytest.approx(2 * service)
+    assert report["mean_wait"] > 0
+
+    reserved = plan([record_task("a", 1.0)], link, keypad_rate=0.5)
+    write = link.frame(WRITE_REQUEST, WRITE_RESPONSE)
+    assert reserved["keypad_reserve"] == pytest.approx(0.5 * write)
+    assert reserved["utilisation"] == pytest.approx(service + 0.5 * write)
+
+
+def test_plan_saturation():
+    link = Link(9600, turnaround=0.03)
+    report = plan([record_task("a", 0.04), record_task("b", 0.1)], link)
+    assert report["saturated"]
+    # b cannot fit whatever its recurrence while a runs every 40 ms; a can, slower
+    assert report["tasks"][1]["min_recurrence"] is None
+    assert report["tasks"][0]["min_recurrence"] > 0.04
+    assert report["queue_growth"] > 0
+    assert report["seconds_to_100_queued"] == pytest.approx(100 / report["queue_growth"])
+    assert report["recurrence_scale"] > 1
+
+
+def test_turnaround_from_trace():
+    link = Link(9600)
+    read = link.wire(READ_REQUEST, read_response(2))
+    write = link.wire(WRITE_REQUEST, WRITE_RESPONSE)
+    records = [TraceRecord(i, read + 0.025 + 0.001 * (i % 3 - 1), OP_READ, STATUS_OK, 1, 1, 2, (0, 0))
+               for i in range(9)]
+    records.append(TraceRecord(9, write + 0.025, OP_WRITE, STATUS_OK, 1, 58, 3, ()))
+    records.append(TraceRecord(10, 1.0, OP_READ, STATUS_ERROR, 1, 1, 2, ()))  # timeout: ignored
+    assert turnaround_from_trace(records, link) == pytest.approx(0.025)
+    assert turnaround_from_trace([], link) is None
+
+
+def test_turnaround_from_stats():
+    link = Link(9600)
+    tasks = [record_task("a", 1.0),
+             {"task_id": "meter", "action": "snapshot", "recurrence": 10.0, "frames": [(8, 61), (8, 7)]}]
+    wire_meter = link.wire(8, 61) + link.wire(8, 7)
+    per_task = {"a": {"count": 10, "bus_mean": link.wire(8, 9) + 0.02},
+                "meter": {"count": 2, "bus_mean": wire_meter + 2 * 0.02},
+                "idle": {"count": 0, "bus_mean": 0.0}}
+    assert turnaround_from_stats(per_task, tasks, link) == pytest.approx(0.02)
+    assert turnaround_from_stats({}, tasks, link) is None
@@ -0,0 +1,91 @@
+# test_bus_trace.py
+# Unit tests of the bus trace recording and replay (fake Modbus client, no device):
+#   python -m pytest -q test_bus_trace.py
+import struct
+
+import pytest
+
+from bus_trace import (MAGIC, OP_READ, OP_WRITE, STATUS_ERROR, STATUS_OK, TraceRecord, TracingClient,
+                       read_trace, replay, trace_stats)
+from modbus_worker import ModbusWorker, Task
+
+
+class Response:
+    def __init__(self, registers=(), error=False):
+        self.registers = list(registers)
+        self._error = error
+
+    def isError(self):
+        return self._error
+
+
+class FakeClient:
+    """Answers reads with 0, 1, 2...; writes at address 99 get an error response."""
+    def read_holding_registers(self, address, count=1, device_id=1):
+        return Response(range(count))
+
+    def write_register(self, address, value, device_id=1):
+        return Response(error=address == 99)
+
+
+def sink(value, timestamp, **kwargs):
+    pass
+
+
+def run(worker, task_id, param, urgent=False):
+    task = Task(task_id=task_id, modbus_param=param, callback=sink, urgent=urgent)
+    task.resolve()
+    worker.execute_task(task)
+
+
+def test_urgent_flag_is_recorded(tmp_path):
+    client = TracingClient(FakeClient(), str(tmp_path / "bus.trace"))
+    worker = ModbusWorker(client)
+    run(worker, "flow", {"op": "read", "addr": 1, "nbreg": 2, "format": "REAL4"})
+    run(worker, "key", {"op": "write", "addr": 58, "value": 3}, urgent=True)
+    run(worker, "velocity", {"op": "read", "addr": 5, "nbreg": 2, "format": "REAL4"})
+    client.close_trace()
+    records = list(read_trace(client.path))
+    assert [(r.op, r.address, r.urgent) for r in records] == [
+        (OP_READ, 1, False), (OP_WRITE, 58, True), (OP_READ, 5, False)]
+    assert records[0].registers == (0, 1)
+
+
+def test_version_1_traces_are_read(tmp_path):
+    path = tmp_path / "old.trace"
+    path.write_bytes(struct.pack("<8sH", MAGIC, 1)
+                     + struct.pack("<dfBBBHHH", 1.0, 0.02, OP_WRITE, STATUS_OK, 1, 58, 3, 0))
+    assert list(read_trace(str(path))) == [TraceRecord(1.0, pytest.approx(0.02), OP_WRITE, STATUS_OK,
+                                                       1, 58, 3, ())]
+    # a new recording keeps the old trace as the backup
+    client = TracingClient(FakeClient(), str(path))
+    client.close_trace()
+    assert len(list(read_trace(f"{path}.1"))) == 1
+    assert list(read_trace(str(path))) == []
+
+
+def test_error_responses_count_as_errors(tmp_path):
+    client = TracingClient(FakeClient(), str(tmp_path / "bus.trace"))
+    worker = ModbusWorker(client)
+    run(worker, "ok", {"op": "write", "addr": 58, "value": 1})
+    run(worker, "rejected", {"op": "write", "addr": 99, "value": 1})
+    client.close_trace()
+    assert worker.stats.snapshot()["errors"] == 1
+    assert [r.status for r in read_trace(client.path)] == [STATUS_OK, STATUS_ERROR]
+
+
+def test_replay_keeps_urgency_and_errors(monkeypatch):
+    records = [TraceRecord(100.0 + i * 0.01, 0.001, OP_READ, STATUS_OK, 1, 1, 2, (0, 0)) for i in range(5)]
+    records.append(TraceRecord(100.05, 0.001, OP_WRITE, STATUS_ERROR, 1, 58, 3, (), True))
+    created = []
+    original = ModbusWorker.create_task
+
+    def create_task(self, task, save=True):
+        created.append((task.modbus_param["op"], task.urgent))
+        return original(self, task, save=save)
+    monkeypatch.setattr(ModbusWorker, "create_task", create_task)
+    report = replay(records, speed=10)
+    assert created[-1] == ("write", True)
+    assert all(not urgent for op, urgent in created if op == "read")
+    assert report["replayed"]["errors"] == 1
+    assert report["recorded"]["errors"] == trace_stats(records)["errors"] == 1
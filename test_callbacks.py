@@ -0,0 +1,55 @@
+# test_callbacks.py
+# Unit tests of the callback registry and its reverse index:
+#   python -m pytest -q test_callbacks.py
+import pytest
+
+from callbacks import (_CALLBACK_NAMES, CALLBACK_REGISTRY, auto_register_callbacks, get_callback_name,
+                       register_callback)
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    saved = dict(CALLBACK_REGISTRY), dict(_CALLBACK_NAMES)
+    yield
+    CALLBACK_REGISTRY.clear()
+    CALLBACK_REGISTRY.update(saved[0])
+    _CALLBACK_NAMES.clear()
+    _CALLBACK_NAMES.update(saved[1])
+
+
+def test_name_lookup_after_registration():
+    @register_callback("test_lookup")
+    def on_value(value, timestamp, **kwargs):
+        pass
+    assert CALLBACK_REGISTRY["test_lookup"] is on_value
+    assert get_callback_name(on_value) == "test_lookup"
+    assert get_callback_name(lambda **kwargs: None) is None
+    assert get_callback_name(None) is None
+
+
+def test_reregistration_drops_the_stale_entry():
+    def first(**kwargs):
+        pass
+
+    def second(**kwargs):
+        pass
+    register_callback("test_rereg")(first)
+    register_callback("test_rereg")(second)
+    assert CALLBACK_REGISTRY["test_rereg"] is second
+    assert get_callback_name(second) == "test_rereg"
+    assert get_callback_name(first) is None
+
+
+def test_only_listed_globals_are_registered():
+    def record_and_log(**kwargs):
+        pass
+
+    def helper(**kwargs):
+        pass
+    module_globals = {"record_and_log": record_and_log, "helper": helper, "LIMIT": 3}
+    auto_register_callbacks(module_globals, ["record_and_log"])
+    assert get_callback_name(record_and_log) == "record_and_log"
+    assert "helper" not in CALLBACK_REGISTRY
+    assert get_callback_name(helper) is None
+    with pytest.raises(ValueError):
+        auto_register_callbacks(module_globals, ["LIMIT"])
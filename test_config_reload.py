@@ -0,0 +1,111 @@
+# test_config_reload.py
+# Unit tests of the key list comparison and generation used by the hot reload:
+#   python -m pytest -q test_config_reload.py
+from config_reload import diff_keys, key_generation, reload_tasks, restart_needed
+
+BASE = [{"label": "1", "reg": 59, "val": 1}, {"label": "2", "reg": 59, "val": 2}]
+ACTIONS = [{"label": "Flow", "action": "record", "file": "flow.csv"},
+           {"label": "Velocity", "action": "record", "file": "velocity.csv"}]
+
+
+def label(key):
+    return key["label"]
+
+
+def test_generation_is_stable():
+    assert key_generation(BASE, ACTIONS) == key_generation([dict(k) for k in BASE], list(ACTIONS))
+
+
+def test_reordered_keys_change_the_generation():
+    assert key_generation(BASE, ACTIONS) != key_generation(BASE, ACTIONS[::-1])
+    assert key_generation(BASE, ACTIONS) != key_generation(BASE[::-1], ACTIONS)
+    changed = [dict(ACTIONS[0], file="flow2.csv"), ACTIONS[1]]
+    assert key_generation(BASE, ACTIONS) != key_generation(BASE, changed)
+
+
+def test_diff_keys_reports_moves():
+    added, removed, changed = diff_keys(ACTIONS, ACTIONS[::-1] + [{"label": "Total"}], label)
+    assert added == ["Total"]
+    assert removed == []
+    assert sorted(changed) == ["Flow", "Velocity"]
+
+
+class FakeWorker:
+    """The task API of ModbusWorker used by reload_tasks, recording the calls."""
+    def __init__(self, *task_ids):
+        self.tasks = {task_id: ("task", task_id) for task_id in task_ids}
+        self.calls = []
+
+    def create_task(self, task):
+        self.calls.append(("create", task[1]))
+        self.tasks[task[1]] = task
+
+    def replace_task(self, task):
+        self.calls.append(("replace", task[1]))
+        self.tasks[task[1]] = task
+
+    def delete_task(self, task):
+        self.calls.append(("delete", task[1]))
+        del self.tasks[task[1]]
+
+
+def task_id(key):
+    return key["label"].replace(" ", "_")
+
+
+def build_task(index, key):
+    return None if key.get("invalid") else ("task", task_id(key))
+
+
+def reload(worker, new_keys, old_maps=None, new_maps=None, old_keys=ACTIONS):
+    return reload_tasks(worker, old_keys, new_keys, old_maps or {}, new_maps or {}, task_id, build_task)
+
+
+def test_renamed_running_key_is_restarted_under_its_new_id():
+    worker = FakeWorker("Flow", "Velocity")
+    renamed = [dict(ACTIONS[0], label="Flow rate"), ACTIONS[1]]
+    summary = reload(worker, renamed)
+    assert summary["renamed"] == {"Flow": "Flow_rate"}
+    assert summary["stopped"] == []
+    assert sorted(worker.tasks) == ["Flow_rate", "Velocity"]
+    assert worker.calls == [("delete", "Flow"), ("create", "Flow_rate")]
+
+
+def test_rename_with_other_file_is_a_removal():
+    worker = FakeWorker("Flow")
+    summary = reload(worker, [dict(ACTIONS[0], label="Flow 2", file="flow2.csv"), ACTIONS[1]])
+    assert summary["stopped"] == ["Flow"]
+    assert summary["renamed"] == {}
+    assert worker.tasks == {}
+
+
+def test_idle_keys_are_never_started():
+    worker = FakeWorker()
+    summary = reload(worker, [dict(ACTIONS[0], label="Flow rate"), dict(ACTIONS[1], recurrence=5)])
+    assert worker.calls == []
+    assert summary["added"] == ["Flow_rate"] and summary["changed"] == ["Velocity"]
+
+
+def test_changed_and_map_changed_keys_are_rescheduled():
+    snapshot = {"label": "Meter", "action": "snapshot", "file": "meter.csv", "map": "tuf2000"}
+    old = ACTIONS + [snapshot]
+    worker = FakeWorker("Flow", "Velocity", "Meter")
+    summary = reload(worker, [dict(ACTIONS[0], recurrence=5), ACTIONS[1], snapshot],
+                     old_maps={"tuf2000": [1]}, new_maps={"tuf2000": [1, 2]}, old_keys=old)
+    assert summary["rescheduled"] == ["Flow", "Meter"]
+    assert worker.calls == [("replace", "Flow"), ("replace", "Meter")]
+
+
+def test_removed_and_invalid_keys_are_stopped():
+    worker = FakeWorker("Flow", "Velocity")
+    summary = reload(worker, [dict(ACTIONS[1], invalid=True)])
+    assert summary["removed"] == ["Flow"]
+    assert summary["stopped"] == ["Flow", "Velocity"]
+    assert worker.tasks == {}
+
+
+def test_restart_needed():
+    old = {"serial": {"port": "/dev/ttyUSB0"}, "log_max_bytes": 1000, "log_level": "INFO"}
+    new = {"serial": {"port": "/dev/ttyUSB0"}, "log_max_bytes": 2000, "log_level": "DEBUG",
+           "bus_trace": {"enabled": True}}
+    assert restart_needed(old, new) == ["log_max_bytes", "bus_trace"]
@@ -0,0 +1,75 @@
+# test_decoders.py
+# Unit tests of the decoder registry (no Modbus device needed):
+#   python -m pytest -q test_decoders.py
+import struct
+
+import pytest
+
+from decoders import decode_block, decode_registers, get_decoder
+
+
+def regs(fmt, *values):
+    """Registers holding `values` packed with `fmt` (little-endian registers, low word first)."""
+    raw = struct.pack("<" + fmt, *values)
+    return list(struct.unpack(f"<{len(raw) // 2}H", raw))
+
+
+def test_real4_rounded():
+    assert decode_registers(regs("f", 12.345678), "REAL4") == 12.3457
+
+
+def test_real4_word_swapped():
+    low, high = regs("f", -2.5)
+    assert decode_registers([high, low], "REAL4_WS") == -2.5
+
+
+def test_integer_long_real8():
+    assert decode_registers([513], "INTEGER") == 513
+    assert decode_registers(regs("i", -123456), "LONG") == -123456
+    assert decode_registers(regs("d", 1 / 3), "REAL8") == 1 / 3
+
+
+def test_long_real_totaliser_sums_integer_and_fraction():
+    assert decode_registers(regs("if", 1234, 0.5), "LONG_REAL") == 1234.5
+
+
+def test_bcd():
+    assert decode_registers([0x1234], "BCD") == 1234
+    assert decode_block([0x0012, 0x3456], "BCD") == [12, 3456]
+    with pytest.raises(ValueError):
+        decode_registers([0x1A00], "BCD")
+
+
+def test_empty_and_unknown_format():
+    assert decode_registers([], "REAL4") is None
+    with pytest.raises(ValueError):
+        get_decoder("FLOAT16")
+
+
+@pytest.mark.parametrize("fmt,code,values", [
+    ("REAL4", "f", [1.5, -2.25, 100.125]),
+    ("LONG", "i", [1, -2, 70000]),
+    ("INTEGER", "H", [0, 1, 65535]),
+    ("LONG_REAL", "if", [10, 0.25, 20, 0.5]),
+])
+def test_block_matches_single_values(fmt, code, values):
+    block = regs(code * (len(values) // len(code)), *values)
+    nbreg = get_decoder(fmt).nbreg
+    singles = [decode_registers(block[i:i + nbreg], fmt) for i in range(0, len(block), nbreg)]
+    assert decode_block(block, fmt) == singles
+
+
+def test_block_numpy_matches_list():
+    np = pytest.importorskip("numpy")
+    block = regs("fff", 1.5, -2.25, 3.0)
+    assert np.allclose(decode_block(block, "REAL4", numpy=True), decode_block(block, "REAL4"))
+    low, high = regs("f", 7.5)
+    assert decode_block([high, low], "REAL4_WS", numpy=True).tolist() == [7.5]
+
+
+def test_block_count_and_short_block():
+    block = regs("ff", 1.0, 2.0)
+    assert decode_block(block, "REAL4", count=1) == [1.0]
+    assert decode_block(block, "REAL4", count=0) == []
+    with pytest.raises(ValueError):
+        decode_block(block, "REAL4", count=3)
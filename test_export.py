@@ -0,0 +1,162 @@
+# test_export.py
+# Unit tests of the streaming /export endpoint (Flask test client, no device):
+#   python -m pytest -q test_export.py
+import pytest
+from flask import Flask, request
+
+from export import export_response
+from recordings import RecordingStore, epoch_to_ts, ts_to_epoch
+
+T0 = ts_to_epoch("2025-03-01 00:00:00")
+
+
+def ts(seconds):
+    return epoch_to_ts(T0 + seconds)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RecordingStore(str(tmp_path))
+    for i in range(100):
+        store.append("flow.csv", ts(i * 10), [f"{i}.5"])
+    return store
+
+
+@pytest.fixture
+def client(store):
+    app = Flask(__name__)
+
+    @app.route("/export")
+    def export():
+        return export_response(store, request.args, request.headers,
+                               channels={"flow.csv", "velocity.csv"})
+    return app.test_client()
+
+
+def full_csv():
+    return "timestamp,value\n" + "".join(f"{ts(i * 10)},{i}.5\n" for i in range(100))
+
+
+def test_single_channel_is_the_raw_file(client):
+    response = client.get("/export?channel=flow.csv")
+    assert response.status_code == 200
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.data.decode() == full_csv()
+    assert int(response.headers["Content-Length"]) == len(full_csv())
+
+
+def test_time_range(client):
+    response = client.get(f"/export?channel=flow.csv&start={ts(100)}&end={ts(130)}")
+    assert response.data.decode() == "timestamp,value\n" + "".join(
+        f"{ts(i * 10)},{i}.5\n" for i in (10, 11, 12))
+
+
+def test_range_request_resumes(client):
+    body = full_csv().encode()
+    response = client.get("/export?channel=flow.csv", headers={"Range": "bytes=10-99"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 10-99/{len(body)}"
+    assert response.data == body[10:100]
+
+    response = client.get("/export?channel=flow.csv", headers={"Range": "bytes=-20"})
+    assert response.status_code == 206
+    assert response.data == body[-20:]
+
+    response = client.get("/export?channel=flow.csv", headers={"Range": f"bytes={len(body) - 5}-"})
+    assert response.data == body[-5:]
+
+
+@pytest.mark.parametrize("header", ["bytes=100000-", "bytes=50-10", "items=0-1", "bytes=-"])
+def test_unsatisfiable_range(client, header):
+    response = client.get("/export?channel=flow.csv", headers={"Range": header})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(full_csv())}"
+
+
+def test_stream_survives_rotation(store, tmp_path):
+    rec = store.get("flow.csv")
+    app = Flask(__name__)
+    with app.test_request_context("/export?channel=flow.csv"):
+        response = export_response(store, request.args, request.headers)
+        # the active file is renamed and a new one started before the body is read
+        (tmp_path / "flow.csv").rename(tmp_path / "flow.csv.20250301T000000")
+        rec.active.reset()
+        store.append("flow.csv", ts(5000), ["999"])
+        body = b"".join(response.response).decode()
+        response.close()
+    assert body == full_csv()
+    assert len(body) == int(response.headers["Content-Length"])
+
+
+def test_merge_exact_and_aligned(store, client):
+    # velocity sampled 3 s after flow: no common timestamp
+    for i in range(3):
+        store.append("velocity.csv", ts(i * 10 + 3), [f"{i}"])
+    end = ts(30)
+    exact = client.get(f"/export?channel=flow.csv&channel=velocity.csv&end={end}").data.decode()
+    assert exact.splitlines() == [
+        "timestamp,flow,velocity",
+        f"{ts(0)},0.5,", f"{ts(3)},,0",
+        f"{ts(10)},1.5,", f"{ts(13)},,1",
+        f"{ts(20)},2.5,", f"{ts(23)},,2",
+    ]
+    aligned = client.get(f"/export?channel=flow.csv&channel=velocity.csv&end={end}"
+                         "&resolution=10").data.decode()
+    assert aligned.splitlines() == [
+        "timestamp,flow,velocity",
+        f"{ts(0)},0.5,0", f"{ts(10)},1.5,1", f"{ts(20)},2.5,2",
+    ]
+
+
+def test_resolution_keeps_last_sample_of_bucket(client):
+    response = client.get(f"/export?channel=flow.csv&end={ts(60)}&resolution=30&format=ndjson")
+    assert [line for line in response.data.decode().splitlines()] == [
+        f'{{"timestamp":"{ts(0)}","value":2.5}}', f'{{"timestamp":"{ts(30)}","value":5.5}}']
+
+
+def test_only_configured_channels(client, tmp_path):
+    (tmp_path / "TUFState").write_text("{}")
+    for name in ("TUFState", "flow.csv.rollup_1h", "../flow.csv"):
+        assert client.get(f"/export?channel={name}").status_code in (400, 404)
+    assert client.get("/export?channel=velocity.csv").status_code == 404  # no data yet
+    assert client.get("/export?channel=flow.csv&resolution=x").status_code == 400
+
+
+@pytest.mark.parametrize("compress", ["gzip", "none"])
+def test_range_across_closed_segments(tmp_path, compress):
+    from recordings import RecordingPolicy, compress_file
+    store = RecordingStore(str(tmp_path))
+    store.set_policy("snap.csv", RecordingPolicy(rotate="daily", compress=compress))
+    rows = []
+    for day in range(3):
+        for i in range(50):
+            stamp = ts(day * 86400 + i * 60)
+            store.append("snap.csv", stamp, [i, day], columns=["flow", "velocity"])
+            rows.append(f"{stamp},{i},{day}\n")
+    rec = store.get("snap.csv")
+    if compress != "none":
+        for _, path in rec.closed_segments():
+            compress_file(path, compress)
+    app = Flask(__name__)
+
+    @app.route("/export")
+    def export():
+        return export_response(store, request.args, request.headers)
+    client = app.test_client()
+
+    full = ("timestamp,flow,velocity\n" + "".join(rows)).encode()
+    response = client.get("/export?channel=snap.csv")
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert int(response.headers["Content-Length"]) == len(full)
+    assert response.data == full
+
+    # time range starting and ending inside closed segments
+    start, end = ts(20 * 60), ts(86400 + 10 * 60)
+    expected = "timestamp,flow,velocity\n" + "".join(r for r in rows if start <= r[:19] < end)
+    assert client.get(f"/export?channel=snap.csv&start={start}&end={end}").data.decode() == expected
+
+    # resume across segment boundaries
+    for first, last in ((0, 9), (1000, 3000), (len(full) - 700, len(full) - 1)):
+        response = client.get("/export?channel=snap.csv", headers={"Range": f"bytes={first}-{last}"})
+        assert response.status_code == 206
+        assert response.data == full[first:last + 1]
@@ -0,0 +1,74 @@
+# test_logging_setup.py
+# Unit tests of the non-blocking logging setup (queue handler + listener thread):
+#   python -m pytest -q test_logging_setup.py
+import logging
+import re
+import threading
+
+import pytest
+
+from logging_setup import _stop_listener, setup_logging
+
+LINE = re.compile(r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3} \[(\w+)\] ([\w.]+): (.*)$")
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    saved = list(root.handlers), root.level
+    yield root
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in saved[0]:
+        root.addHandler(handler)
+    root.setLevel(saved[1])
+
+
+def test_records_reach_the_rotated_file(tmp_path, root_logger):
+    log_file = tmp_path / "logs" / "tuf.log"
+    listener = setup_logging({"log_level": "debug", "log_file": str(log_file),
+                              "log_max_bytes": 300, "log_backup_count": 2})
+    assert isinstance(root_logger.handlers[0], logging.handlers.QueueHandler)
+    assert root_logger.level == logging.DEBUG
+
+    logger = logging.getLogger("tuf.test")
+    for i in range(10):
+        logger.info("record %d of the test", i)
+    logger.debug("last record")
+    thread = listener._thread
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    assert listener._thread is None and not thread.is_alive()
+    _stop_listener(listener)  # the atexit hook after an explicit stop
+
+    files = [log_file.with_name("tuf.log.2"), log_file.with_name("tuf.log.1"), log_file]
+    assert all(f.exists() for f in files)
+    assert not log_file.with_name("tuf.log.3").exists()
+    lines = [line for f in files for line in f.read_text(encoding="utf-8").splitlines()]
+    parsed = [LINE.match(line).groups() for line in lines]
+    assert parsed[-1] == ("DEBUG", "tuf.test", "last record")
+    assert all(level == "INFO" for level, _, _ in parsed[:-1])
+    # oldest rotated files dropped beyond backup_count, the remaining records in order
+    numbers = [int(message.split()[1]) for _, _, message in parsed[:-1]]
+    assert numbers == list(range(numbers[0], 10))
+
+
+def test_records_are_written_by_the_listener_thread(tmp_path, root_logger):
+    log_file = tmp_path / "tuf.log"
+    listener = setup_logging({"log_file": str(log_file), "log_level": "NOLEVEL"})
+    assert root_logger.level == logging.INFO  # unknown level name
+    writers = []
+    handler = listener.handlers[0]
+    emit = handler.emit
+
+    def record_thread(record):
+        writers.append(threading.current_thread())
+        emit(record)
+    handler.emit = record_thread
+    logging.getLogger("tuf.test").warning("from the worker")
+    logging.getLogger("tuf.test").debug("filtered")
+    listener.stop()
+    handler.close()
+    assert len(writers) == 1 and writers[0] is not threading.current_thread()
+    assert log_file.read_text(encoding="utf-8").endswith("[WARNING] tuf.test: from the worker\n")
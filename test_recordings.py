@@ -0,0 +1,170 @@
+# test_recordings.py
+# Unit tests of the recording segments: sparse time index, exact offsets,
+# range reads, legacy (unindexed) files and the wall clock check:
+#   python -m pytest -q test_recordings.py
+import os
+import time
+
+import pytest
+
+from recordings import Segment, epoch_to_ts, ts_to_epoch, wall_clock_problem
+
+T0 = ts_to_epoch("2025-03-01 00:00:00")
+
+
+def ts(i, step=10):
+    return epoch_to_ts(T0 + i * step)
+
+
+def write_segment(path, count, header=None, every=100):
+    segment = Segment(str(path), index_every=every)
+    for i in range(count):
+        segment.append_row(ts(i), f"{ts(i)},{i}\n".encode(), header)
+    return segment
+
+
+def test_sparse_index_every_n_rows(tmp_path):
+    segment = write_segment(tmp_path / "flow.csv", 1000, every=100)
+    with open(segment.index_path) as f:
+        entries = [line.split(",") for line in f.read().splitlines()]
+    assert len(entries) == 10
+    assert [e[0] for e in entries] == [ts(i) for i in range(0, 1000, 100)]
+    with open(segment.path, "rb") as f:
+        data = f.read()
+    for stamp, offset in entries:
+        assert data[int(offset):int(offset) + 19].decode() == stamp
+
+
+def test_offset_of_exact_row(tmp_path):
+    segment = write_segment(tmp_path / "flow.csv", 1000, header=b"timestamp,flow\n")
+    with open(segment.path, "rb") as f:
+        data = f.read()
+    for i in (0, 1, 99, 100, 101, 555, 999):
+        offset = segment.offset_of(ts(i))
+        assert data[offset:offset + 19].decode() == ts(i)
+    # between two rows: the next one
+    offset = segment.offset_of(epoch_to_ts(T0 + 5))
+    assert data[offset:offset + 19].decode() == ts(1)
+    assert segment.offset_of(None) == len(data)
+    assert segment.offset_of(ts(5000)) == len(data)
+
+
+def test_offset_of_ignores_partial_last_line(tmp_path):
+    segment = write_segment(tmp_path / "flow.csv", 10)
+    size = os.path.getsize(segment.path)
+    with open(segment.path, "ab") as f:
+        f.write(ts(10).encode())
+    assert segment.offset_of(None) == size
+    assert segment.offset_of(ts(10)) == size
+
+
+def test_iter_rows_range(tmp_path):
+    segment = write_segment(tmp_path / "flow.csv", 1000, header=b"timestamp,flow\n")
+    rows = list(segment.iter_rows(ts(250), ts(260)))
+    assert [r[0] for r in rows] == [ts(i) for i in range(250, 260)]
+    assert rows[0][1] == ["250"]
+    assert len(list(segment.iter_rows())) == 1000
+
+
+def test_first_ts_skips_header(tmp_path):
+    segment = write_segment(tmp_path / "snap.csv", 3, header=b"timestamp,flow,velocity\n")
+    assert Segment(segment.path).first_ts() == ts(0)
+    assert Segment(str(tmp_path / "missing.csv")).first_ts() is None
+
+
+def test_legacy_file_is_indexed_off_the_append_path(tmp_path):
+    path = tmp_path / "flow.csv"
+    with open(path, "w") as f:
+        f.writelines(f"{ts(i)},{i}\n" for i in range(500))
+    segment = Segment(str(path), index_every=100)
+    # appending and first_ts() never scan the legacy file
+    assert segment.first_ts() == ts(0)
+    segment.append_row(ts(500), f"{ts(500)},500\n".encode())
+    assert not os.path.exists(segment.index_path)
+
+    segment.build_index()
+    with open(segment.index_path) as f:
+        assert [line.split(",")[0] for line in f.read().splitlines()] == [ts(i) for i in range(0, 501, 100)]
+    # later appends extend the index
+    for i in range(501, 700):
+        segment.append_row(ts(i), f"{ts(i)},{i}\n".encode())
+    with open(segment.index_path) as f:
+        assert f.read().splitlines()[-1].split(",")[0] == ts(600)
+    assert [r[0] for r in segment.iter_rows(ts(640), ts(642))] == [ts(640), ts(641)]
+
+
+def test_range_read_builds_missing_index(tmp_path):
+    path = tmp_path / "flow.csv"
+    with open(path, "w") as f:
+        f.writelines(f"{ts(i)},{i}\n" for i in range(300))
+    segment = Segment(str(path), index_every=100)
+    assert [r[0] for r in segment.iter_rows(ts(150), ts(151))] == [ts(150)]
+    assert os.path.exists(segment.index_path)
+
+
+def test_stale_index_entries_are_dropped(tmp_path):
+    segment = write_segment(tmp_path / "flow.csv", 300, every=100)
+    # file truncated behind the index (restored backup)
+    with open(segment.path, "r+b") as f:
+        f.truncate(150 * len(f"{ts(0)},0\n"))
+    fresh = Segment(segment.path, index_every=100)
+    assert [r[0] for r in fresh.iter_rows(ts(120), ts(122))] == [ts(120), ts(121)]
+
+
+def test_retention_bytes_counts_caches_and_extra(tmp_path):
+    from recordings import RecordingPolicy, RecordingStore
+    store = RecordingStore(str(tmp_path))
+    store.set_policy("flow.csv", RecordingPolicy(rotate="daily", compress="none"))
+    for day in range(4):
+        for i in range(100):
+            store.append("flow.csv", epoch_to_ts(T0 + day * 86400 + i * 10), [i])
+    rec = store.get("flow.csv")
+    segments = [path for _, path in rec.closed_segments()]
+    assert len(segments) == 3
+    segment_size = os.path.getsize(segments[0])
+    # analytics caches next to the first two segments
+    for path in segments[:2]:
+        with open(f"{path}.npy", "wb") as f:
+            f.write(b"\0" * 3 * segment_size)
+
+    rec.policy.retention_bytes = 10 * segment_size
+    assert rec.apply_retention() == [segments[0]]
+    assert not os.path.exists(f"{segments[0]}.npy")
+    # rollups (extra_bytes) count too
+    assert rec.apply_retention(extra_bytes=4 * segment_size) == [segments[1]]
+    assert [path for _, path in rec.closed_segments()] == segments[2:]
+
+
+def test_rows_survive_compression_during_iteration(tmp_path):
+    from recordings import RecordingPolicy, RecordingStore, compress_file
+    store = RecordingStore(str(tmp_path))
+    store.set_policy("flow.csv", RecordingPolicy(rotate="daily", compress="none"))
+    for day in range(4):
+        for i in range(24):
+            store.append("flow.csv", epoch_to_ts(T0 + day * 86400 + i * 3600), [i])
+    rec = store.get("flow.csv")
+    first, second, third = [path for _, path in rec.closed_segments()]
+
+    rows = rec.iter_rows()
+    stamps = [next(rows)[0]]
+    # the maintainer compresses the segment being read and one not opened yet
+    compress_file(first, "gzip")
+    compress_file(second, "gzip")
+    stamps.append(next(rows)[0])
+    os.remove(third)  # a segment deleted meanwhile is skipped
+    stamps += [row[0] for row in rows]
+    expected = [epoch_to_ts(T0 + day * 86400 + i * 3600) for day in (0, 1, 3) for i in range(24)]
+    assert stamps == expected
+
+
+@pytest.mark.parametrize("zone, fixed", [("UTC", True), ("Asia/Kolkata", True),
+                                         ("Europe/Paris", False), ("America/New_York", False)])
+def test_wall_clock_problem_in_daylight_saving_zones(monkeypatch, zone, fixed):
+    monkeypatch.setenv("TZ", zone)
+    time.tzset()
+    try:
+        problem = wall_clock_problem(T0)
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    assert (problem is None) == fixed
@@ -0,0 +1,72 @@
+# test_register_map.py
+# Unit tests of the snapshot read plan (no Modbus device needed):
+#   python -m pytest -q test_register_map.py
+import struct
+
+from modbus_worker import MAX_READ_COUNT, RegisterMap
+
+TUF2000 = [
+    {"name": "flow", "addr": 1, "format": "REAL4"},
+    {"name": "velocity", "addr": 5, "format": "REAL4"},
+    {"name": "pos_total", "addr": 9, "format": "LONG_REAL"},
+    {"name": "neg_total", "addr": 13, "format": "LONG_REAL"},
+    {"name": "net_total", "addr": 25, "format": "LONG_REAL"},
+    {"name": "error_code", "addr": 72, "format": "INTEGER"},
+    {"name": "signal_quality", "addr": 92, "format": "INTEGER"},
+]
+
+
+def plan(rmap):
+    return [(start, count, [name for name, _, _ in members]) for start, count, members in rmap.blocks]
+
+
+def test_close_fields_share_a_block():
+    assert plan(RegisterMap(TUF2000)) == [
+        (1, 28, ["flow", "velocity", "pos_total", "neg_total", "net_total"]),
+        (72, 21, ["error_code", "signal_quality"]),
+    ]
+
+
+def test_max_gap_zero_only_merges_adjacent_fields():
+    rmap = RegisterMap(TUF2000, max_gap=0)
+    assert [(start, count) for start, count, _ in rmap.blocks] == [
+        (1, 2), (5, 2), (9, 8), (25, 4), (72, 1), (92, 1)]
+
+
+def test_fields_are_sorted_by_address():
+    rmap = RegisterMap(list(reversed(TUF2000)))
+    assert rmap.names() == [f["name"] for f in TUF2000]
+    assert plan(rmap) == plan(RegisterMap(TUF2000))
+
+
+def test_blocks_stay_within_max_read_count():
+    fields = [{"name": f"r{i}", "addr": i * 20, "format": "REAL4"} for i in range(20)]
+    rmap = RegisterMap(fields)
+    assert all(count <= MAX_READ_COUNT for _, count, _ in rmap.blocks)
+    assert len(rmap.blocks) > 1
+    assert sum(len(members) for _, _, members in rmap.blocks) == 20
+
+
+def test_decode_uses_block_offsets():
+    rmap = RegisterMap(TUF2000)
+    blocks = []
+    for start, count, _ in rmap.blocks:
+        block = [0] * count
+        for name, addr, value in (("flow", 1, 2.5), ("net_total", 25, None),
+                                  ("error_code", 72, 7), ("signal_quality", 92, 85)):
+            if not start <= addr < start + count:
+                continue
+            offset = addr - start
+            if name == "flow":
+                block[offset:offset + 2] = struct.unpack("<2H", struct.pack("<f", value))
+            elif name == "net_total":
+                block[offset:offset + 4] = struct.unpack("<4H", struct.pack("<if", 100, 0.5))
+            else:
+                block[offset] = value
+        blocks.append(block)
+    record = rmap.decode(blocks)
+    assert record["flow"] == 2.5
+    assert record["net_total"] == 100.5
+    assert record["error_code"] == 7
+    assert record["signal_quality"] == 85
+    assert set(record) == set(rmap.names())
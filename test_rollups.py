@@ -0,0 +1,103 @@
+# test_rollups.py
+# Unit tests of the incremental rollups and their rebuild:
+#   python -m pytest -q test_rollups.py
+import threading
+
+from recordings import RecordingStore, epoch_to_ts, ts_to_epoch
+from rollups import RollupManager
+
+T0 = ts_to_epoch("2025-03-01 00:00:00")
+
+
+def fill(store, file, first, count, step=10):
+    for i in range(first, first + count):
+        store.append(file, epoch_to_ts(T0 + i * step), [float(i % 7)])
+
+
+def totals(manager, rec, tier):
+    rows = manager.query(rec, tier=tier)
+    return sum(r["count"] for r in rows), round(sum(r["integral"] for r in rows), 6)
+
+
+def test_incremental_matches_rebuild(tmp_path):
+    manager = RollupManager()
+    store = RecordingStore(str(tmp_path), rollups=manager)
+    fill(store, "flow.csv", 0, 2000)
+    rec = store.get("flow.csv")
+    incremental = {tier: totals(manager, rec, tier) for tier in ("1m", "1h", "1d")}
+    assert incremental["1h"][0] == 2000
+
+    assert manager.rebuild(rec) == 2000
+    assert {tier: totals(manager, rec, tier) for tier in ("1m", "1h", "1d")} == incremental
+
+
+def test_rebuild_does_not_block_nor_double_count_appends(tmp_path):
+    manager = RollupManager()
+    store = RecordingStore(str(tmp_path), rollups=manager)
+    fill(store, "flow.csv", 0, 20000)
+    rec = store.get("flow.csv")
+
+    done = threading.Event()
+    appended = []
+
+    def acquire():
+        # rows keep coming while the rebuild scans the raw file
+        i = 20000
+        while not done.is_set() or i < 20200:
+            fill(store, "flow.csv", i, 1)
+            appended.append(i)
+            i += 1
+
+    writer = threading.Thread(target=acquire)
+    writer.start()
+    manager.rebuild(rec)
+    done.set()
+    writer.join()
+    assert len(appended) >= 200
+
+    expected = 20000 + len(appended)
+    assert totals(manager, rec, "1h")[0] == expected
+    assert totals(manager, rec, "1m")[0] == expected
+    assert not manager.rebuilding(rec)
+    assert not list(tmp_path.glob("*.rebuild"))
+
+    # same tiers as a rebuild of the final data
+    reference = RollupManager()
+    reference.rebuild(rec)
+    for tier in ("1m", "1h", "1d"):
+        assert totals(manager, rec, tier) == totals(reference, rec, tier)
+
+
+def test_delete_discards_running_rebuild(tmp_path):
+    manager = RollupManager()
+    store = RecordingStore(str(tmp_path), rollups=manager)
+    fill(store, "flow.csv", 0, 500)
+    rec = store.get("flow.csv")
+    original = rec.iter_rows
+
+    def iter_then_delete(*args, **kwargs):
+        yield from original(*args, **kwargs)
+        store.delete("flow.csv")
+    rec.iter_rows = iter_then_delete
+    manager.rebuild(rec)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_tier_retention_drops_old_buckets(tmp_path):
+    manager = RollupManager(retention_days={"1m": 1})
+    store = RecordingStore(str(tmp_path), rollups=manager)
+    fill(store, "flow.csv", 0, 3 * 8640)  # three days of 10 s samples
+    rec = store.get("flow.csv")
+    hours = totals(manager, rec, "1h")
+    now = epoch_to_ts(T0 + 3 * 86400)
+
+    dropped = manager.apply_retention(rec, now=now)
+    assert dropped == 2 * 1440
+    buckets = [r["bucket"] for r in manager.query(rec, tier="1m", include_open=False)]
+    assert buckets[0] == epoch_to_ts(T0 + 2 * 86400)
+    assert (tmp_path / "flow.csv.rollup_1m").read_text().startswith("bucket,")
+    # other tiers are kept, appends go on in the rewritten file
+    assert totals(manager, rec, "1h") == hours
+    fill(store, "flow.csv", 3 * 8640, 100)
+    assert manager.query(rec, tier="1m", include_open=False)[-1]["bucket"] > buckets[-1]
+    assert manager.apply_retention(rec, now=now) == 0
@@ -0,0 +1,143 @@
+# test_worker_state.py
+# Unit tests of the worker state persistence (snapshot, journal, recovery);
+# the worker thread is never started and no Modbus device is needed:
+#   python -m pytest -q test_worker_state.py
+import json
+import os
+
+import pytest
+
+from callbacks import register_callback
+from modbus_worker import ModbusWorker, Task
+
+
+@register_callback("test_state_cb")
+def state_cb(value, timestamp, **kwargs):
+    pass
+
+
+def read_task(task_id, addr=1):
+    return Task(task_id=task_id, modbus_param={"op": "read", "addr": addr, "nbreg": 2, "format": "REAL4"},
+                callback=state_cb, parameters={"file": f"{task_id}.csv"}, recurrence=3600)
+
+
+def task_state(task_id, addr=1):
+    return {"task_id": task_id, "modbus_param": {"op": "read", "addr": addr, "nbreg": 2, "format": "REAL4"},
+            "parameters": {}, "recurrence": 3600, "urgent": False, "callback_name": "test_state_cb"}
+
+
+@pytest.fixture
+def make_worker(tmp_path):
+    workers = []
+
+    def make(**kwargs):
+        kwargs.setdefault("save_delay", 0)
+        worker = ModbusWorker(client=None, state_file=str(tmp_path / "TUFState"), **kwargs)
+        workers.append(worker)
+        return worker
+    yield make
+    for worker in workers:
+        worker.stop()
+
+
+def test_snapshot_round_trip(make_worker):
+    worker = make_worker()
+    worker.create_task(read_task("flow"))
+    worker.create_task(read_task("velocity", addr=5))
+    worker.delete_task(worker.tasks["flow"])
+    with open(worker.state_file) as f:
+        assert list(json.load(f)) == ["velocity"]
+    assert not os.path.exists(f"{worker.state_file}.tmp")
+
+    restored = make_worker()
+    restored.load_state()
+    assert list(restored.tasks) == ["velocity"]
+    assert restored.tasks["velocity"].modbus_param["addr"] == 5
+
+
+def test_saves_are_coalesced(make_worker):
+    worker = make_worker(save_delay=60)
+    for i in range(5):
+        worker.create_task(read_task(f"t{i}"))
+    assert not os.path.exists(worker.state_file)
+    worker.flush_state()
+    with open(worker.state_file) as f:
+        assert len(json.load(f)) == 5
+
+
+def test_journal_appends_then_folds_into_snapshot(make_worker):
+    worker = make_worker(journal=True, journal_limit=100)
+    worker.create_task(read_task("flow"))
+    worker.create_task(read_task("velocity"))
+    worker.delete_task(worker.tasks["flow"])
+    with open(worker.journal_file) as f:
+        assert [json.loads(line)["op"] for line in f] == ["create", "create", "delete"]
+    assert not os.path.exists(worker.state_file)
+
+    restored = make_worker(journal=True)
+    restored.load_state()
+    assert list(restored.tasks) == ["velocity"]
+    # the replayed journal is folded into a fresh snapshot
+    assert not os.path.exists(restored.journal_file)
+    with open(restored.state_file) as f:
+        assert list(json.load(f)) == ["velocity"]
+
+
+def test_journal_limit_rewrites_snapshot(make_worker):
+    worker = make_worker(journal=True, journal_limit=3)
+    for i in range(3):
+        worker.create_task(read_task(f"t{i}"))
+    assert not os.path.exists(worker.journal_file)
+    with open(worker.state_file) as f:
+        assert len(json.load(f)) == 3
+
+
+def test_replay_after_snapshot(make_worker):
+    worker = make_worker(journal=True)
+    with open(worker.state_file, "w") as f:
+        json.dump({"flow": task_state("flow"), "velocity": task_state("velocity", 5)}, f)
+    with open(worker.journal_file, "w") as f:
+        f.write(json.dumps({"op": "delete", "task_id": "flow"}) + "\n")
+        f.write(json.dumps({"op": "create", "task_id": "total", "task": task_state("total", 25)}) + "\n")
+    worker.load_state()
+    assert sorted(worker.tasks) == ["total", "velocity"]
+    assert worker.tasks["total"].modbus_param["addr"] == 25
+
+
+def test_torn_journal_tail_is_ignored(make_worker):
+    worker = make_worker(journal=True)
+    with open(worker.journal_file, "w") as f:
+        f.write(json.dumps({"op": "create", "task_id": "flow", "task": task_state("flow")}) + "\n")
+        # crash in the middle of the next append
+        f.write(json.dumps({"op": "create", "task_id": "velocity", "task": task_state("velocity")})[:30])
+    worker.load_state()
+    assert list(worker.tasks) == ["flow"]
+
+
+def test_unreadable_snapshot_is_moved_aside(make_worker):
+    worker = make_worker(journal=True)
+    with open(worker.state_file, "w") as f:
+        f.write('{"flow": {"task_id": "fl')
+    with open(worker.journal_file, "w") as f:
+        f.write(json.dumps({"op": "create", "task_id": "velocity", "task": task_state("velocity")}) + "\n")
+    worker.load_state()
+    with open(f"{worker.state_file}.corrupt") as f:
+        assert f.read() == '{"flow": {"task_id": "fl'
+    # the journal is still replayed and saved as the new snapshot
+    assert list(worker.tasks) == ["velocity"]
+    with open(worker.state_file) as f:
+        assert list(json.load(f)) == ["velocity"]
+
+
+def test_torn_only_journal_is_folded(make_worker):
+    worker = make_worker(journal=True)
+    with open(worker.journal_file, "w") as f:
+        f.write(json.dumps({"op": "create", "task_id": "flow", "task": task_state("flow")})[:30])
+    worker.load_state()
+    assert worker.tasks == {}
+    assert not os.path.exists(worker.journal_file)
+    # the next change starts a clean journal line and survives a restart
+    worker.create_task(read_task("velocity"))
+    restored = make_worker(journal=True)
+    restored.load_state()
+    assert list(restored.tasks) == ["velocity"]
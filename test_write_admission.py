@@ -0,0 +1,98 @@
+# test_write_admission.py
+# Unit tests of the keypad write admission (debounce, lease), on a fake clock:
+#   python -m pytest -q test_write_admission.py
+import pytest
+
+from write_admission import WriteAdmission
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def changes():
+    return []
+
+
+@pytest.fixture
+def keypad(clock, changes):
+    return WriteAdmission(debounce=0.4, lease=5.0, on_change=changes.append, clock=clock)
+
+
+def test_double_click_is_dropped_deliberate_repeat_is_sent(keypad, clock):
+    assert keypad.admit("a", (59, 1)).admitted
+    clock.now += 0.2  # second click of a double click
+    decision = keypad.admit("a", (59, 1))
+    assert not decision.admitted and decision.reason == "debounced"
+    assert decision.message
+    # typing "11" at a deliberate pace: the repeat after the window is sent
+    clock.now += 0.3
+    assert keypad.admit("a", (59, 1)).admitted
+    # another key right away is not a repeat
+    clock.now += 0.05
+    assert keypad.admit("a", (59, 2)).admitted
+    assert keypad.stats()["counts"] == {"ok": 3, "debounced": 1, "busy": 0}
+
+
+def test_other_session_is_refused_while_the_lease_runs(keypad, clock, changes):
+    assert keypad.admit("a", (59, 1)).admitted
+    assert changes == ["a"]
+    clock.now += 2.0
+    decision = keypad.admit("b", (59, 2))
+    assert not decision.admitted and decision.reason == "busy"
+    assert decision.retry_in == pytest.approx(3.0)
+    assert "retry in 3 s" in decision.message
+    # each admitted press renews the lease
+    assert keypad.admit("a", (59, 3)).admitted
+    clock.now += 4.0
+    assert keypad.admit("b", (59, 2)).reason == "busy"
+
+
+def test_lease_expiry_and_takeover(keypad, clock, changes):
+    keypad.admit("a", (59, 1))
+    clock.now += 5.0
+    assert keypad.admit("b", (59, 2)).admitted
+    assert keypad.holder == "b"
+    assert changes == ["a", "b"]
+
+
+def test_expiry_timer_releases_the_keypad(keypad, clock, changes):
+    keypad.admit("a", (59, 1))
+    clock.now += 3.0
+    keypad._expire()  # renewed meanwhile: nothing changes
+    assert keypad.holder == "a"
+    clock.now += 2.0
+    keypad._expire()
+    assert keypad.holder is None
+    assert changes == ["a", None]
+
+
+def test_release_on_disconnect(keypad, changes):
+    keypad.admit("a", (59, 1))
+    keypad.release("b")  # not the holder
+    assert keypad.holder == "a"
+    keypad.release("a")
+    assert keypad.holder is None
+    assert changes == ["a", None]
+    assert keypad.admit("b", (59, 2)).admitted
+
+
+def test_no_lease(clock):
+    keypad = WriteAdmission(debounce=0.4, lease=0, clock=clock)
+    assert keypad.admit("a", (59, 1)).admitted
+    # the debounce is per session: another operator's press is not a double click
+    clock.now += 0.1
+    assert keypad.admit("b", (59, 1)).admitted
+    clock.now += 0.1
+    assert keypad.admit("a", (59, 1)).reason == "debounced"
+    assert keypad.holder is None
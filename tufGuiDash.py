@@ -4,12 +4,22 @@ import os
 import time
 import struct
 import threading
-from dash import html, dcc, Input, Output, State, ctx
+from dash import html, dcc, Input, Output, State, ClientsideFunction
 from pymodbus.client.serial import ModbusSerialClient
 from modbus_worker import Task,ModbusWorker
-from callbacks import register_callback,auto_register_callbacks, CALLBACK_REGISTRY
+from callbacks import register_callback, CALLBACK_REGISTRY
 from layout import build_layout
-from flask_socketio import SocketIO
+from logging_setup import setup_logging
+from recordings import RecordingPolicy, RecordingStore, wall_clock_problem
+from rollups import RollupManager
+from export import export_response
+from bus_trace import TracingClient
+from bus_planner import Link, compare as compare_bus, plan as plan_bus, task_set, turnaround_from_stats
+from write_admission import WriteAdmission
+from analytics import SeriesLoader, summary as analytics_summary
+from config_reload import ConfigWatcher, key_generation, reload_tasks, restart_needed
+from flask_socketio import SocketIO, emit
+from flask import request, jsonify
 from dash import Dash
 import logging,sys
 import yaml, argparse
@@ -34,17 +44,16 @@ try:
 except FileNotFoundError:
     sys.exit(f"Config file not found: {CONFIG_PATH}")
 
+# Recordings are stamped with the local wall clock and must never go back
+clock_problem = wall_clock_problem()
+if clock_problem:
+    sys.exit(f"{clock_problem}; run the service in UTC (TZ=UTC, see systemd/tufgui.service)")
+
 #parameters
 data_path = config["data_path"]
 
-# Configure root logger
-logging.basicConfig(
-    level=logging.DEBUG,  # show everything, including debug()
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    stream=sys.stdout # send to standard output
-    #filename=config["log_file"],  # full path to log file
-    #filemode="a"  # append mode (use 'w' to overwrite each run)
-)
+# Configure root logger: level, rotating log_file from config, I/O off the worker thread
+log_listener = setup_logging(config)
 
 #Create a module-level logger
 logger = logging.getLogger(__name__)
@@ -59,6 +68,13 @@ client = ModbusSerialClient(**config["serial"])
 client.socket = ser  # Attach the serial connection manually
 client.connect()
 
+# Optional capture of the bus traffic (replay offline with: python bus_trace.py replay <file>)
+trace_config = config.get("bus_trace", {})
+if trace_config.get("enabled", False):
+    client = TracingClient(client, trace_config.get("file", os.path.join(data_path, "bus.trace")),
+                           max_bytes=int(trace_config.get("max_bytes", 50_000_000)))
+    logger.info(f"Recording bus traffic to {client.path}")
+
 # Define keyboard layout
 baseKeys = config["base_keys"]
 
@@ -69,6 +85,12 @@ composite_keys = config["composite_keys"]
 
 # Composite buttons
 action_keys = config["action_keys"]
+
+# sent back by the pages with every key event (indexes into the lists above)
+layout_generation = key_generation(baseKeys, functionKeys, composite_keys, action_keys)
+
+# Register maps read in one go by snapshot actions
+register_maps = config.get("register_maps", {})
 # Initialize Dash app
 app = Dash(__name__, suppress_callback_exceptions=True)
 socketio = SocketIO(app.server, cors_allowed_origins="*")
@@ -85,8 +107,33 @@ current_row = []
 # --- Tracking threads and states ---
 active_tasks = {} # key: index, value: threading.Event
 
+# Recorded channels and their minute/hour/day rollups
+rollup_config = config.get("rollups", {})
+rollups = RollupManager(max_gap=float(rollup_config.get("max_gap", 300)),
+                        retention_days=rollup_config.get("retention_days")) if rollup_config.get("enabled", True) else None
+recording_config = config.get("recordings", {})
+recordings = RecordingStore(data_path, rollups=rollups,
+                            index_every=int(recording_config.get("index_every", 1000)),
+                            policy=RecordingPolicy.from_config(recording_config))
+# per channel overrides: rotate/max_bytes/compress/retention_* keys of the action key
+for key in action_keys:
+    if key.get("file"):
+        recordings.set_policy(key["file"], RecordingPolicy.from_config(recording_config, key))
+
+# task starts/stops are pushed to the browsers (button colors)
+def push_task_state(op, task):
+    """Broadcast a periodic task start/stop: every open page recolors its button."""
+    socketio.emit("task_state", {"task_id": task.task_id, "active": op == "create"})
+
 #define worker but do not start items
-worker = ModbusWorker(client,state_file=os.path.join(data_path, "TUFState"))
+state_config = config.get("state", {})
+worker = ModbusWorker(
+    client,
+    state_file=os.path.join(data_path, "TUFState"),
+    save_delay=float(state_config.get("save_delay", 1.0)),
+    journal=bool(state_config.get("journal", False)),
+    on_task_change=push_task_state,
+)
 
 # Custom HTML template to include the Socket.IO client library
 app.index_string = """
@@ -111,8 +158,139 @@ app.index_string = """
 </html>
 """
 
-# Build App layout
-app.layout = build_layout(baseKeys, functionKeys, composite_keys, action_keys)
+# Build App layout: a function, so that new page loads get the keys of the
+# last config reload (built once per reload, then served from the cache)
+_layout_cache = {}
+def serve_layout():
+    layout = _layout_cache.get("layout")
+    if layout is None:
+        layout = _layout_cache["layout"] = build_layout(
+            baseKeys, functionKeys, composite_keys, action_keys, generation=layout_generation,
+            show_latency=bool(config.get("ui", {}).get("key_latency", False)))
+    return layout
+
+app.layout = serve_layout
+
+def export_channels():
+    """Files of the recording keys: the only files of data_path served by /export
+    and /rollups (other files, e.g. TUFState, are never scanned nor given sidecars)."""
+    return {key["file"] for key in action_keys
+            if key.get("action") in ("record", "snapshot") and key.get("file")}
+
+#-----------rollup queries: /rollups/<file>?tier=1h&start=...&end=...&column=...------
+@app.server.route("/rollups/<file>")
+def rollups_query(file):
+    if rollups is None:
+        return jsonify(error="rollups are disabled"), 404
+    if file not in export_channels():
+        return jsonify(error=f"unknown channel: {file}"), 404
+    args = request.args
+    try:
+        rows = rollups.query(recordings.get(file), tier=args.get("tier", "1h"),
+                             start=args.get("start"), end=args.get("end"), column=args.get("column"))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(rows)
+
+
+@app.server.route("/rollups/<file>/rebuild", methods=["POST"])
+def rollups_rebuild(file):
+    if rollups is None:
+        return jsonify(error="rollups are disabled"), 404
+    if file not in export_channels():
+        return jsonify(error=f"unknown channel: {file}"), 404
+    # scanned on a background thread, acquisition goes on meanwhile
+    try:
+        started = rollups.rebuild_async(recordings.get(file))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if not started:
+        return jsonify(error=f"rollups of {file} are already being rebuilt"), 409
+    return jsonify(file=file, rebuilding=True), 202
+
+
+#-----------streaming export: /export?channel=<file>&start=...&end=...&format=csv|ndjson&gzip=1------
+@app.server.route("/export")
+def export_data():
+    return export_response(recordings, request.args, request.headers, channels=export_channels())
+
+#-----------volumes integrated from the recorded flows, reconciled with the totalisers------
+analytics_config = config.get("analytics", {})
+series = SeriesLoader(recordings, cache_bytes=int(analytics_config.get("cache_bytes", 256_000_000)))
+
+def analytics_channels():
+    """Flow channels of the action keys: record keys ("value" column) and snapshot
+    keys whose map has a "flow" field (reconciled with its "net_total" field).
+    A `totaliser: "<file>:<column>"` key field sets/overrides the totaliser."""
+    channels = []
+    for key in action_keys:
+        file = key.get("file")
+        if not file:
+            continue
+        if key.get("action") == "record":
+            channel = {"label": key.get("label", file), "file": file}
+        elif key.get("action") == "snapshot":
+            names = [f["name"] for f in register_maps.get(key.get("map"), [])]
+            if "flow" not in names:
+                continue
+            channel = {"label": key.get("label", file), "file": file, "column": "flow"}
+            if "net_total" in names:
+                channel["totaliser"] = f"{file}:net_total"
+        else:
+            continue
+        if key.get("totaliser"):
+            channel["totaliser"] = key["totaliser"]
+        if os.path.exists(os.path.join(data_path, file)) or recordings.get(file).closed_segments():
+            channels.append(channel)
+    return channels
+
+
+def volume_summary(start=None, end=None, bucket=None):
+    return analytics_summary(series, analytics_channels(), start=start, end=end,
+                             max_gap=float(analytics_config.get("max_gap", 300)),
+                             unit_seconds=float(analytics_config.get("flow_unit_seconds", 3600)),
+                             bucket=bucket)
+
+
+@app.server.route("/analytics/summary")
+def analytics_query():
+    args = request.args
+    bucket = int(args["bucket"]) if args.get("bucket") else None
+    return jsonify(volume_summary(args.get("start"), args.get("end"), bucket))
+
+
+def _fmt_number(x, fmt="{:.3f}"):
+    return "" if x is None else fmt.format(x)
+
+
+@app.callback(
+    Output("analytics-summary", "children"),
+    Input("analytics-period", "value"),
+    Input("analytics-refresh", "n_clicks"),
+)
+def update_analytics_panel(days, n_clicks):
+    start = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() - int(days or 1) * 86400))
+    rows = volume_summary(start=start)
+    if not rows:
+        return "no recorded flow"
+    header = html.Tr([html.Th(h) for h in ("channel", "volume", "mean flow", "coverage", "gaps",
+                                            "totaliser", "difference")])
+    lines = []
+    for r in rows:
+        rec = r.get("reconciliation") or {}
+        coverage = r.get("coverage")
+        lines.append(html.Tr([
+            html.Td(r["label"]),
+            html.Td(r.get("error") or _fmt_number(r.get("volume"))),
+            html.Td(_fmt_number(r.get("mean_flow"))),
+            html.Td("" if coverage is None else f"{coverage:.1%}"),
+            html.Td(r.get("gaps", "")),
+            html.Td(_fmt_number(rec.get("totaliser"))),
+            html.Td("" if rec.get("difference") is None else
+                    _fmt_number(rec["difference"]) + ("" if rec.get("relative") is None
+                                                      else f" ({rec['relative']:+.2%})")),
+        ]))
+    return html.Table([header] + lines, style={"borderSpacing": "10px 2px"})
 
 #-----------callback callled after modbus write----------------
 @register_callback("record_and_log")
@@ -124,15 +302,36 @@ def record_and_log(task_id, value, timestamp, **kwargs):
         return "inactive"
     target_id = kwargs.get("target_id")
     file = kwargs.get("file")
-    logger.debug(f"; record_and_log: task_id={task_id},timestamp:{timestamp},target_id= {target_id},value={value},file:{file}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("record_and_log: task_id=%s timestamp=%s target_id=%s value=%s file=%s",
+                     task_id, timestamp, target_id, value, file)
     
-    ## write data to a task specific log file
+    ## write data to a task specific log file (and its rollups)
     try:
-        os.makedirs(data_path, exist_ok=True)
-        file_path = os.path.join(data_path, f"{file}")
+        recordings.append(file, timestamp, [value])
+
+    except Exception as e:
+        logger.error(f"Failed to write data for task {task_id}: {e}")
+
+    log_to_browser(task_id, value, timestamp, **kwargs)
+
+
+@register_callback("record_snapshot")
+def record_snapshot(task_id, value, timestamp, **kwargs):
+    # value is one record {field name: value} read by a snapshot task
+    missing = [k for k in ( "target_id","file","fields") if kwargs.get(k) is None]
+    if missing:
+        logger.error(f"[record_snapshot] Missing parameters {missing} for task id '{task_id}'")
+        return "inactive"
+    file = kwargs.get("file")
+    fields = kwargs.get("fields")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("record_snapshot: task_id=%s timestamp=%s value=%s file=%s",
+                     task_id, timestamp, value, file)
 
-        with open(file_path, "a", encoding="utf-8") as f:
-            f.write(f"{timestamp},{value}\n")
+    ## write the record as one csv row, with a header line for new files
+    try:
+        recordings.append(file, timestamp, [value.get(name) for name in fields], columns=fields)
 
     except Exception as e:
         logger.error(f"Failed to write data for task {task_id}: {e}")
@@ -143,7 +342,9 @@ def record_and_log(task_id, value, timestamp, **kwargs):
 @register_callback("log_to_browser")
 def log_to_browser(task_id, value, timestamp, **kwargs):
     target_id = kwargs.get("target_id")
-    logger.debug(f"; log_to_browser: task_id={task_id},timestamp:{timestamp},target_id= {target_id},value={value}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("log_to_browser: task_id=%s timestamp=%s target_id=%s value=%s",
+                     task_id, timestamp, target_id, value)
     # now send status line to be displayed in the browser
     message = {
         "target_id": target_id,
@@ -151,65 +352,115 @@ def log_to_browser(task_id, value, timestamp, **kwargs):
     }
     # Send this to the client (frontend) through a socket
     socketio.emit("update_element", message)
-#--------------record action; create or stop task------------------------
-def record_action(index, **params):
+#--------------task of an action key (record / snapshot)------------------------
+def action_task_id(key):
+    return f"{key.get('label', '').replace(' ', '_')}"
 
+
+def record_task(index, **params):
+    """Periodic read task of a record key; None if the key is invalid."""
     # Validate required params
     required = ("label", "addr", "nbReg", "format", "recurrence")
     missing = [k for k in required if params.get(k) is None]
     if missing:
         logger.error(f"[record_action] Missing parameters {missing} for record button '{index}'")
+        return None
+    # all params except the required ones
+    extra_params = {k: v for k, v in params.items() if k not in required}
+    return Task(
+        task_id=action_task_id(params),
+        modbus_param={
+            "op": "read",
+            "addr": int(params.get("addr")),
+            "nbreg": int(params.get("nbReg")),
+            "format": params.get("format")
+        },
+        recurrence=float(params.get("recurrence")),
+        callback=record_and_log,
+        parameters={"target_id": f"status_{index}"}|extra_params
+    )
+
+
+def snapshot_task(index, **params):
+    """Periodic register map task of a snapshot key; None if the key is invalid."""
+    # Validate required params
+    required = ("label", "map", "recurrence", "file")
+    missing = [k for k in required if params.get(k) is None]
+    if missing:
+        logger.error(f"[snapshot_action] Missing parameters {missing} for snapshot button '{index}'")
+        return None
+    map_name = params.get("map")
+    fields = register_maps.get(map_name)
+    if not fields:
+        logger.error(f"[snapshot_action] Unknown register map '{map_name}' for button '{params.get('label')}'")
+        return None
+    # all the map fields in one record
+    extra_params = {k: v for k, v in params.items() if k not in ("map", "recurrence", "max_gap")}
+    modbus_param = {"op": "snapshot", "fields": fields}
+    if params.get("max_gap") is not None:
+        modbus_param["max_gap"] = int(params["max_gap"])
+    return Task(
+        task_id=action_task_id(params),
+        modbus_param=modbus_param,
+        recurrence=float(params.get("recurrence")),
+        callback=record_snapshot,
+        parameters={"target_id": f"status_{index}", "fields": [f["name"] for f in fields]}|extra_params
+    )
+#--------------record action; create or stop task------------------------
+def record_action(index, **params):
+    task = record_task(index, **params)
+    if task is None:
         return "inactive"
     label = params.get("label", f"button_{index}")
-    addr = params.get("addr")
-    nbReg = params.get("nbReg")
-    format = params.get("format")
-    recurrence = params.get("recurrence")
-    task_id = f"{label.replace(' ', '_')}"
 
     #now see if needed to start or stop a task
-    if task_id in worker.tasks:
+    if task.task_id in worker.tasks:
         # Stop existing task
-        worker.delete_task(worker.tasks[task_id])
+        worker.delete_task(worker.tasks[task.task_id])
         logger.info(f"[record_action] Stopped recording: {label}")
         return "inactive"
 
     # Start a new recording task
-    # all params except the required ones
-    extra_params = {k: v for k, v in params.items() if k not in required}
-    task = Task(
-        task_id=task_id,
-        modbus_param={
-            "op": "read",
-            "addr": int(addr),
-            "nbreg": int(nbReg),
-            "format": format
-        },
-        recurrence=float(recurrence),
-        callback=record_and_log,
-        parameters={"target_id": f"status_{index}"}|extra_params
-    )
     worker.create_task(task)
-    logger.debug(f"[record_action] created task: {task_id}; parameters:{task.parameters}")
+    logger.debug(f"[record_action] created task: {task.task_id}; parameters:{task.parameters}")
     logger.info (f"[record_action] Started recording: {label}")
     return "active"
+#--------------snapshot action; create or stop a register map task----------
+def snapshot_action(index, **params):
+    task = snapshot_task(index, **params)
+    if task is None:
+        return "inactive"
+    label = params.get("label", f"button_{index}")
+
+    #now see if needed to start or stop a task
+    if task.task_id in worker.tasks:
+        worker.delete_task(worker.tasks[task.task_id])
+        logger.info(f"[snapshot_action] Stopped snapshot: {label}")
+        return "inactive"
+
+    # Start a new snapshot task
+    worker.create_task(task)
+    logger.info (f"[snapshot_action] Started snapshot: {label}, {len(task.register_map.blocks)} block read(s) for {len(task.modbus_param['fields'])} fields")
+    return "active"
 #-----------callback to delete a record file------------------
 def deleteFile_action(index, **params):
+    label = params.get("label", f"button_{index}")
     # Validate required params
     missing = [k for k in ("label","file") if params.get(k) is None]
     if missing:
-        logger.error(f"[record_action] Missing parameters {missing} for button '{label}'")
+        logger.error(f"[deleteFile_action] Missing parameters {missing} for button '{label}'")
         return "inactive"
     file= params.get("file")
-    label = params.get("label", f"button_{index}")
 
     if not file:
         logger.error(f"[deleteFile_action] Missing 'file' parameter for button '{label}'")
         return "inactive"
     file_path = os.path.join(data_path, file)
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        existed = os.path.exists(file_path)
+        # raw file and derived data (rollups)
+        recordings.delete(file)
+        if existed:
             logger.info(f"[deleteFile_action] Deleted file: {file_path}")
         else:
             logger.warning(f"[deleteFile_action] File not found: {file_path}")
@@ -217,43 +468,120 @@ def deleteFile_action(index, **params):
         logger.error(f"[deleteFile_action] Error deleting file '{file_path}': {e}")
 
     return "inactive"
-#-----------Callback for base and function button press----------
-@app.callback(
-    Output("response", "children"),
+#-----------key presses: sent by the browser over the socket (acknowledged)----------
+# clientside callbacks (assets/clientside.js) emit the presses and color the
+# record buttons from the task state pushed by push_task_state(): no Dash
+# request, and constant server work per press
+app.clientside_callback(
+    ClientsideFunction(namespace="tuf", function_name="sendKey"),
+    Output("key-sent", "data"),
     Input({'group': dash.ALL, 'index': dash.ALL}, 'n_clicks'),
+    Input({'type': 'composite', 'index': dash.ALL}, 'n_clicks'),
+    Input({'type': 'rec-btn', 'index': dash.ALL}, 'n_clicks'),
+    State("layout-generation", "data"),
     prevent_initial_call=True
 )
-def on_base_or_function_key_press(n_clicks):
-    triggered = dash.callback_context.triggered_id
-    if not triggered:
-        return ""
-    group = triggered["group"]
-    index = triggered["index"]
-    if group == 'base':
-        key = baseKeys[index]
-    else:
-        key = functionKeys[index]
+
+app.clientside_callback(
+    ClientsideFunction(namespace="tuf", function_name="buttonStyles"),
+    Output({'type': 'rec-btn', 'index': dash.ALL}, 'style'),
+    Input("task-state", "data"),
+    Input("action-task-ids", "data"),
+    State({'type': 'rec-btn', 'index': dash.ALL}, 'style'),
+)
+
+RELOAD_PAGE = {"target_id": "response", "message": "Keys changed by a config reload: reload the page"}
+
+def stale_page(data):
+    """True when a key event comes from a page built before the last key change.
+
+    Events carry indexes into the key lists: after a reload that reordered
+    them, the same index names another key (another register, another file).
+    """
+    return not isinstance(data, dict) or data.get("generation") != layout_generation
+
+# keypad writes: double clicked keys are dropped, one operator (socket session)
+# holds the keypad at a time and the other pages are told it is busy; refused
+# presses are answered in the keypad status line of the page
+def keypad_lease_changed(holder):
+    socketio.emit("keypad_busy", {"holder": holder})
+
+keypad_config = config.get("keypad", {})
+keypad = WriteAdmission(debounce=float(keypad_config.get("debounce", 0.4)),
+                        lease=float(keypad_config.get("lease", 5.0)),
+                        on_change=keypad_lease_changed)
+
+
+@app.server.route("/stats/keypad")
+def keypad_stats():
+    return jsonify(keypad.stats())
+
+
+# bus occupancy of the running tasks: worker timings next to the planner model
+# (turnaround calibrated on the timings); python bus_planner.py --live <url> prints it
+@app.server.route("/stats/bus")
+def bus_stats():
+    measured = worker.stats.snapshot()
+    settings = config.get("bus_planner", {})
+    tasks = task_set(config, worker.get_active_task_ids())
+    link = Link.from_config(config)
+    calibrated = turnaround_from_stats(measured["per_task"], tasks, link)
+    if calibrated is not None:
+        link.turnaround = calibrated
+    model = plan_bus(tasks, link, target=float(settings.get("target", 0.7)),
+                     keypad_rate=float(settings.get("keypad_rate", 0.0)))
+    return jsonify(measured=measured, model=model, comparison=compare_bus(model, measured))
+
+
+@socketio.on("connect")
+def on_connect():
+    # full task state for the new page, then only changes
+    emit("task_state", {"active": worker.get_active_task_ids()})
+    emit("keypad_busy", {"holder": keypad.holder})
+
+
+@socketio.on("disconnect")
+def on_disconnect(*args):
+    keypad.release(request.sid)
+
+
+@socketio.on("key_press")
+def on_base_or_function_key_press(data):
+    if stale_page(data):
+        return RELOAD_PAGE
+    group, index = data.get("group"), data.get("index")
+    keys = baseKeys if group == 'base' else functionKeys
+    if not isinstance(index, int) or not 0 <= index < len(keys):
+        return RELOAD_PAGE
+    key = keys[index]
     reg, val = key["reg"], key["val"]
+    decision = keypad.admit(request.sid, (reg, val))
+    if not decision.admitted:
+        return {"ok": False, "target_id": "keypad-status", "message": decision.message}
     logger.debug(f"; on_base_or_function_key_press addr= {reg}, value={val}")
-    #create a one time task to perform this
+    #create a one time task to perform this, ahead of the periodic reads
     task = Task(
         task_id=f"write_{group}_{index}",
         modbus_param={"op": "write", "addr": reg-1, "value": val},
         callback=log_to_browser,
         parameters={"target_id": "response"},  # element to update
+        urgent=True,
     )
     worker.create_task(task)
-
-#---------call back for composite buttons (key sequence)------------
-@app.callback(
-    Output("response", "children", allow_duplicate=True),
-    Input({'type': 'composite', 'index': dash.ALL}, 'n_clicks'),
-    prevent_initial_call=True
-)
-def on_composite_key_pressed(n_clicks):
-    triggered = ctx.triggered_id
-    index = triggered["index"]
+    return {"ok": True, "target_id": "keypad-status", "message": ""}
+
+#---------composite buttons (key sequence)------------
+@socketio.on("composite_key")
+def on_composite_key_pressed(data):
+    if stale_page(data):
+        return RELOAD_PAGE
+    index = data.get("index")
+    if not isinstance(index, int) or not 0 <= index < len(composite_keys):
+        return RELOAD_PAGE
     composite = composite_keys[index]
+    decision = keypad.admit(request.sid, ("composite", index))
+    if not decision.admitted:
+        return {"ok": False, "target_id": "keypad-status", "message": decision.message}
 
     output_log = []
 
@@ -267,80 +595,129 @@ def on_composite_key_pressed(n_clicks):
                 modbus_param={"op": "write", "addr": reg- 1, "value": val},
                 callback=log_to_browser,
                 parameters={"target_id": "response"},  # element to update
+                urgent=True,
             )
             worker.create_task(task)
+            output_log.append(key["label"])
 
-    return "Composite Sent:<br>" + "<br>".join(output_log)
+    return {"target_id": "response", "message": "Composite Sent: " + ", ".join(output_log)}
 
- #--- Callback to update button colors and perform  recording  actions  for register keys ---
-@app.callback(
-    Output({'type': 'rec-btn', 'index': dash.ALL}, 'style'),
-    Input("url", "pathname"),  # Fires on page load
-    Input({'type': 'rec-btn', 'index': dash.ALL}, 'n_clicks'),  # Fires on clicks
-    prevent_initial_call=False
-)
-def handle_actions_buttons(pathname, n_clicks_list):
-    
-    # callback handles both:initializing button colors at page load
-    # and toggling a recording task when a button is clicked
-    # Base styles (default colors)
-    
-    styles = [{"backgroundColor": "lightgray"} for _ in action_keys]
-
-    # --- Determine what triggered this callback ---
-    trigger = ctx.triggered_id
-
-    # --- Handle button click to manage associated tasks  ---
-    if isinstance(trigger, dict) and trigger.get("type") == "rec-btn":
-        index = trigger["index"]
-        key = action_keys[index]
-        label = key.get("label", f"button_{index}")
-
-        action = key.get("action")
-        if not action:
-            logger.error(f"[handle_rec_buttons] Missing 'action' key for button '{label}'.")
-            return styles
-
-        # Build the function name dynamically
-        func_name = f"{action}_action"
-        action_func = globals().get(func_name)
-
-        if not callable(action_func):
-            logger.error(f"[handle_rec_buttons] No handler found for action '{action}' (expected function '{func_name}').")
-            return styles
-
-        # Prepare arguments: pass all key fields except 'action'
-        params = {k: v for k, v in key.items() if k != "action"}
-
-        try:
-            logger.debug(f"[handle_rec_buttons] Executing action '{action}' for '{label}' with params={params}")
-            result = action_func(index=index, **params)  # Call dynamically
-        except Exception as e:
-            logger.error(f"[handle_rec_buttons] Error executing action '{action}' for '{label}': {e}")
-            return styles
-
-    #refresh the style of all the buttons
-    #this part is executed when the page load of when a button is pressed
-    active_ids = worker.get_active_task_ids()
-    queue_size = worker.queue_size()
-    logger.debug(f"[handle_rec_buttons] active_ids: {active_ids} ; worker queue size:{queue_size}")
-    for i, key in enumerate(action_keys):
-        task_id = f"{key['label'].replace(' ', '_')}"
-        if task_id in active_ids:
-            logger.debug(f"[handle_rec_buttons] action key: {task_id} is green ")
-            styles[i] = {"backgroundColor": "lightgreen"}
-        else:
-            styles[i] = {"backgroundColor": "lightgray"}
-    return styles
+#--- record actions for action keys; button colors follow push_task_state() ---
+@socketio.on("action_key")
+def on_action_key(data):
+    if stale_page(data):
+        return RELOAD_PAGE
+    index = data.get("index")
+    if not isinstance(index, int) or not 0 <= index < len(action_keys):
+        return RELOAD_PAGE
+    key = action_keys[index]
+    label = key.get("label", f"button_{index}")
+
+    action = key.get("action")
+    if not action:
+        logger.error(f"[handle_rec_buttons] Missing 'action' key for button '{label}'.")
+        return {"ok": False}
+
+    # Build the function name dynamically
+    func_name = f"{action}_action"
+    action_func = globals().get(func_name)
+
+    if not callable(action_func):
+        logger.error(f"[handle_rec_buttons] No handler found for action '{action}' (expected function '{func_name}').")
+        return {"ok": False}
+
+    # Prepare arguments: pass all key fields except 'action'
+    params = {k: v for k, v in key.items() if k != "action"}
+
+    try:
+        logger.debug(f"[handle_rec_buttons] Executing action '{action}' for '{label}' with params={params}")
+        result = action_func(index=index, **params)  # Call dynamically
+    except Exception as e:
+        logger.error(f"[handle_rec_buttons] Error executing action '{action}' for '{label}': {e}")
+        return {"ok": False}
+    return {"ok": True, "state": result}
+
+#-----------hot reload of config.yaml (file watch or POST /config/reload)------------------
+reload_lock = threading.Lock()
+
+def build_action_task(index, key):
+    """Periodic task of an action key ({action}_task builder); None without one."""
+    builder = globals().get(f"{key.get('action')}_task")
+    params = {k: v for k, v in key.items() if k != "action"}
+    return builder(index=index, **params) if callable(builder) else None
+
+def apply_config(new_config):
+    """Apply a new configuration in place; the bus connection and data files stay open.
+
+    Key lists and register maps are updated in place (callbacks see them at
+    once, new page loads get a rebuilt layout and a new generation, so that
+    the key events of older pages are rejected), recording policies are
+    replaced, and only the running tasks whose key or register map changed
+    are rescheduled, restarted under a new label or stopped (reload_tasks()).
+    """
+    global config, recording_config, analytics_config, layout_generation
+    with reload_lock:
+        restart = restart_needed(config, new_config)
+        if restart:
+            logger.warning(f"[apply_config] Changes of {restart} need a service restart")
+        old_action_keys = list(action_keys)
+        old_maps = dict(register_maps)
+
+        baseKeys[:] = new_config["base_keys"]
+        functionKeys[:] = new_config["function_keys"]
+        composite_keys[:] = new_config.get("composite_keys") or []
+        action_keys[:] = new_config["action_keys"]
+        register_maps.clear()
+        register_maps.update(new_config.get("register_maps", {}))
+        layout_generation = key_generation(baseKeys, functionKeys, composite_keys, action_keys)
+        _layout_cache.clear()
+
+        level = logging.getLevelName(str(new_config.get("log_level", "INFO")).upper())
+        if isinstance(level, int):
+            logging.getLogger().setLevel(level)
+
+        recording_config = new_config.get("recordings", {})
+        analytics_config = new_config.get("analytics", {})
+        series.cache_bytes = int(analytics_config.get("cache_bytes", 256_000_000))
+        keypad_settings = new_config.get("keypad", {})
+        keypad.debounce = float(keypad_settings.get("debounce", 0.4))
+        keypad.lease = float(keypad_settings.get("lease", 5.0))
+        recordings.policy = RecordingPolicy.from_config(recording_config)
+        for key in action_keys:
+            if key.get("file"):
+                recordings.set_policy(key["file"], RecordingPolicy.from_config(recording_config, key))
+
+        # running tasks of removed keys are stopped, renamed ones restarted under
+        # their new id, those of changed keys rescheduled
+        tasks = reload_tasks(worker, old_action_keys, action_keys, old_maps, register_maps,
+                             action_task_id, build_action_task)
+
+        config = new_config
+        summary = dict(tasks, restart_needed=restart)
+        logger.info(f"[apply_config] Configuration reloaded: {summary}")
+        return summary
+
+
+reload_config = config.get("reload", {})
+config_watcher = ConfigWatcher(CONFIG_PATH, apply_config, interval=float(reload_config.get("interval", 2.0)))
+
+
+@app.server.route("/config/reload", methods=["POST"])
+def config_reload():
+    try:
+        return jsonify(config_watcher.reload())
+    except Exception as e:
+        logger.error(f"Config reload failed, keeping the running configuration: {e}")
+        return jsonify(error=str(e)), 400
 
 
-        
-        
-# 1️⃣ Automatically register all callbacks from your callbacks module
+# Callbacks are registered explicitly with @register_callback:
 # this create association betwen callbacks names and calback functions
 #needed to save and restore worker states
-auto_register_callbacks(globals())
 print("Registered callbacks at startup:", CALLBACK_REGISTRY.keys())
+recordings.start_maintenance()
+if reload_config.get("watch", True):
+    config_watcher.start()
 worker.start()
 
 # Run server
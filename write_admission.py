@@ -0,0 +1,125 @@
+"""
+write_admission.py
+------------------
+Admission of the interactive keypad writes sent by the browsers.
+
+- debounce: a write identical to one the same session had admitted less
+  than `debounce` seconds ago is dropped and answered as such: browser
+  double clicks come 100-500 ms apart. A deliberate repeat (typing "11")
+  goes through once the window is over;
+- lease: the keypad belongs to one session (socket id) at a time. Each
+  admitted press renews the lease, which expires `lease` seconds after the
+  last one; meanwhile the presses of the other sessions are refused, so
+  two operators never interleave keystrokes in the meter menus;
+- on_change(holder) is called when the lease is taken, changes hands or is
+  released (holder None), to tell the browsers that the keypad is busy.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Decision(NamedTuple):
+    admitted: bool
+    reason: str                 # "ok", "debounced" or "busy"
+    retry_in: float = 0.0       # seconds until the lease of another session expires
+
+    @property
+    def message(self) -> str:
+        if self.reason == "busy":
+            return f"Keypad in use by another operator, retry in {self.retry_in:.0f} s"
+        if self.reason == "debounced":
+            return "Repeated key ignored (double click): wait a moment to press it again"
+        return ""
+
+
+class WriteAdmission:
+    """Debounce of a session's identical writes and keypad lease of one session at a time."""
+    def __init__(self, debounce: float = 0.4, lease: float = 5.0,
+                 on_change: Optional[Callable[[Optional[str]], None]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.debounce = debounce
+        self.lease = lease
+        self.on_change = on_change
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.holder: Optional[str] = None
+        self.expires = 0.0
+        self._last: Dict[Hashable, float] = {}   # (session, write key) → time admitted
+        self._timer: Optional[threading.Timer] = None
+        self.counts = {"ok": 0, "debounced": 0, "busy": 0}
+
+    def admit(self, session: str, key: Hashable) -> Decision:
+        """Decide on a write `key` (e.g. (register, value)) pressed by `session`."""
+        changed = False
+        with self.lock:
+            now = self.clock()
+            if self.holder is not None and now >= self.expires:
+                self.holder = None
+                changed = True
+            if self.lease > 0 and self.holder is not None and self.holder != session:
+                decision = Decision(False, "busy", self.expires - now)
+            elif now - self._last.get((session, key), float("-inf")) < self.debounce:
+                decision = Decision(False, "debounced")
+            else:
+                decision = Decision(True, "ok")
+                self._last[(session, key)] = now
+                if len(self._last) > 256:
+                    self._last = {k: t for k, t in self._last.items() if now - t < self.debounce}
+                if self.lease > 0:
+                    changed |= self.holder != session
+                    self.holder = session
+                    self.expires = now + self.lease
+                    self._arm_timer(self.lease)
+            self.counts[decision.reason] += 1
+            holder = self.holder
+        if changed:
+            self._notify(holder)
+        return decision
+
+    def release(self, session: str):
+        """Give the lease back (the session disconnected)."""
+        with self.lock:
+            if self.holder != session:
+                return
+            self.holder = None
+        self._notify(None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"holder": self.holder, "counts": dict(self.counts),
+                    "debounce": self.debounce, "lease": self.lease}
+
+    def _arm_timer(self, delay: float):
+        """Call _expire() after `delay` seconds (one pending timer). Call with self.lock held."""
+        if self._timer is not None:
+            return
+        self._timer = threading.Timer(delay, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _expire(self):
+        with self.lock:
+            self._timer = None
+            if self.holder is None:
+                return
+            remaining = self.expires - self.clock()
+            if remaining > 0:
+                # renewed meanwhile
+                self._arm_timer(remaining)
+                return
+            self.holder = None
+        self._notify(None)
+
+    def _notify(self, holder: Optional[str]):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(holder)
+        except Exception as e:
+            logger.error(f"Keypad lease listener error: {e}")